@@ -1,5 +1,5 @@
 from datetime import timedelta
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, status, Request
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from pydantic import BaseModel
 from typing import Optional
@@ -12,6 +12,7 @@ from utils.auth import (
 
 router = APIRouter(prefix="/auth", tags=["authentication"])
 security = HTTPBearer()
+optional_security = HTTPBearer(auto_error=False)
 
 class LoginRequest(BaseModel):
     username: str
@@ -30,6 +31,20 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
     user_data = get_current_user_from_token(credentials.credentials)
     return User(**user_data)
 
+async def get_stream_user(
+    request: Request,
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security)
+) -> User:
+    """Like get_current_user, but also accepts the access_token cookie, since EventSource can't set headers"""
+    token = credentials.credentials if credentials else request.cookies.get("access_token")
+    if not token:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Not authenticated",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return User(**get_current_user_from_token(token))
+
 @router.post("/login", response_model=Token)
 async def login(login_data: LoginRequest):
     user = authenticate_user(login_data.username, login_data.password)
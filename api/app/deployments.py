@@ -1,23 +1,60 @@
+import os
+import re
+import json
+import base64
+import time
+import hashlib
 import asyncio
-from fastapi import APIRouter, Depends, HTTPException, status, BackgroundTasks
-from typing import List
-from pydantic import BaseModel
-from app.auth import get_current_user, User
+from datetime import datetime, timezone
+from fastapi import APIRouter, Depends, HTTPException, status, BackgroundTasks, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from typing import Dict, List, Optional
+from pydantic import BaseModel, Field
+from app.auth import get_current_user, get_stream_user, User
+from app.fast_json import fast_json_enabled, json_response, json_array_response
 from models import (
     get_database, 
+    mark_deployments_changed,
+    get_deployments_version,
+    deployment_cache,
     DeploymentModel, 
     DeploymentCreate, 
     DeploymentResponse,
     DeploymentStatus,
-    BuildLogModel
+    BuildLane,
+    LogLevel,
+    ResourceProfile,
+    PlacementConstraints,
+    ProxySettings,
+    PyObjectId
 )
 from services import (
-    DockerService,
     NginxService, 
     CloudflareService,
     PortService,
-    CleanupService
+    CleanupService,
+    CapacityService,
+    PlacementScheduler,
+    NodeService,
+    HibernationService,
+    ReplicaService,
+    PipelineTimeline,
+    TimelineService,
+    LogService,
+    ReconcileService,
+    BuildScheduler,
+    BuildQuotaExceeded,
+    event_bus,
+    runtime_logs,
+    TooManyLogStreams,
+    stats_sampler
 )
+from services.metrics import STAGE_DURATION, DEPLOY_OUTCOMES
+from services.timeline_service import span
+from services.log_service import write_log
+from services.stats_service import STAT_FIELDS
+from services.journal_service import StepJournal, find_interrupted_deployments
+from services.lease_service import lease, try_acquire, LeaseUnavailable
 
 router = APIRouter(prefix="/deployments", tags=["deployments"])
 
@@ -25,6 +62,38 @@ class DeploymentCreateRequest(BaseModel):
     github_url: str
     subdomain: str
     env_vars: dict = {}
+    resources: Optional[ResourceProfile] = None
+    placement: Optional[PlacementConstraints] = None
+    readiness_path: Optional[str] = None
+    scale_to_zero: Optional[bool] = None
+    replicas: int = Field(default=1, ge=1)
+    lane: BuildLane = BuildLane.PREVIEW
+    micro_cache: bool = False
+    proxy: Optional[ProxySettings] = None
+
+class ScaleRequest(BaseModel):
+    replicas: int = Field(ge=1)
+
+# Fields DeploymentResponse is built from; list queries fetch nothing else
+DEPLOYMENT_RESPONSE_PROJECTION = {
+    "name": 1,
+    "github_url": 1,
+    "subdomain": 1,
+    "port": 1,
+    "status": 1,
+    "created_at": 1,
+    "updated_at": 1,
+    "resources": 1,
+    "node": 1,
+    "time_to_ready": 1,
+    "scale_to_zero": 1,
+    "last_request_at": 1,
+    "replicas": 1,
+    "replica_instances.port": 1
+}
+
+LIST_SORT_FIELDS = ("created_at", "updated_at", "name", "subdomain")
+LIST_DATE_FIELDS = ("created_at", "updated_at")
 
 class LogResponse(BaseModel):
     id: str
@@ -32,8 +101,83 @@ class LogResponse(BaseModel):
     log_level: str
     timestamp: str
 
+class LogSearchResult(BaseModel):
+    id: str
+    deployment_id: str
+    deployment_name: Optional[str] = None
+    subdomain: Optional[str] = None
+    log_level: str
+    timestamp: datetime
+    snippet: str
+    # [start, end) character offsets of the matched terms within snippet
+    highlights: List[List[int]]
+
+# Pipelines running in this process, and why one was cancelled ("cancelled" or "timed_out")
+_deploy_tasks: Dict[str, asyncio.Task] = {}
+_cancel_reasons: Dict[str, str] = {}
+
+def cancel_deploy_task(deployment_id: str, reason: str) -> bool:
+    """Cancel the deployment's pipeline if it runs in this process"""
+    task = _deploy_tasks.get(deployment_id)
+    if not task or task.done():
+        return False
+    if deployment_id in _cancel_reasons:
+        # Already cancelled; a second cancel would interrupt its cleanup
+        return True
+    _cancel_reasons[deployment_id] = reason
+    task.cancel()
+    return True
+
 async def deploy_application(deployment_id: str):
-    """Background task to handle deployment process"""
+    """Background task to handle deployment process; also resumes a deploy interrupted by a restart"""
+    # One pipeline per deployment across workers and hosts; a deploy already running elsewhere is left to it
+    try:
+        async with lease(f"deploy:{deployment_id}", wait=0):
+            await supervise_deploy(deployment_id)
+    except LeaseUnavailable:
+        print(f"Deployment {deployment_id} is already being deployed by another worker")
+
+async def supervise_deploy(deployment_id: str):
+    """
+    Run the pipeline as its own task and cancel it once it has run for
+    DEPLOY_TIMEOUT seconds (build queue wait included), or when a cancel is
+    requested from any worker (checked every DEPLOY_CANCEL_POLL_INTERVAL).
+    """
+    from bson import ObjectId
+    timeout = float(os.getenv("DEPLOY_TIMEOUT", "3600"))
+    poll_interval = float(os.getenv("DEPLOY_CANCEL_POLL_INTERVAL", "2"))
+    loop = asyncio.get_event_loop()
+    deadline = loop.time() + timeout
+    db = get_database()
+    
+    task = asyncio.create_task(run_deploy_pipeline(deployment_id))
+    _deploy_tasks[deployment_id] = task
+    try:
+        while not task.done():
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                cancel_deploy_task(deployment_id, "timed_out")
+                break
+            await asyncio.wait({task}, timeout=min(poll_interval, remaining))
+            if not task.done() and await db.deployments.find_one(
+                {"_id": ObjectId(deployment_id), "cancel_requested_at": {"$ne": None}}, {"_id": 1}
+            ):
+                cancel_deploy_task(deployment_id, "cancelled")
+                break
+        await task
+    except asyncio.CancelledError:
+        # The API is shutting down; the pipeline stops where it is and resumes later
+        task.cancel()
+        raise
+    finally:
+        _deploy_tasks.pop(deployment_id, None)
+        _cancel_reasons.pop(deployment_id, None)
+
+async def run_deploy_pipeline(deployment_id: str):
+    timeline = None
+    journal = None
+    outcome = "error"
+    interrupted = False
     try:
         from bson import ObjectId
         db = get_database()
@@ -47,17 +191,23 @@ async def deploy_application(deployment_id: str):
         if not deployment_doc:
             return
         
+        # With the deploy lease held, an unfinished attempt belongs to a process that stopped
+        await db.deployment_timelines.update_many(
+            {"deployment_id": deployment_id, "kind": "deploy", "finished_at": None},
+            {"$set": {"finished_at": datetime.utcnow(), "outcome": "interrupted"}}
+        )
+        
+        # Each run of the pipeline is a new attempt in the deployment's timeline
+        timeline = await PipelineTimeline.start(deployment_id, "deploy")
+        journal = await StepJournal.open(deployment_doc)
+        if journal.last_step:
+            await write_log(deployment_id, f"Resuming interrupted deployment after step: {journal.last_step}")
+        
         # Create a simple deployment object instead of using Pydantic model
         deployment_id_str = str(deployment_doc["_id"])
         
         # Debug: Log what's in the deployment document
-        from models import BuildLogModel, LogLevel
-        log_entry = BuildLogModel(
-            deployment_id=deployment_id_str,
-            message=f"Deployment document env_vars: {deployment_doc.get('env_vars', {})}",
-            log_level=LogLevel.INFO
-        )
-        await db.build_logs.insert_one(log_entry.dict(by_alias=True))
+        await write_log(deployment_id_str, f"Deployment document env_vars: {deployment_doc.get('env_vars', {})}")
         
         class SimpleDeployment:
             def __init__(self, doc):
@@ -68,46 +218,95 @@ async def deploy_application(deployment_id: str):
                 self.port = doc["port"]
                 self.status = doc["status"]
                 self.env_vars = doc.get("env_vars", {})
+                self.resources = ResourceProfile(**(doc.get("resources") or {}))
+                self.readiness_path = doc.get("readiness_path")
         
         deployment = SimpleDeployment(deployment_doc)
         
+        node_service = NodeService()
+        node = await node_service.get_node(deployment_doc["node"]) if deployment_doc.get("node") else None
+        
+        # In queue mode, hold the deployment as pending until the host (or its node) has room for it
+        capacity_service = CapacityService()
+        if capacity_service.admission_mode == "queue" and not journal.last_step:
+            async with span("admission"):
+                await capacity_service.admit(
+                    capacity_service.footprint(deployment.resources, deployment_doc.get("replicas", 1)),
+                    deployment_id_str,
+                    node
+                )
+        
         # Initialize services with error logging
         try:
-            docker_service = DockerService()
+            docker_service = await node_service.get_docker_service(deployment_doc.get("node"))
             await docker_service.log_build(deployment_id_str, "Docker service initialized successfully")
         except Exception as e:
-            # Log error directly to database since docker_service failed to initialize
-            from models import BuildLogModel, LogLevel
-            log_entry = BuildLogModel(
-                deployment_id=deployment_id_str,
-                message=f"Failed to initialize Docker service: {str(e)}",
-                log_level=LogLevel.ERROR
-            )
-            await db.build_logs.insert_one(log_entry.dict(by_alias=True))
+            # Log error directly since docker_service failed to initialize
+            await write_log(deployment_id_str, f"Failed to initialize Docker service: {str(e)}", LogLevel.ERROR)
             raise
             
         nginx_service = NginxService()
         cloudflare_service = CloudflareService()
         cleanup_service = CleanupService()
         
-        # Deploy using Docker service
-        success = await docker_service.deploy_from_github(deployment)
+        # Builds take a fair share of the build slots; a resumed deploy keeps its place in the queue
+        build_scheduler = BuildScheduler()
+        await build_scheduler.enqueue(
+            deployment_id_str,
+            deployment_doc.get("user_id", "admin"),
+            deployment_doc.get("lane", BuildLane.PREVIEW.value),
+            enforce_quota=False
+        )
+        event_bus.publish("stage", deployment_id, stage="build_queue")
+        async with span("build_queue"):
+            await build_scheduler.wait_for_slot(deployment_id_str)
+        
+        # Deploy using Docker service; readiness is probed on the node's address
+        success = await docker_service.deploy_from_github(deployment, node["address"] if node else "127.0.0.1", journal)
+        await build_scheduler.release(deployment_id_str)
         
         if success:
-            # Setup nginx
-            nginx_success = await nginx_service.setup_deployment_nginx(
-                deployment.subdomain, 
-                deployment.port, 
-                deployment_id
-            )
+            nginx_success = journal.done("routed")
+            if not nginx_success:
+                # Start extra replicas from the image just built; nginx setup below routes them all
+                if deployment_doc.get("replicas", 1) > 1:
+                    replica_service = ReplicaService()
+                    async with span("replicas", replicas=deployment_doc["replicas"]) as stage:
+                        scaled = await replica_service.scale(deployment_id, deployment_doc["replicas"], refresh_routes=False)
+                        stage["status"] = "ok" if scaled else "failed"
+                
+                # Setup nginx
+                event_bus.publish("stage", deployment_id, stage="nginx")
+                started = time.monotonic()
+                async with span("nginx") as stage:
+                    nginx_success = await nginx_service.setup_deployment_nginx(
+                        deployment.subdomain, 
+                        deployment.port, 
+                        deployment_id
+                    )
+                    stage["status"] = "ok" if nginx_success else "failed"
+                STAGE_DURATION.observe(time.monotonic() - started, "nginx")
+                if nginx_success:
+                    await journal.complete("routed")
             
             if nginx_success:
                 # Setup Cloudflare
-                cf_success = await cloudflare_service.setup_deployment_cloudflare(
-                    deployment.subdomain,
-                    deployment.port,
-                    deployment_id
-                )
+                cf_success = journal.done("dns_ready")
+                if not cf_success:
+                    event_bus.publish("stage", deployment_id, stage="cloudflare")
+                    started = time.monotonic()
+                    async with span("cloudflare") as stage:
+                        cf_success = await cloudflare_service.setup_deployment_cloudflare(
+                            deployment.subdomain,
+                            deployment.port,
+                            deployment_id
+                        )
+                        stage["status"] = "ok" if cf_success else "failed"
+                    STAGE_DURATION.observe(time.monotonic() - started, "cloudflare")
+                    if cf_success:
+                        await journal.complete("dns_ready")
+                outcome = "success" if cf_success else "success_without_cloudflare"
+                DEPLOY_OUTCOMES.inc(outcome)
                 
                 if not cf_success:
                     await docker_service.log_build(
@@ -121,55 +320,195 @@ async def deploy_application(deployment_id: str):
                     "Nginx setup failed, cleaning up deployment",
                     "error"
                 )
-                await cleanup_service.cleanup_failed_deployment(deployment_id)
+                outcome = "nginx_failed"
+                DEPLOY_OUTCOMES.inc(outcome)
+                async with span("cleanup"):
+                    await cleanup_service.cleanup_failed_deployment(deployment_id)
         else:
-            await cleanup_service.cleanup_failed_deployment(deployment_id)
+            outcome = "build_failed"
+            DEPLOY_OUTCOMES.inc(outcome)
+            async with span("cleanup"):
+                await cleanup_service.cleanup_failed_deployment(deployment_id)
             
+    except asyncio.CancelledError:
+        outcome = _cancel_reasons.get(deployment_id)
+        if outcome is None:
+            # Not cancelled by us (shutdown): leave the journal open so the deploy resumes
+            interrupted = True
+            raise
+        DEPLOY_OUTCOMES.inc(outcome)
+        # The build slot goes to the next build before cleanup starts
+        await BuildScheduler().release(deployment_id)
+        if outcome == "timed_out":
+            await write_log(deployment_id, f"Deployment exceeded DEPLOY_TIMEOUT ({os.getenv('DEPLOY_TIMEOUT', '3600')}s), cancelling", LogLevel.ERROR)
+        else:
+            await write_log(deployment_id, "Deployment cancelled", LogLevel.WARNING)
+        event_bus.publish_status(deployment_id, DeploymentStatus.FAILED, reason=outcome)
+        async with span("cleanup"):
+            await CleanupService().cleanup_failed_deployment(deployment_id)
     except Exception as e:
         print(f"Background deployment task failed: {e}")
+        DEPLOY_OUTCOMES.inc("error")
         import traceback
         traceback.print_exc()
         
         # Log error to database for user visibility
         try:
             db = get_database()
-            from models import BuildLogModel, LogLevel
-            log_entry = BuildLogModel(
-                deployment_id=deployment_id,
-                message=f"Background deployment task failed: {str(e)}",
-                log_level=LogLevel.ERROR
-            )
-            await db.build_logs.insert_one(log_entry.dict(by_alias=True))
+            await write_log(deployment_id, f"Background deployment task failed: {str(e)}", LogLevel.ERROR)
             
             # Update deployment status to failed
             await db.deployments.update_one(
                 {"_id": ObjectId(deployment_id)},
                 {"$set": {"status": "failed"}}
             )
+            await mark_deployments_changed(deployment_id)
+            event_bus.publish_status(deployment_id, DeploymentStatus.FAILED)
         except Exception as log_error:
             print(f"Failed to log error to database: {log_error}")
         
         cleanup_service = CleanupService()
-        await cleanup_service.cleanup_failed_deployment(deployment_id)
+        async with span("cleanup"):
+            await cleanup_service.cleanup_failed_deployment(deployment_id)
+    finally:
+        if not interrupted:
+            # Frees the build slot or queue place of a pipeline that ended early
+            await BuildScheduler().release(deployment_id)
+            if timeline:
+                await timeline.finish(outcome)
+            if journal:
+                await journal.finish(outcome)
+
+# Resumed pipelines, referenced until they finish
+_resumed_deploys: set = set()
+
+async def run_deploy_resumer():
+    """
+    Background loop started with the API: picks up every deploy whose process
+    stopped mid-pipeline, at startup and then every PIPELINE_RESUME_INTERVAL
+    seconds (a stopped worker's deploy leases take up to LEASE_TTL_SECONDS to
+    expire). Each pipeline continues after its last journaled step; deploys
+    a live worker is running hold their lease and are skipped.
+    """
+    interval = int(os.getenv("PIPELINE_RESUME_INTERVAL", "60"))
+    while True:
+        try:
+            for deployment_id in await find_interrupted_deployments():
+                held = await try_acquire(f"deploy:{deployment_id}")
+                if not held:
+                    continue
+                # Only checking; deploy_application takes the lease itself
+                await held.release()
+                print(f"Resuming interrupted deployment {deployment_id}")
+                task = asyncio.create_task(deploy_application(deployment_id))
+                _resumed_deploys.add(task)
+                task.add_done_callback(_resumed_deploys.discard)
+        except Exception as e:
+            print(f"Failed to resume interrupted deployments: {e}")
+        await asyncio.sleep(interval)
+
+def deployment_row(deployment: dict) -> dict:
+    """The DeploymentResponse fields of a document projected with DEPLOYMENT_RESPONSE_PROJECTION"""
+    return {
+        "id": str(deployment["_id"]),
+        "name": deployment["name"],
+        "github_url": deployment["github_url"],
+        "subdomain": deployment["subdomain"],
+        "port": deployment["port"],
+        "status": deployment["status"],
+        "created_at": deployment["created_at"],
+        "updated_at": deployment["updated_at"],
+        "resources": deployment.get("resources"),
+        "node": deployment.get("node"),
+        "time_to_ready": deployment.get("time_to_ready"),
+        "scale_to_zero": deployment.get("scale_to_zero", False),
+        "last_request_at": deployment.get("last_request_at"),
+        "replicas": deployment.get("replicas", 1),
+        "replica_ports": [instance["port"] for instance in deployment.get("replica_instances", [])]
+    }
+
+def deployment_response(deployment: dict) -> DeploymentResponse:
+    return DeploymentResponse(**deployment_row(deployment))
+
+def encode_cursor(sort: str, deployment: dict) -> str:
+    value = deployment.get(sort)
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    payload = json.dumps({"v": value, "id": str(deployment["_id"])}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+def decode_cursor(sort: str, cursor: str):
+    from bson import ObjectId
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        value = payload["v"]
+        if sort in LIST_DATE_FIELDS and value is not None:
+            value = datetime.fromisoformat(value)
+        return value, ObjectId(payload["id"])
+    except Exception:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor"
+        )
 
 @router.get("/", response_model=List[DeploymentResponse])
-async def list_deployments(current_user: User = Depends(get_current_user)):
+async def list_deployments(
+    request: Request,
+    response: Response,
+    status_filter: Optional[DeploymentStatus] = Query(None, alias="status"),
+    name_prefix: Optional[str] = Query(None, max_length=100),
+    sort: str = Query("created_at", pattern="^(" + "|".join(LIST_SORT_FIELDS) + ")$"),
+    order: str = Query("asc", pattern="^(asc|desc)$"),
+    limit: int = Query(200, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    List deployments a page at a time (keyset pagination on the sort field and
+    _id; the next page's cursor is returned in X-Next-Cursor). The ETag is the
+    collection version plus the query, so a poll with a matching If-None-Match
+    is answered 304 without reading any deployment documents. With FAST_JSON
+    the rows are serialized straight from the projected documents.
+    """
+    query_key = json.dumps([status_filter, name_prefix, sort, order, limit, cursor])
+    version = await get_deployments_version()
+    etag = f'W/"{version}-{hashlib.sha1(query_key.encode()).hexdigest()[:16]}"'
+    # no-cache lets the browser keep the body and revalidate it with If-None-Match
+    cache_headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+
+    if etag in [tag.strip() for tag in request.headers.get("if-none-match", "").split(",")]:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=cache_headers)
+
     db = get_database()
-    deployments = await db.deployments.find().to_list(length=None)
-    
-    return [
-        DeploymentResponse(
-            id=str(deployment["_id"]),
-            name=deployment["name"],
-            github_url=deployment["github_url"],
-            subdomain=deployment["subdomain"],
-            port=deployment["port"],
-            status=deployment["status"],
-            created_at=deployment["created_at"],
-            updated_at=deployment["updated_at"]
-        )
-        for deployment in deployments
-    ]
+    conditions = []
+    if status_filter:
+        conditions.append({"status": status_filter})
+    if name_prefix:
+        # An anchored, escaped prefix can be answered from the name index
+        conditions.append({"name": {"$regex": f"^{re.escape(name_prefix)}"}})
+    if cursor:
+        value, last_id = decode_cursor(sort, cursor)
+        direction = "$gt" if order == "asc" else "$lt"
+        conditions.append({"$or": [
+            {sort: {direction: value}},
+            {sort: value, "_id": {direction: last_id}}
+        ]})
+
+    query = {"$and": conditions} if conditions else {}
+    sort_direction = 1 if order == "asc" else -1
+    # One extra document tells us whether another page exists
+    deployments = await db.deployments.find(query, DEPLOYMENT_RESPONSE_PROJECTION).sort(
+        [(sort, sort_direction), ("_id", sort_direction)]
+    ).limit(limit + 1).to_list(length=limit + 1)
+
+    if len(deployments) > limit:
+        deployments = deployments[:limit]
+        cache_headers["X-Next-Cursor"] = encode_cursor(sort, deployments[-1])
+
+    if fast_json_enabled():
+        return json_response([deployment_row(deployment) for deployment in deployments], headers=cache_headers)
+    response.headers.update(cache_headers)
+    return [deployment_response(deployment) for deployment in deployments]
 
 @router.post("/", response_model=DeploymentResponse)
 async def create_deployment(
@@ -191,37 +530,86 @@ async def create_deployment(
             detail="Subdomain already exists"
         )
     
-    # Extract repository name from GitHub URL
-    repo_name = deployment_data.github_url.split("/")[-1].replace(".git", "")
-    
-    # Find available port
-    deployment_id = None  # Will be set after creating deployment
-    available_port = await port_service.find_available_port("temp")
-    if not available_port:
+    replica_limit = ReplicaService().max_replicas
+    if deployment_data.replicas > replica_limit:
         raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail="No available ports"
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {replica_limit} replicas are allowed"
         )
     
-    # Create deployment record
-    deployment = DeploymentModel(
-        name=repo_name,
-        github_url=deployment_data.github_url,
-        subdomain=deployment_data.subdomain,
-        port=available_port,
-        status=DeploymentStatus.PENDING,
-        user_id=current_user.id,
-        env_vars=deployment_data.env_vars
-    )
+    resources = deployment_data.resources or ResourceProfile()
+    placement = deployment_data.placement or PlacementConstraints()
+    if not placement.spread_group:
+        placement.spread_group = deployment_data.github_url
+    capacity_service = CapacityService()
+    queue_mode = capacity_service.admission_mode == "queue"
+    # Every replica holds a full resource profile
+    footprint = capacity_service.footprint(resources, deployment_data.replicas)
     
-    result = await db.deployments.insert_one(deployment.dict(by_alias=True))
-    deployment_id = str(result.inserted_id)
+    # Take a place in the build queue before allocating anything; over quota is answered 429
+    # The model's id field only accepts PyObjectId
+    deployment_id = str(PyObjectId())
+    build_scheduler = BuildScheduler()
+    if not build_scheduler.may_use_lane(current_user.id, deployment_data.lane.value):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail=f"Not allowed to use the {deployment_data.lane.value} build lane"
+        )
+    try:
+        await build_scheduler.enqueue(deployment_id, current_user.id, deployment_data.lane.value)
+    except BuildQuotaExceeded as e:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=e.reason,
+            headers={"Retry-After": str(e.retry_after)}
+        )
     
-    # Update port registry with correct deployment ID
-    await db.port_registry.update_one(
-        {"port": available_port},
-        {"$set": {"deployment_id": deployment_id}}
-    )
+    # Until the deployment is stored nothing else frees its ticket or port
+    available_port = None
+    try:
+        # Find available port
+        available_port = await port_service.find_available_port(deployment_id)
+        if not available_port:
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail="No available ports"
+            )
+        
+        # The capacity check and the insert that commits it happen under one lease,
+        # so concurrent creates can't all fit into the same free capacity
+        async with lease("capacity"):
+            # With registered nodes, place the deployment on one; otherwise it runs on this host.
+            # Deployments that would overcommit are rejected here (queue mode admits them later).
+            node_name = None
+            scheduler = PlacementScheduler()
+            if await scheduler.has_nodes():
+                node = await scheduler.place(footprint, placement, require_fit=not queue_mode)
+                if not node:
+                    raise HTTPException(
+                        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                        detail="No node can fit the requested resources and placement constraints"
+                    )
+                node_name = node["name"]
+            elif not queue_mode and not await capacity_service.can_admit(footprint):
+                raise HTTPException(
+                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    detail="Insufficient host capacity for the requested resources"
+                )
+            
+            deployment = await store_new_deployment(deployment_id, deployment_data, current_user, available_port, resources, placement, node_name)
+    except LeaseUnavailable:
+        await build_scheduler.release(deployment_id)
+        if available_port:
+            await port_service.release_port(available_port)
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Host capacity is busy being allocated; try again"
+        )
+    except BaseException:
+        await build_scheduler.release(deployment_id)
+        if available_port:
+            await port_service.release_port(available_port)
+        raise
     
     # Start background deployment task
     background_tasks.add_task(deploy_application, deployment_id)
@@ -234,22 +622,205 @@ async def create_deployment(
         port=deployment.port,
         status=deployment.status,
         created_at=deployment.created_at,
-        updated_at=deployment.updated_at
+        updated_at=deployment.updated_at,
+        resources=deployment.resources,
+        node=deployment.node,
+        scale_to_zero=deployment.scale_to_zero,
+        replicas=deployment.replicas
+    )
+
+async def store_new_deployment(
+    deployment_id: str,
+    deployment_data: DeploymentCreateRequest,
+    current_user: User,
+    port: int,
+    resources: ResourceProfile,
+    placement: PlacementConstraints,
+    node_name: Optional[str]
+) -> DeploymentModel:
+    from pymongo.errors import DuplicateKeyError
+    db = get_database()
+    # Extract repository name from GitHub URL
+    repo_name = deployment_data.github_url.split("/")[-1].replace(".git", "")
+    
+    # Create deployment record
+    deployment = DeploymentModel(
+        id=PyObjectId(deployment_id),
+        name=repo_name,
+        github_url=deployment_data.github_url,
+        subdomain=deployment_data.subdomain,
+        port=port,
+        status=DeploymentStatus.PENDING,
+        user_id=current_user.id,
+        env_vars=deployment_data.env_vars,
+        resources=resources,
+        placement=placement,
+        node=node_name,
+        readiness_path=deployment_data.readiness_path,
+        scale_to_zero=(
+            deployment_data.scale_to_zero
+            if deployment_data.scale_to_zero is not None
+            else os.getenv("SCALE_TO_ZERO_DEFAULT", "false").lower() == "true"
+        ),
+        replicas=deployment_data.replicas,
+        lane=deployment_data.lane,
+        micro_cache=deployment_data.micro_cache,
+        proxy=deployment_data.proxy or ProxySettings()
+    )
+    
+    try:
+        await db.deployments.insert_one(deployment.dict(by_alias=True))
+    except DuplicateKeyError:
+        # A concurrent create took the subdomain after the check above
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Subdomain already exists"
+        )
+    await mark_deployments_changed(deployment_id)
+    event_bus.publish("created", deployment_id, name=deployment.name, subdomain=deployment.subdomain, status=deployment.status)
+    return deployment
+
+@router.get("/capacity")
+async def get_capacity(current_user: User = Depends(get_current_user)):
+    capacity_service = CapacityService()
+    return await capacity_service.get_capacity_report()
+
+@router.get("/build-queue")
+async def get_build_queue(current_user: User = Depends(get_current_user)):
+    """Running and waiting builds, in the order they will start"""
+    build_scheduler = BuildScheduler()
+    return await build_scheduler.get_queue_report()
+
+@router.get("/events")
+async def stream_events(
+    request: Request,
+    last_event_id: Optional[int] = Query(None),
+    current_user: User = Depends(get_stream_user)
+):
+    """
+    Server-sent events for every deployment: status changes, creates, deletes
+    and pipeline stages. Reconnecting clients send Last-Event-ID (EventSource
+    does this itself) and get the buffered events they missed; a "reset"
+    event means the gap is too old to replay and the list should be refetched.
+    """
+    header_id = request.headers.get("last-event-id")
+    if header_id and header_id.isdigit():
+        last_event_id = int(header_id)
+    heartbeat = float(os.getenv("EVENT_HEARTBEAT_SECONDS", "15"))
+
+    def format_event(event: dict) -> str:
+        return f"id: {event['id']}\nevent: {event['type']}\ndata: {json.dumps(event, default=str)}\n\n"
+
+    async def event_stream():
+        # Subscribe before replaying so nothing published in between is lost
+        queue = event_bus.subscribe()
+        try:
+            missed = event_bus.replay(last_event_id)
+            if missed is None:
+                yield format_event({"id": event_bus.sequence, "type": "reset"})
+            else:
+                for event in missed:
+                    yield format_event(event)
+            replayed = missed[-1]["id"] if missed else 0
+
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=heartbeat)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    yield ": keep-alive\n\n"
+                    continue
+                if event is None:
+                    # Dropped for falling behind; the client reconnects and replays
+                    break
+                if event["id"] > replayed:
+                    yield format_event(event)
+        finally:
+            event_bus.unsubscribe(queue)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
     )
 
+@router.get("/timeline-stats")
+async def get_timeline_stats(
+    kind: str = Query("deploy", pattern="^(deploy|delete)$"),
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    current_user: User = Depends(get_current_user)
+):
+    """p50/p95 per pipeline stage across the most recent finished attempts"""
+    timeline_service = TimelineService()
+    return await timeline_service.stage_stats(kind, limit)
+
+@router.get("/cache")
+async def get_cache_stats(current_user: User = Depends(get_current_user)):
+    return deployment_cache.stats()
+
+@router.get("/stats/top")
+async def get_top_stats(
+    by: str = Query("cpu_percent", pattern="^(" + "|".join(STAT_FIELDS) + ")$"),
+    limit: int = Query(10, ge=1, le=100),
+    current_user: User = Depends(get_current_user)
+):
+    """The deployments using the most of one resource right now, plus totals over every deployment still being sampled"""
+    top = stats_sampler.top(by, len(stats_sampler.rings))
+    return {
+        "by": by,
+        "interval": stats_sampler.interval,
+        "totals": {field: round(sum(entry[field] for entry in top), 2) for field in STAT_FIELDS if field != "memory_limit_bytes"},
+        "deployments": top[:limit]
+    }
+
+@router.get("/reconcile")
+async def get_drift_report(current_user: User = Depends(get_current_user)):
+    """Dry run: where the database, Docker, nginx, the tunnel config and DNS disagree, and what a repair would do"""
+    reconcile_service = ReconcileService()
+    return await reconcile_service.reconcile(repair=False)
+
+@router.post("/reconcile")
+async def repair_drift(current_user: User = Depends(get_current_user)):
+    """Run a reconciliation pass now and repair what it finds"""
+    reconcile_service = ReconcileService()
+    return await reconcile_service.reconcile(repair=True)
+
+@router.get("/logs/search", response_model=List[LogSearchResult])
+async def search_logs(
+    response: Response,
+    q: str = Query(..., min_length=1, max_length=200),
+    level: Optional[List[LogLevel]] = Query(None),
+    deployment_id: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Full-text search across every deployment's build logs, newest first. q uses
+    MongoDB $text syntax ("quoted phrases", -excluded terms). The next page's
+    cursor is returned in X-Next-Cursor.
+    """
+    log_service = LogService()
+    try:
+        hits, next_cursor = await log_service.search(q, level, deployment_id, since, until, limit, cursor)
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor"
+        )
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return [LogSearchResult(**hit) for hit in hits]
+
 @router.get("/{deployment_id}", response_model=DeploymentResponse)
 async def get_deployment(
     deployment_id: str,
     current_user: User = Depends(get_current_user)
 ):
-    from bson import ObjectId
-    db = get_database()
-    
-    # Convert string ID to ObjectId for MongoDB query
-    try:
-        deployment = await db.deployments.find_one({"_id": ObjectId(deployment_id)})
-    except Exception:
-        deployment = None
+    deployment = await deployment_cache.get(deployment_id)
     
     if not deployment:
         raise HTTPException(
@@ -257,16 +828,7 @@ async def get_deployment(
             detail="Deployment not found"
         )
     
-    return DeploymentResponse(
-        id=str(deployment["_id"]),
-        name=deployment["name"],
-        github_url=deployment["github_url"],
-        subdomain=deployment["subdomain"],
-        port=deployment["port"],
-        status=deployment["status"],
-        created_at=deployment["created_at"],
-        updated_at=deployment["updated_at"]
-    )
+    return deployment_response(deployment)
 
 @router.delete("/{deployment_id}")
 async def delete_deployment(
@@ -274,14 +836,7 @@ async def delete_deployment(
     background_tasks: BackgroundTasks,
     current_user: User = Depends(get_current_user)
 ):
-    from bson import ObjectId
-    db = get_database()
-    
-    # Convert string ID to ObjectId for MongoDB query
-    try:
-        deployment = await db.deployments.find_one({"_id": ObjectId(deployment_id)})
-    except Exception:
-        deployment = None
+    deployment = await deployment_cache.get(deployment_id)
     
     if not deployment:
         raise HTTPException(
@@ -297,48 +852,232 @@ async def delete_deployment(
 @router.get("/{deployment_id}/logs", response_model=List[LogResponse])
 async def get_deployment_logs(
     deployment_id: str,
+    after: Optional[str] = Query(None, description="id of the last line already seen"),
+    limit: Optional[int] = Query(None, ge=1, le=10000),
     current_user: User = Depends(get_current_user)
 ):
-    from bson import ObjectId
-    db = get_database()
+    """
+    The deployment's log lines in order; pass the last id seen as `after` to
+    read only newer lines. With FAST_JSON the lines are streamed as they are
+    read instead of collected and validated first.
+    """
+    log_service = LogService()
+    # Logs of deleted deployments stay readable from their archive
+    deployment = await deployment_cache.get(deployment_id)
+    if not deployment and not await log_service.has_logs(deployment_id):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Deployment not found"
+        )
     
-    # Check if deployment exists
     try:
-        deployment = await db.deployments.find_one({"_id": ObjectId(deployment_id)})
-    except Exception:
-        deployment = None
+        if fast_json_enabled():
+            return await json_array_response(log_service.iter_logs(deployment_id, after), limit)
+        logs = await log_service.get_logs(deployment_id, after, limit)
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Unknown log cursor"
+        )
+    return [LogResponse(**log) for log in logs]
+
+@router.get("/{deployment_id}/runtime-logs")
+async def get_runtime_logs(
+    request: Request,
+    deployment_id: str,
+    follow: bool = False,
+    since: Optional[datetime] = None,
+    tail: int = Query(100, ge=0, le=10000),
+    replica: int = Query(0, ge=0),
+    current_user: User = Depends(get_stream_user)
+):
+    """
+    The container's stdout/stderr. Without follow, the last `tail` lines (since
+    `since`) as JSON. With follow, server-sent events: the backlog from the
+    shared ring buffer (so `tail` is capped at RUNTIME_LOG_BUFFER), then new
+    lines as they are written. The stream ends with an "end" event when the
+    container stops, or is closed if the viewer falls too far behind.
+    """
+    deployment = await deployment_cache.get(deployment_id)
     if not deployment:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Deployment not found"
         )
     
-    # Get logs
-    logs = await db.build_logs.find(
-        {"deployment_id": deployment_id}
-    ).sort("timestamp", 1).to_list(length=None)
+    container_id = deployment.get("container_id")
+    if replica:
+        instance = next((i for i in deployment.get("replica_instances", []) if i["index"] == replica), None)
+        container_id = instance["container_id"] if instance else None
+    if not container_id:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Deployment has no container"
+        )
+    
+    # Docker timestamps are UTC; compare naive to naive
+    if since and since.tzinfo:
+        since = since.astimezone(timezone.utc).replace(tzinfo=None)
+    
+    node_service = NodeService()
+    docker_service = await node_service.get_docker_service(deployment.get("node"))
+    
+    def log_entry(entry: dict) -> dict:
+        return {"timestamp": entry["timestamp"], "line": entry["line"]}
+    
+    if not follow:
+        try:
+            lines = await runtime_logs.read(docker_service.client, container_id, tail, since)
+        except Exception as e:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Container logs unavailable: {str(e)}"
+            )
+        return [log_entry(entry) for entry in lines]
+    
+    heartbeat = float(os.getenv("EVENT_HEARTBEAT_SECONDS", "15"))
+    
+    def format_line(entry: dict) -> str:
+        return f"id: {entry['id']}\nevent: log\ndata: {json.dumps(log_entry(entry), default=str)}\n\n"
+    
+    try:
+        stream = runtime_logs.stream(docker_service.client, container_id)
+    except TooManyLogStreams as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=str(e)
+        )
+    
+    async def log_stream():
+        backlog, queue = await stream.subscribe(tail, since)
+        try:
+            for entry in backlog:
+                yield format_line(entry)
+            
+            while True:
+                try:
+                    entry = await asyncio.wait_for(queue.get(), timeout=heartbeat)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    yield ": keep-alive\n\n"
+                    continue
+                if entry is None:
+                    if stream.closed:
+                        yield "event: end\ndata: {}\n\n"
+                    # Otherwise dropped for falling behind; the client reconnects with `since`
+                    break
+                yield format_line(entry)
+        finally:
+            stream.unsubscribe(queue)
     
-    return [
-        LogResponse(
-            id=str(log["_id"]),
-            message=log["message"],
-            log_level=log["log_level"],
-            timestamp=log["timestamp"].isoformat()
+    return StreamingResponse(
+        log_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.get("/{deployment_id}/stats")
+async def get_deployment_stats(
+    deployment_id: str,
+    points: int = Query(60, ge=1, le=1000),
+    since: Optional[datetime] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """Current CPU, memory, network and block I/O, and the sampled history averaged down to `points` points"""
+    if since and since.tzinfo:
+        since = since.astimezone(timezone.utc).replace(tzinfo=None)
+    stats = stats_sampler.get_stats(
+        deployment_id,
+        points,
+        since.replace(tzinfo=timezone.utc).timestamp() if since else None
+    )
+    if stats is None:
+        if not await deployment_cache.get(deployment_id):
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Deployment not found"
+            )
+        # Not running, or not sampled yet
+        return {"deployment_id": deployment_id, "interval": stats_sampler.interval, "current": None, "history": []}
+    return stats
+
+@router.get("/{deployment_id}/timeline")
+async def get_deployment_timeline(
+    deployment_id: str,
+    current_user: User = Depends(get_current_user)
+):
+    timeline_service = TimelineService()
+    attempts = await timeline_service.get_timeline(deployment_id)
+    # Timelines outlive their deployment, so deleted deployments can still be inspected
+    if not attempts and not await deployment_cache.get(deployment_id):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Deployment not found"
         )
-        for log in logs
-    ]
+    
+    return {"deployment_id": deployment_id, "attempts": attempts}
 
 @router.get("/{deployment_id}/status")
 async def get_deployment_status(
     deployment_id: str,
     current_user: User = Depends(get_current_user)
 ):
+    deployment = await deployment_cache.get(deployment_id)
+    
+    if not deployment:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Deployment not found"
+        )
+    
+    return {
+        "id": deployment_id,
+        "status": deployment["status"],
+        "updated_at": deployment["updated_at"],
+        "ready_at": deployment.get("ready_at"),
+        "time_to_ready": deployment.get("time_to_ready")
+    }
+
+async def cleanup_abandoned_deploy(deployment_id: str):
+    """Clean up a cancelled deploy whose pipeline isn't running anywhere (its worker stopped)"""
+    from bson import ObjectId
+    try:
+        async with lease(f"deploy:{deployment_id}", wait=0):
+            # The pipeline may have finished before the cancel reached it; a deployed app is kept
+            deployment = await get_database().deployments.find_one(
+                {"_id": ObjectId(deployment_id)}, {"status": 1, "pipeline": 1, "cancel_requested_at": 1}
+            )
+            if (
+                not deployment or
+                not deployment.get("cancel_requested_at") or
+                (deployment.get("pipeline") or {}).get("finished_at") or
+                deployment["status"] in (DeploymentStatus.RUNNING, DeploymentStatus.HIBERNATED)
+            ):
+                return
+            await BuildScheduler().release(deployment_id)
+            await CleanupService().cleanup_failed_deployment(deployment_id)
+    except LeaseUnavailable:
+        # A resumed pipeline picked it up and will see the cancel request
+        pass
+
+@router.post("/{deployment_id}/cancel")
+async def cancel_deployment(
+    deployment_id: str,
+    background_tasks: BackgroundTasks,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Stop a deploy in progress. The clone or build is aborted, the build slot
+    freed, and the partial image, workspace, port and deployment removed.
+    """
     from bson import ObjectId
     db = get_database()
-    
-    # Convert string ID to ObjectId for MongoDB query
+    # Read from the database: a cached copy may predate the pipeline finishing
     try:
-        deployment = await db.deployments.find_one({"_id": ObjectId(deployment_id)})
+        deployment = await db.deployments.find_one(
+            {"_id": ObjectId(deployment_id)}, {"status": 1, "pipeline": 1}
+        )
     except Exception:
         deployment = None
     
@@ -348,8 +1087,145 @@ async def get_deployment_status(
             detail="Deployment not found"
         )
     
-    return {
-        "id": deployment_id,
-        "status": deployment["status"],
-        "updated_at": deployment["updated_at"]
-    }
\ No newline at end of file
+    pipeline = deployment.get("pipeline") or {}
+    in_progress = (
+        deployment["status"] in (DeploymentStatus.PENDING, DeploymentStatus.BUILDING) or
+        (pipeline.get("started_at") and not pipeline.get("finished_at"))
+    )
+    if not in_progress:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Deployment is not being deployed"
+        )
+    
+    # A pipeline on another worker sees this within DEPLOY_CANCEL_POLL_INTERVAL
+    await db.deployments.update_one(
+        {"_id": ObjectId(deployment_id)},
+        {"$set": {"cancel_requested_at": datetime.utcnow()}}
+    )
+    await mark_deployments_changed(deployment_id)
+    
+    if not cancel_deploy_task(deployment_id, "cancelled"):
+        background_tasks.add_task(cleanup_abandoned_deploy, deployment_id)
+    
+    return {"message": "Deployment cancellation requested"}
+
+@router.post("/{deployment_id}/hibernate")
+async def hibernate_deployment(
+    deployment_id: str,
+    current_user: User = Depends(get_current_user)
+):
+    deployment = await deployment_cache.get(deployment_id)
+    
+    if not deployment:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Deployment not found"
+        )
+    
+    if deployment["status"] != DeploymentStatus.RUNNING:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Only running deployments can be hibernated"
+        )
+    
+    hibernation_service = HibernationService()
+    if not await hibernation_service.hibernate(deployment_id):
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to hibernate deployment"
+        )
+    
+    return {"message": "Deployment hibernated"}
+
+@router.post("/{deployment_id}/wake")
+async def wake_deployment(
+    deployment_id: str,
+    current_user: User = Depends(get_current_user)
+):
+    deployment = await deployment_cache.get(deployment_id)
+    
+    if not deployment:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Deployment not found"
+        )
+    
+    hibernation_service = HibernationService()
+    if not await hibernation_service.wake(deployment_id):
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Failed to wake deployment"
+        )
+    
+    return {"message": "Deployment is running"}
+
+@router.post("/{deployment_id}/scale")
+async def scale_deployment(
+    deployment_id: str,
+    scale_data: ScaleRequest,
+    current_user: User = Depends(get_current_user)
+):
+    deployment = await deployment_cache.get(deployment_id)
+    
+    if not deployment:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Deployment not found"
+        )
+    
+    if deployment["status"] != DeploymentStatus.RUNNING:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Only running deployments can be scaled"
+        )
+    
+    replica_service = ReplicaService()
+    if scale_data.replicas > replica_service.max_replicas:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {replica_service.max_replicas} replicas are allowed"
+        )
+    
+    if not await replica_service.scale(deployment_id, scale_data.replicas):
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to scale deployment; check the deployment logs"
+        )
+    
+    return {"message": f"Deployment scaled to {scale_data.replicas} replicas"}
+
+@router.put("/{deployment_id}/proxy")
+async def update_proxy_settings(
+    deployment_id: str,
+    proxy_data: ProxySettings,
+    current_user: User = Depends(get_current_user)
+):
+    """Replace the deployment's upstream pool and timeout settings; unset values use the defaults"""
+    from bson import ObjectId
+    
+    deployment = await deployment_cache.get(deployment_id)
+    
+    if not deployment:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Deployment not found"
+        )
+    
+    db = get_database()
+    await db.deployments.update_one(
+        {"_id": ObjectId(deployment_id)},
+        {"$set": {"proxy": proxy_data.dict(), "updated_at": datetime.utcnow()}}
+    )
+    await mark_deployments_changed(deployment_id)
+    
+    # Only this deployment's upstream file changes; others are left as they are
+    if deployment["status"] == DeploymentStatus.RUNNING:
+        nginx_service = NginxService()
+        if not await nginx_service.generate_mapping_file(deployment_id) or not await nginx_service.reload_nginx(deployment_id):
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail="Failed to apply proxy settings; check the deployment logs"
+            )
+    
+    return {"message": "Proxy settings updated", "proxy": proxy_data.dict()}
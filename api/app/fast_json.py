@@ -0,0 +1,68 @@
+"""
+Opt-in fast path for the large list and log responses (FAST_JSON=true).
+Projected Mongo rows are serialized directly instead of building a Pydantic
+model per row and having FastAPI validate them against response_model again.
+orjson is used when installed, otherwise pydantic_core's serializer; both
+write datetimes the way the models do.
+"""
+import os
+from typing import Any, AsyncIterator, Dict, List, Optional
+from fastapi.responses import Response, StreamingResponse
+from pydantic_core import to_json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def fast_json_enabled() -> bool:
+    return os.getenv("FAST_JSON", "false").lower() == "true"
+
+def dumps(value: Any) -> bytes:
+    # ObjectIds and anything else unexpected fall back to str, as the models' json_encoders do
+    if orjson is not None:
+        return orjson.dumps(value, default=str)
+    return to_json(value, fallback=str)
+
+def json_response(value: Any, headers: Optional[Dict[str, str]] = None) -> Response:
+    return Response(content=dumps(value), media_type="application/json", headers=headers)
+
+async def _batches(rows: AsyncIterator[Dict[str, Any]], size: int, limit: Optional[int]) -> AsyncIterator[List[Dict[str, Any]]]:
+    batch: List[Dict[str, Any]] = []
+    count = 0
+    async for row in rows:
+        batch.append(row)
+        count += 1
+        if len(batch) >= size or count == limit:
+            yield batch
+            batch = []
+        if count == limit:
+            return
+    if batch:
+        yield batch
+
+async def json_array_response(
+    rows: AsyncIterator[Dict[str, Any]],
+    limit: Optional[int] = None,
+    headers: Optional[Dict[str, str]] = None
+) -> StreamingResponse:
+    """
+    Stream rows as one JSON array, FAST_JSON_BATCH rows per chunk, so a large
+    response is never held in memory. The first batch is read before the
+    response starts: errors the query raises up to then (an unknown cursor)
+    still reach the caller as exceptions rather than a truncated body.
+    """
+    batches = _batches(rows, int(os.getenv("FAST_JSON_BATCH", "1000")), limit)
+    first = await anext(batches, None)
+
+    async def body():
+        yield b"["
+        batch, separator = first, b""
+        while batch is not None:
+            # Each batch encodes as "[...]"; drop the brackets and join with commas
+            yield separator + dumps(batch)[1:-1]
+            separator = b","
+            batch = await anext(batches, None)
+        yield b"]"
+
+    return StreamingResponse(body(), media_type="application/json", headers=headers)
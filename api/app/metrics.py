@@ -0,0 +1,24 @@
+import os
+import hmac
+from fastapi import APIRouter, Request
+from fastapi.responses import PlainTextResponse
+from models import get_database, DeploymentStatus
+from services.metrics import render_metrics, RUNNING_DEPLOYMENTS, ALLOCATED_PORTS
+
+router = APIRouter(tags=["metrics"])
+
+# Prometheus scrapes without a login; set METRICS_TOKEN to require it as a bearer token
+@router.get("/metrics", response_class=PlainTextResponse)
+async def metrics(request: Request):
+    token = os.getenv("METRICS_TOKEN")
+    if token:
+        supplied = request.headers.get("authorization", "").removeprefix("Bearer ")
+        if not hmac.compare_digest(supplied, token):
+            return PlainTextResponse("Unauthorized", status_code=401)
+
+    # Shared state is read from Mongo at scrape time so every worker reports the same values
+    db = get_database()
+    RUNNING_DEPLOYMENTS.set(await db.deployments.count_documents({"status": DeploymentStatus.RUNNING}))
+    ALLOCATED_PORTS.set(await db.port_registry.count_documents({"is_allocated": True}))
+
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
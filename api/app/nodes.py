@@ -0,0 +1,130 @@
+from fastapi import APIRouter, Depends, HTTPException, status, BackgroundTasks
+from typing import List, Dict
+from datetime import datetime
+from pydantic import BaseModel, Field
+from app.auth import get_current_user, User
+from models import NodeModel, NodeStatus, ResourceProfile
+from services import NodeService, CapacityService
+
+router = APIRouter(prefix="/nodes", tags=["nodes"])
+
+class NodeCreateRequest(BaseModel):
+    name: str
+    docker_url: str
+    address: str
+    labels: Dict[str, str] = Field(default_factory=dict)
+    capacity: ResourceProfile
+
+class NodeResponse(BaseModel):
+    name: str
+    docker_url: str
+    address: str
+    labels: Dict[str, str]
+    capacity: ResourceProfile
+    status: NodeStatus
+    committed: Dict[str, float]
+    created_at: datetime
+
+async def build_node_response(node: dict) -> NodeResponse:
+    capacity_service = CapacityService()
+    return NodeResponse(
+        name=node["name"],
+        docker_url=node["docker_url"],
+        address=node["address"],
+        labels=node.get("labels", {}),
+        capacity=node["capacity"],
+        status=node["status"],
+        committed=await capacity_service.committed(node=node["name"]),
+        created_at=node["created_at"]
+    )
+
+@router.get("/", response_model=List[NodeResponse])
+async def list_nodes(current_user: User = Depends(get_current_user)):
+    node_service = NodeService()
+    nodes = await node_service.list_nodes()
+    return [await build_node_response(node) for node in nodes]
+
+@router.post("/", response_model=NodeResponse)
+async def register_node(
+    node_data: NodeCreateRequest,
+    current_user: User = Depends(get_current_user)
+):
+    node_service = NodeService()
+
+    if await node_service.get_node(node_data.name):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Node already exists"
+        )
+
+    node = NodeModel(
+        name=node_data.name,
+        docker_url=node_data.docker_url,
+        address=node_data.address,
+        labels=node_data.labels,
+        capacity=node_data.capacity
+    )
+
+    if not await node_service.register_node(node):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Could not reach the Docker engine for this node"
+        )
+
+    return await build_node_response(await node_service.get_node(node.name))
+
+@router.delete("/{name}")
+async def remove_node(
+    name: str,
+    current_user: User = Depends(get_current_user)
+):
+    node_service = NodeService()
+
+    if not await node_service.get_node(name):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Node not found"
+        )
+
+    if not await node_service.remove_node(name):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Node still has deployments; drain it first"
+        )
+
+    return {"message": "Node removed"}
+
+@router.post("/{name}/drain")
+async def drain_node(
+    name: str,
+    background_tasks: BackgroundTasks,
+    current_user: User = Depends(get_current_user)
+):
+    node_service = NodeService()
+
+    if not await node_service.get_node(name):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Node not found"
+        )
+
+    # Stop new placements right away; migrations run in the background
+    await node_service.set_status(name, NodeStatus.DRAINING)
+    background_tasks.add_task(node_service.drain_node, name)
+
+    return {"message": "Node drain started"}
+
+@router.post("/{name}/activate")
+async def activate_node(
+    name: str,
+    current_user: User = Depends(get_current_user)
+):
+    node_service = NodeService()
+
+    if not await node_service.set_status(name, NodeStatus.ACTIVE):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Node not found"
+        )
+
+    return {"message": "Node activated"}
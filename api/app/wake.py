@@ -0,0 +1,45 @@
+import os
+from fastapi import APIRouter, Request
+from fastapi.responses import HTMLResponse, RedirectResponse
+from models import get_database
+from services import HibernationService
+
+router = APIRouter(tags=["wake"])
+
+WAKE_FAILED_PAGE = """<!DOCTYPE html>
+<html>
+<head><title>Starting up</title><meta http-equiv="refresh" content="10"></head>
+<body><p>This app is starting up. The page will retry in a few seconds.</p></body>
+</html>"""
+
+# nginx proxies every request for a hibernated subdomain here, keeping the
+# visitor's Host header and passing the original path in X-Original-URI.
+# Unauthenticated on purpose: it can only start an existing hibernated deployment.
+@router.api_route("/wake", methods=["GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"])
+async def wake_deployment(request: Request):
+    base_domain = os.getenv("BASE_DOMAIN", "ao2395.com")
+    host = request.headers.get("host", "").split(":")[0].lower()
+    suffix = f".{base_domain}"
+
+    if not host.endswith(suffix):
+        return HTMLResponse("Unknown host", status_code=404)
+
+    db = get_database()
+    deployment = await db.deployments.find_one({"subdomain": host[:-len(suffix)]}, {"_id": 1})
+    if not deployment:
+        return HTMLResponse("Unknown deployment", status_code=404)
+
+    hibernation_service = HibernationService()
+    if not await hibernation_service.wake(str(deployment["_id"])):
+        return HTMLResponse(
+            WAKE_FAILED_PAGE,
+            status_code=503,
+            headers={"Retry-After": "10", "Cache-Control": "no-store"}
+        )
+
+    original_uri = request.headers.get("x-original-uri", "/")
+    if not original_uri.startswith("/") or original_uri.startswith("//"):
+        original_uri = "/"
+
+    # 307 keeps the method and body, so form posts that triggered the wake go through
+    return RedirectResponse(original_uri, status_code=307, headers={"Cache-Control": "no-store"})
@@ -0,0 +1,8 @@
+"""
+Benchmark harness for the API.
+
+Runs the real FastAPI app over HTTP against MongoDB (or an in-memory
+stand-in), a fake Docker engine, a fake Cloudflare API and a no-op nginx,
+so the pipeline and the dashboard endpoints can be timed without a host
+set up for deployments. See `python -m benchmarks.run --help`.
+"""
@@ -0,0 +1,231 @@
+"""
+Local stand-ins for the Docker engine, the Cloudflare API, nginx and the
+GitHub repository a deployment is cloned from.
+"""
+import os
+import time
+import uuid
+import shutil
+import asyncio
+import socket
+import subprocess
+import threading
+from contextlib import contextmanager
+from typing import Dict, Any, List, Optional
+
+import docker
+import uvicorn
+from fastapi import FastAPI, Request
+from git import Repo
+
+from services import NginxService, CloudflareService
+
+def free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+class FakeContainer:
+    """Enough of docker.models.containers.Container for the pipeline, cleanup and readiness code"""
+
+    def __init__(self, engine: "FakeDockerClient", image: str, name: str, host_port: Optional[int], labels: Optional[Dict[str, str]] = None):
+        self._engine = engine
+        self.id = uuid.uuid4().hex
+        self.name = name
+        self.image = image
+        self.labels = labels or {}
+        self.ports = {"3000/tcp": [{"HostIp": "0.0.0.0", "HostPort": str(host_port)}]} if host_port else {}
+        self.status = "running"
+
+    @property
+    def attrs(self) -> Dict[str, Any]:
+        # A HEALTHCHECK that already passes, so readiness never probes the network
+        return {
+            "State": {"Status": self.status, "Health": {"Status": "healthy"}},
+            "Config": {"Healthcheck": {"Test": ["CMD", "true"]}}
+        }
+
+    def start(self):
+        time.sleep(self._engine.start_latency)
+        self.status = "running"
+
+    def stop(self):
+        self.status = "exited"
+
+    def remove(self):
+        self._engine.containers.discard(self.id)
+
+class FakeContainers:
+    def __init__(self, engine: "FakeDockerClient"):
+        self._engine = engine
+        self._containers: Dict[str, FakeContainer] = {}
+        self._lock = threading.Lock()
+
+    def run(
+        self,
+        image: str,
+        name: str = "",
+        ports: Optional[Dict[str, int]] = None,
+        labels: Optional[Dict[str, str]] = None,
+        **kwargs
+    ) -> FakeContainer:
+        time.sleep(self._engine.start_latency)
+        host_port = next(iter((ports or {}).values()), None)
+        container = FakeContainer(self._engine, image, name, host_port, labels)
+        with self._lock:
+            self._containers[container.id] = container
+        return container
+
+    def get(self, container_id: str) -> FakeContainer:
+        container = self._containers.get(container_id)
+        if container is None:
+            raise docker.errors.NotFound(f"No such container: {container_id}")
+        return container
+
+    def list(self, *args, **kwargs) -> List[FakeContainer]:
+        with self._lock:
+            return list(self._containers.values())
+
+    def discard(self, container_id: str):
+        with self._lock:
+            self._containers.pop(container_id, None)
+
+class FakeImages:
+    def __init__(self):
+        self.tags = set()
+
+    def remove(self, image_tag: str, **kwargs):
+        if image_tag not in self.tags:
+            raise docker.errors.ImageNotFound(f"No such image: {image_tag}")
+        self.tags.discard(image_tag)
+
+    def prune(self, filters=None):
+        return {"ImagesDeleted": None, "SpaceReclaimed": 0}
+
+class FakeBuildAPI:
+    def __init__(self, engine: "FakeDockerClient"):
+        self._engine = engine
+        # requests' session hooks; there is no HTTP response to hand them, so none are called
+        self.hooks = {"response": []}
+
+    def build(self, path: str, tag: str, **kwargs):
+        """Stream one "Step n/m" line per Dockerfile instruction, spreading build_latency across them"""
+        with open(os.path.join(path, "Dockerfile")) as f:
+            instructions = [line.strip() for line in f if line.strip() and not line.lstrip().startswith("#")]
+        step_latency = self._engine.build_latency / max(len(instructions), 1)
+        for index, instruction in enumerate(instructions, 1):
+            yield {"stream": f"Step {index}/{len(instructions)} : {instruction}\n"}
+            time.sleep(step_latency)
+        self._engine.images.tags.add(tag)
+        yield {"stream": f"Successfully tagged {tag}\n"}
+
+class FakeDockerClient:
+    """Stands in for docker.DockerClient; register it with register_engine_client("local", ...)"""
+
+    def __init__(self, build_latency: float = 2.0, start_latency: float = 0.05):
+        self.build_latency = build_latency
+        self.start_latency = start_latency
+        self.containers = FakeContainers(self)
+        self.images = FakeImages()
+        self.api = FakeBuildAPI(self)
+
+    def ping(self) -> bool:
+        return True
+
+def create_cloudflare_app(latency: float = 0.0) -> FastAPI:
+    """The slice of the Cloudflare v4 DNS API that CloudflareService calls, kept in memory"""
+    app = FastAPI()
+    records: Dict[str, Dict[str, Any]] = {}
+
+    @app.get("/zones/{zone_id}/dns_records")
+    async def list_records(zone_id: str, name: Optional[str] = None):
+        await asyncio.sleep(latency)
+        result = [record for record in records.values() if name is None or record["name"] == name]
+        return {"success": True, "result": result}
+
+    @app.post("/zones/{zone_id}/dns_records")
+    async def create_record(zone_id: str, request: Request):
+        await asyncio.sleep(latency)
+        body = await request.json()
+        base_domain = os.getenv("BASE_DOMAIN", "yourdomain.com")
+        record = {**body, "id": uuid.uuid4().hex, "name": f"{body['name']}.{base_domain}"}
+        records[record["id"]] = record
+        return {"success": True, "result": record}
+
+    @app.delete("/zones/{zone_id}/dns_records/{record_id}")
+    async def delete_record(zone_id: str, record_id: str):
+        await asyncio.sleep(latency)
+        records.pop(record_id, None)
+        return {"success": True, "result": {"id": record_id}}
+
+    return app
+
+class BackgroundServer:
+    """Serve an ASGI app with uvicorn on a free local port inside the running event loop"""
+
+    def __init__(self, app, port: Optional[int] = None):
+        self.port = port or free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.server = uvicorn.Server(uvicorn.Config(
+            app, host="127.0.0.1", port=self.port, lifespan="off", log_level="warning", access_log=False
+        ))
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        self._task = asyncio.create_task(self.server.serve())
+        while not self.server.started:
+            if self._task.done():
+                self._task.result()
+            await asyncio.sleep(0.01)
+
+    async def stop(self):
+        self.server.should_exit = True
+        if self._task:
+            await self._task
+
+def _local_run_command(self, args: list) -> subprocess.CompletedProcess:
+    # Files are installed into the harness's temp dir; nginx -t and reloads always succeed
+    if args[:2] == ["sudo", "mv"]:
+        shutil.move(args[2], args[3])
+    elif args[:3] == ["sudo", "mkdir", "-p"]:
+        os.makedirs(args[3], exist_ok=True)
+    elif args[:3] == ["sudo", "rm", "-f"]:
+        for path in args[3:]:
+            if os.path.exists(path):
+                os.remove(path)
+    return subprocess.CompletedProcess(args, 0, "", "")
+
+def _skip_tunnel_reload(self, check: bool = True):
+    pass
+
+@contextmanager
+def local_host_commands():
+    """Keep nginx commands and cloudflared reloads inside the harness while it runs"""
+    run_command, reload_tunnel = NginxService.run_command, CloudflareService.reload_tunnel
+    NginxService.run_command = _local_run_command
+    CloudflareService.reload_tunnel = _skip_tunnel_reload
+    try:
+        yield
+    finally:
+        NginxService.run_command = run_command
+        CloudflareService.reload_tunnel = reload_tunnel
+
+def create_repository(path: str) -> str:
+    """A one-commit static site repository; returns a URL `git clone` accepts"""
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, "index.html"), "w") as f:
+        f.write("<!doctype html><title>bench</title><p>ok</p>\n")
+    repo = Repo.init(path)
+    repo.index.add(["index.html"])
+    repo.index.commit("Initial commit")
+    return f"file://{path}"
+
+def write_tunnel_config(path: str):
+    with open(path, "w") as f:
+        f.write(
+            "tunnel: bench-tunnel\n"
+            "ingress:\n"
+            "  - hostname: dashboard.bench.local\n"
+            "    service: http://localhost:3000\n"
+            "  - service: http_status:404\n"
+        )
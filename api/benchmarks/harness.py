@@ -0,0 +1,168 @@
+import os
+import math
+import shutil
+import tempfile
+import logging
+from datetime import timedelta
+from typing import Dict, List, Optional
+
+import httpx
+
+from models import mongodb, create_indexes, deployment_cache
+from services.docker_service import register_engine_client, forget_engine_client, LOCAL_ENGINE
+from utils.auth import create_access_token, ADMIN_USERNAME
+from .fakes import (
+    FakeDockerClient,
+    BackgroundServer,
+    create_cloudflare_app,
+    create_repository,
+    write_tunnel_config,
+    local_host_commands
+)
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    """count, nearest-rank p50/p95 and max of samples given in seconds, reported in ms"""
+    if not samples:
+        return {"count": 0}
+    values = sorted(samples)
+
+    def percentile(fraction: float) -> float:
+        return round(values[max(0, math.ceil(fraction * len(values)) - 1)] * 1000, 2)
+
+    return {"count": len(values), "p50_ms": percentile(0.5), "p95_ms": percentile(0.95), "max_ms": round(values[-1] * 1000, 2)}
+
+class Harness:
+    """
+    One isolated run of the API: a fresh database, a temp dir for nginx and
+    cloudflared files, the fake engine and Cloudflare API, and the app served
+    over HTTP so background deploy tasks run the way they do in production.
+    """
+
+    def __init__(
+        self,
+        mongo_url: Optional[str] = None,
+        build_latency: float = 2.0,
+        start_latency: float = 0.05,
+        cloudflare_latency: float = 0.02
+    ):
+        self.mongo_url = mongo_url
+        self.build_latency = build_latency
+        self.start_latency = start_latency
+        self.cloudflare_latency = cloudflare_latency
+        self.workdir = None
+        self.repo_url = None
+        self.engine = None
+        self.client: Optional[httpx.AsyncClient] = None
+        self._servers: List[BackgroundServer] = []
+        self._host_commands = None
+        self._saved_env: Dict[str, Optional[str]] = {}
+        self._database_name = f"deployment_lab_bench_{os.getpid()}"
+
+    def _set_env(self, **values: str):
+        for key, value in values.items():
+            self._saved_env.setdefault(key, os.environ.get(key))
+            os.environ[key] = value
+
+    async def _connect_database(self):
+        if self.mongo_url:
+            from motor.motor_asyncio import AsyncIOMotorClient
+            mongodb.client = AsyncIOMotorClient(self.mongo_url)
+        else:
+            try:
+                from mongomock_motor import AsyncMongoMockClient
+            except ImportError:
+                raise SystemExit("Install mongomock-motor or pass --mongo-url to benchmark against a real MongoDB")
+            mongodb.client = AsyncMongoMockClient()
+        mongodb.database = mongodb.client[self._database_name]
+        await create_indexes()
+
+    async def start(self):
+        self.workdir = tempfile.mkdtemp(prefix="deployment-lab-bench-")
+        cloudflare = BackgroundServer(create_cloudflare_app(self.cloudflare_latency))
+        await cloudflare.start()
+        self._servers.append(cloudflare)
+
+        tunnel_config = os.path.join(self.workdir, "cloudflared.yml")
+        write_tunnel_config(tunnel_config)
+        os.makedirs(os.path.join(self.workdir, "sites-enabled"))
+        self._set_env(
+            BASE_DOMAIN="bench.local",
+            CLOUDFLARE_API_URL=cloudflare.url,
+            CLOUDFLARE_API_TOKEN="bench-token",
+            CLOUDFLARE_ZONE_ID="bench-zone",
+            CLOUDFLARE_TUNNEL_ID="bench-tunnel",
+            CLOUDFLARED_CONFIG=tunnel_config,
+            NGINX_CONFIG_PATH=self.workdir,
+            NGINX_ENABLED_PATH=os.path.join(self.workdir, "sites-enabled"),
+            NGINX_MAPPING_FILE=os.path.join(self.workdir, "subdomain-map.conf"),
+            NGINX_UPSTREAMS_FILE=os.path.join(self.workdir, "deployment-upstreams.conf"),
+            NGINX_UPSTREAMS_DIR=os.path.join(self.workdir, "deployment-upstreams.d"),
+            NGINX_PROXY_SNIPPET=os.path.join(self.workdir, "deployment-proxy.conf"),
+            NGINX_WILDCARD_CONFIG=os.path.join(self.workdir, "wildcard.conf"),
+            NGINX_ACTIVITY_LOG=os.path.join(self.workdir, "activity.log"),
+            # Capacity and ports are not what's being measured
+            ADMISSION_MODE="reject",
+            HOST_CPUS="100000",
+            HOST_MEMORY_MB="100000000",
+            HOST_PIDS="100000000",
+            MIN_PORT="20000",
+            MAX_PORT="60000",
+            DEPLOYMENT_CACHE_WATCH="false"
+        )
+        self._host_commands = local_host_commands()
+        self._host_commands.__enter__()
+
+        self.engine = FakeDockerClient(self.build_latency, self.start_latency)
+        register_engine_client(LOCAL_ENGINE, self.engine)
+        self.repo_url = create_repository(os.path.join(self.workdir, "repo"))
+
+        await self._connect_database()
+        deployment_cache.invalidate()
+
+        from main import app
+        logging.getLogger("main").setLevel(logging.WARNING)
+        api = BackgroundServer(app)
+        await api.start()
+        self._servers.append(api)
+
+        token = create_access_token({"sub": ADMIN_USERNAME}, timedelta(hours=12))
+        self.client = httpx.AsyncClient(
+            base_url=api.url,
+            headers={"Authorization": f"Bearer {token}"},
+            timeout=120,
+            limits=httpx.Limits(max_connections=None, max_keepalive_connections=None)
+        )
+        return self
+
+    async def stop(self):
+        if self.client:
+            await self.client.aclose()
+        for server in reversed(self._servers):
+            await server.stop()
+        if mongodb.client:
+            if self.mongo_url:
+                await mongodb.client.drop_database(self._database_name)
+            if hasattr(mongodb.client, "close"):
+                mongodb.client.close()
+            mongodb.client = mongodb.database = None
+        forget_engine_client(LOCAL_ENGINE)
+        deployment_cache.invalidate()
+        if self._host_commands:
+            self._host_commands.__exit__(None, None, None)
+        for key, value in self._saved_env.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+        if self.workdir:
+            shutil.rmtree(self.workdir, ignore_errors=True)
+
+    async def __aenter__(self):
+        try:
+            return await self.start()
+        except BaseException:
+            await self.stop()
+            raise
+
+    async def __aexit__(self, *exc_info):
+        await self.stop()
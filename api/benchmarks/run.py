@@ -0,0 +1,213 @@
+"""
+Run benchmark scenarios and compare them with stored baselines.
+
+    python -m benchmarks.run                              # every scenario, in-memory MongoDB
+    python -m benchmarks.run -s polling_fanout --mongo-url mongodb://localhost:27017
+    python -m benchmarks.run -s json_throughput           # FAST_JSON off vs on
+    python -m benchmarks.run --save-baseline              # record the current numbers
+    python -m benchmarks.run --against HEAD~1             # compare with another revision on this machine
+
+Exits with status 1 when a scenario errors (such as a request answered 500),
+reports a correctness problem, or has a latency more than --tolerance above
+its baseline (or above the --against revision's).
+"""
+import os
+import io
+import sys
+import json
+import shutil
+import asyncio
+import tempfile
+import subprocess
+import argparse
+import contextlib
+from datetime import datetime
+from typing import Dict, Any, List, Optional
+
+from .harness import Harness
+from .scenarios import SCENARIOS
+
+BASELINE_DIR = os.path.join(os.path.dirname(__file__), "baselines")
+
+def scenario_params(name: str, args: argparse.Namespace) -> Dict[str, Any]:
+    if name == "deploy_burst":
+        return {"deployments": args.deployments}
+    if name == "deploy_lifecycle":
+        return {"deployments": args.lifecycle_deployments}
+    if name == "polling_fanout":
+        return {"deployments": args.seed, "clients": args.clients, "polls": args.polls}
+    if name == "json_throughput":
+        return {"deployments": args.seed, "lines": args.json_log_lines, "requests": args.json_requests}
+    return {"lines": args.log_lines, "tailers": args.tailers, "storage": args.log_storage}
+
+def baseline_path(name: str, args: argparse.Namespace) -> str:
+    backend = "mongodb" if args.mongo_url else "mongomock"
+    return os.path.join(args.baseline_dir, f"{name}.{backend}.json")
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float, label: str = "baseline") -> List[str]:
+    regressions = []
+    for key, value in results.items():
+        previous = baseline.get(key)
+        if not key.endswith("_ms") or not previous:
+            continue
+        if value > previous * (1 + tolerance):
+            regressions.append(f"{key}: {value} ms vs {label} {previous} ms (+{(value / previous - 1) * 100:.0f}%)")
+    return regressions
+
+def correctness(results: Dict[str, Any]) -> List[str]:
+    """Problems a scenario reports in its results, whatever the baseline says"""
+    problems = []
+    if results.get("failed"):
+        problems.append(f"{results['failed']} deployments failed")
+    for key, value in results.items():
+        if key.endswith("_identical") and value is False:
+            problems.append(f"{key} is false")
+    return problems
+
+def forwarded_args(args: argparse.Namespace) -> List[str]:
+    """The options that shape a scenario's numbers, to run it the same way elsewhere"""
+    forwarded = [
+        "--build-latency", str(args.build_latency),
+        "--cloudflare-latency", str(args.cloudflare_latency),
+        "--deployments", str(args.deployments),
+        "--lifecycle-deployments", str(args.lifecycle_deployments),
+        "--seed", str(args.seed),
+        "--clients", str(args.clients),
+        "--polls", str(args.polls),
+        "--log-lines", str(args.log_lines),
+        "--tailers", str(args.tailers),
+        "--log-storage", args.log_storage,
+        "--json-log-lines", str(args.json_log_lines),
+        "--json-requests", str(args.json_requests)
+    ]
+    if args.mongo_url:
+        forwarded += ["--mongo-url", args.mongo_url]
+    return forwarded
+
+def run_reference(name: str, args: argparse.Namespace) -> Optional[Dict[str, Any]]:
+    """
+    The scenario's results with the API at the --against revision, measured
+    on this machine. The revision is checked out in a temporary worktree and
+    given this tree's benchmarks package, so only the code under test differs.
+    None if the reference run fails.
+    """
+    benchmarks_dir = os.path.dirname(os.path.abspath(__file__))
+    api_dir = os.path.dirname(benchmarks_dir)
+    root = subprocess.run(["git", "rev-parse", "--show-toplevel"], cwd=api_dir, capture_output=True, text=True, check=True).stdout.strip()
+    with tempfile.TemporaryDirectory(prefix="deployment-lab-reference-") as workdir:
+        worktree = os.path.join(workdir, "tree")
+        subprocess.run(["git", "worktree", "add", "--detach", worktree, args.against], cwd=root, capture_output=True, text=True, check=True)
+        try:
+            reference_api = os.path.join(worktree, os.path.relpath(api_dir, root))
+            shutil.rmtree(os.path.join(reference_api, "benchmarks"), ignore_errors=True)
+            shutil.copytree(benchmarks_dir, os.path.join(reference_api, "benchmarks"), ignore=shutil.ignore_patterns("__pycache__", "baselines"))
+            results_file = os.path.join(workdir, "results.json")
+            subprocess.run(
+                [sys.executable, "-m", "benchmarks.run", "-s", name, "--results-file", results_file, *forwarded_args(args)],
+                cwd=reference_api,
+                stdout=subprocess.DEVNULL
+            )
+            if not os.path.exists(results_file):
+                return None
+            with open(results_file) as f:
+                return json.load(f).get(name)
+        finally:
+            subprocess.run(["git", "worktree", "remove", "--force", worktree], cwd=root, capture_output=True)
+
+async def run_scenario(name: str, args: argparse.Namespace) -> Dict[str, Any]:
+    params = scenario_params(name, args)
+    harness = Harness(
+        mongo_url=args.mongo_url,
+        build_latency=args.build_latency,
+        cloudflare_latency=args.cloudflare_latency
+    )
+    # The API prints per-request debug output; keep the report readable
+    quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+    with quiet:
+        async with harness:
+            return await SCENARIOS[name](harness, **params)
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the deployment API against local stand-ins")
+    parser.add_argument("-s", "--scenario", action="append", choices=sorted(SCENARIOS), help="repeatable; default is every scenario")
+    parser.add_argument("--mongo-url", help="benchmark against this MongoDB instead of mongomock-motor")
+    parser.add_argument("--build-latency", type=float, default=2.0, help="seconds each fake image build takes")
+    parser.add_argument("--cloudflare-latency", type=float, default=0.02, help="seconds per fake Cloudflare API call")
+    parser.add_argument("--deployments", type=int, default=20, help="deploy_burst: concurrent deployments")
+    parser.add_argument("--lifecycle-deployments", type=int, default=3, help="deploy_lifecycle: deployments created and deleted in turn")
+    parser.add_argument("--seed", type=int, default=1000, help="polling_fanout, json_throughput: deployments in the database")
+    parser.add_argument("--clients", type=int, default=50, help="polling_fanout: polling dashboards")
+    parser.add_argument("--polls", type=int, default=20, help="polling_fanout: polls per dashboard")
+    parser.add_argument("--log-lines", type=int, default=100000, help="log_tailing: build log lines")
+    parser.add_argument("--tailers", type=int, default=10, help="log_tailing: concurrent readers")
+    parser.add_argument("--log-storage", choices=["lines", "chunks"], default="lines", help="log_tailing: build log storage format")
+    parser.add_argument("--json-log-lines", type=int, default=20000, help="json_throughput: build log lines")
+    parser.add_argument("--json-requests", type=int, default=40, help="json_throughput: reads per endpoint and mode")
+    parser.add_argument("--baseline-dir", default=BASELINE_DIR)
+    parser.add_argument("--save-baseline", action="store_true", help="store these results as the new baseline")
+    parser.add_argument("--against", metavar="REV", help="compare with the API at this git revision instead of the stored baseline")
+    parser.add_argument("--results-file", help="also write the results as JSON to this file")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown over baseline (0.2 = 20%%)")
+    parser.add_argument("-v", "--verbose", action="store_true", help="show the API's own output")
+    args = parser.parse_args()
+
+    failed = False
+    collected: Dict[str, Dict[str, Any]] = {}
+    for name in args.scenario or sorted(SCENARIOS):
+        print(f"\n{name}")
+        try:
+            results = asyncio.run(run_scenario(name, args))
+        except Exception as e:
+            print(f"  ERROR {type(e).__name__}: {e}")
+            failed = True
+            continue
+        for key, value in results.items():
+            print(f"  {key:<28} {value}")
+        problems = correctness(results)
+        for problem in problems:
+            print(f"  FAILED {problem}")
+        failed = failed or bool(problems)
+        collected[name] = results
+        if args.results_file:
+            with open(args.results_file, "w") as f:
+                json.dump(collected, f, indent=2)
+
+        if args.against:
+            reference = run_reference(name, args)
+            if reference is None:
+                print(f"  the run at {args.against} failed; not comparing")
+                continue
+            regressions = compare(results, reference, args.tolerance, args.against)
+            for regression in regressions:
+                print(f"  REGRESSION {regression}")
+            failed = failed or bool(regressions)
+            continue
+
+        path = baseline_path(name, args)
+        # Harness latencies shape the numbers as much as the scenario's own parameters
+        params = {**scenario_params(name, args), "build_latency": args.build_latency, "cloudflare_latency": args.cloudflare_latency}
+        if args.save_baseline:
+            os.makedirs(args.baseline_dir, exist_ok=True)
+            with open(path, "w") as f:
+                json.dump({"recorded_at": datetime.utcnow().isoformat(), "params": params, "results": results}, f, indent=2)
+                f.write("\n")
+            print(f"  baseline saved to {path}")
+            continue
+
+        if not os.path.exists(path):
+            print("  no baseline; run with --save-baseline to record one")
+            continue
+        with open(path) as f:
+            baseline = json.load(f)
+        if baseline["params"] != params:
+            print(f"  baseline was recorded with {baseline['params']}; not comparing")
+            continue
+        regressions = compare(results, baseline["results"], args.tolerance)
+        for regression in regressions:
+            print(f"  REGRESSION {regression}")
+        failed = failed or bool(regressions)
+
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,367 @@
+"""
+Each scenario takes a started Harness plus its parameters and returns a flat
+dict of results. Keys ending in _ms are latencies compared against the
+stored baseline; everything else is reported as context.
+"""
+import os
+import json
+import time
+import random
+import asyncio
+from typing import Dict, Any, List, Tuple
+
+from models import get_database, mark_deployments_changed, DeploymentModel, BuildLogModel, DeploymentStatus, LogLevel
+from services import TimelineService, NginxService, CloudflareService
+from services.log_service import log_writer, chunk_raw_logs
+from .harness import Harness, summarize
+
+def _flatten(prefix: str, summary: Dict[str, float]) -> Dict[str, float]:
+    return {f"{prefix}_{key}": value for key, value in summary.items()}
+
+async def deploy_burst(harness: Harness, deployments: int = 20, poll_interval: float = 0.05) -> Dict[str, Any]:
+    """Create deployments concurrently and time each one until it is running (or failed)"""
+    async def create(index: int):
+        started = time.monotonic()
+        response = await harness.client.post("/deployments/", json={
+            "github_url": harness.repo_url,
+            "subdomain": f"burst-{index}"
+        })
+        response.raise_for_status()
+        return response.json()["id"], started, time.monotonic() - started
+
+    burst_started = time.monotonic()
+    created = await asyncio.gather(*(create(index) for index in range(deployments)))
+    started_at = {deployment_id: started for deployment_id, started, _ in created}
+
+    from bson import ObjectId
+    db = get_database()
+    time_to_running: List[float] = []
+    failed = 0
+    pending = set(started_at)
+    while pending:
+        docs = await db.deployments.find(
+            {"_id": {"$in": [ObjectId(deployment_id) for deployment_id in pending]}},
+            {"status": 1}
+        ).to_list(length=None)
+        now = time.monotonic()
+        for doc in docs:
+            deployment_id = str(doc["_id"])
+            if doc["status"] == DeploymentStatus.RUNNING:
+                time_to_running.append(now - started_at[deployment_id])
+            elif doc["status"] == DeploymentStatus.FAILED:
+                failed += 1
+            else:
+                continue
+            pending.discard(deployment_id)
+        # Deleted (failed and cleaned up) deployments disappear from the query
+        for deployment_id in pending - {str(doc["_id"]) for doc in docs}:
+            failed += 1
+            pending.discard(deployment_id)
+        if pending:
+            await asyncio.sleep(poll_interval)
+
+    # The pipeline keeps going (nginx, cloudflare) after the status flips to running
+    while await db.deployment_timelines.count_documents({"kind": "deploy", "finished_at": None}):
+        await asyncio.sleep(poll_interval)
+
+    stage_stats = await TimelineService().stage_stats("deploy", deployments)
+    results: Dict[str, Any] = {
+        "deployments": deployments,
+        "failed": failed,
+        "wall_s": round(time.monotonic() - burst_started, 2),
+        **_flatten("create", summarize([latency for _, _, latency in created])),
+        **_flatten("time_to_running", summarize(time_to_running))
+    }
+    for stage in ("clone", "build", "readiness", "nginx", "cloudflare", "total"):
+        if stage in stage_stats["stages"]:
+            results[f"stage_{stage}_p95_ms"] = stage_stats["stages"][stage]["p95_ms"]
+    return results
+
+async def deploy_lifecycle(
+    harness: Harness,
+    deployments: int = 3,
+    poll_interval: float = 0.05,
+    timeout: float = 60.0
+) -> Dict[str, Any]:
+    """
+    Create, wait for and delete deployments one at a time through the API,
+    checking every answer and that nginx and the tunnel route each host while
+    it exists. Any request that errors fails the run; a deployment that never
+    comes up or isn't routed is counted in "failed".
+    """
+    nginx_service, cloudflare_service = NginxService(), CloudflareService()
+
+    def routed(host: str) -> bool:
+        try:
+            with open(nginx_service.mapping_file) as f:
+                mapped = any(line.split()[:1] == [host] for line in f)
+        except FileNotFoundError:
+            mapped = False
+        return mapped and host in cloudflare_service.read_tunnel_routes()
+
+    async def wait_for(predicate, what: str):
+        deadline = time.monotonic() + timeout
+        while not await predicate():
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Timed out after {timeout:.0f}s waiting for {what}")
+            await asyncio.sleep(poll_interval)
+
+    create_latency: List[float] = []
+    time_to_running: List[float] = []
+    time_to_deleted: List[float] = []
+    failed = 0
+    for index in range(deployments):
+        subdomain = f"lifecycle-{index}"
+        host = f"{subdomain}.{nginx_service.base_domain}"
+        started = time.monotonic()
+        response = await harness.client.post("/deployments/", json={"github_url": harness.repo_url, "subdomain": subdomain})
+        response.raise_for_status()
+        create_latency.append(time.monotonic() - started)
+        deployment_id = response.json()["id"]
+
+        status = None
+
+        async def settled() -> bool:
+            nonlocal status
+            response = await harness.client.get(f"/deployments/{deployment_id}")
+            response.raise_for_status()
+            status = response.json()["status"]
+            return status in (DeploymentStatus.RUNNING, DeploymentStatus.FAILED)
+
+        await wait_for(settled, f"{subdomain} to finish deploying")
+        time_to_running.append(time.monotonic() - started)
+        # Routes are written after the status flips to running
+        while await get_database().deployment_timelines.count_documents({"kind": "deploy", "finished_at": None}):
+            await asyncio.sleep(poll_interval)
+        if status != DeploymentStatus.RUNNING or not routed(host):
+            failed += 1
+
+        started = time.monotonic()
+        response = await harness.client.delete(f"/deployments/{deployment_id}")
+        response.raise_for_status()
+
+        async def gone() -> bool:
+            response = await harness.client.get(f"/deployments/{deployment_id}")
+            if response.status_code == 404:
+                return True
+            response.raise_for_status()
+            return False
+
+        await wait_for(gone, f"{subdomain} to be deleted")
+        time_to_deleted.append(time.monotonic() - started)
+        if routed(host):
+            failed += 1
+
+    return {
+        "deployments": deployments,
+        "failed": failed,
+        **_flatten("create", summarize(create_latency)),
+        **_flatten("time_to_running", summarize(time_to_running)),
+        **_flatten("time_to_deleted", summarize(time_to_deleted))
+    }
+
+async def seed_deployments(count: int) -> List[str]:
+    db = get_database()
+    deployments = [
+        DeploymentModel(
+            name=f"seed-{index}",
+            github_url=f"https://github.com/bench/seed-{index}",
+            subdomain=f"seed-{index}",
+            port=20000 + index,
+            status=DeploymentStatus.RUNNING,
+            container_id=f"seed-container-{index}",
+            docker_image=f"seed-{index}:latest"
+        ).dict(by_alias=True)
+        for index in range(count)
+    ]
+    for start in range(0, count, 1000):
+        await db.deployments.insert_many(deployments[start:start + 1000])
+    await mark_deployments_changed()
+    return [str(deployment["_id"]) for deployment in deployments]
+
+async def polling_fanout(
+    harness: Harness,
+    deployments: int = 1000,
+    clients: int = 50,
+    polls: int = 20,
+    interval: float = 0.1,
+    write_interval: float = 0.5
+) -> Dict[str, Any]:
+    """Many dashboards polling the list (with ETags) and single statuses while deployments change underneath"""
+    deployment_ids = await seed_deployments(deployments)
+    list_latency: List[float] = []
+    status_latency: List[float] = []
+    not_modified = 0
+
+    async def dashboard():
+        nonlocal not_modified
+        etag = None
+        for _ in range(polls):
+            headers = {"If-None-Match": etag} if etag else {}
+            started = time.monotonic()
+            response = await harness.client.get("/deployments/", headers=headers)
+            list_latency.append(time.monotonic() - started)
+            if response.status_code == 304:
+                not_modified += 1
+            else:
+                response.raise_for_status()
+                etag = response.headers.get("ETag")
+
+            started = time.monotonic()
+            response = await harness.client.get(f"/deployments/{random.choice(deployment_ids)}/status")
+            status_latency.append(time.monotonic() - started)
+            response.raise_for_status()
+            await asyncio.sleep(interval)
+
+    async def writer():
+        # Status flips invalidate ETags and cached entries the way a live pipeline does
+        from bson import ObjectId
+        db = get_database()
+        while True:
+            await asyncio.sleep(write_interval)
+            deployment_id = random.choice(deployment_ids)
+            await db.deployments.update_one(
+                {"_id": ObjectId(deployment_id)},
+                {"$set": {"status": random.choice([DeploymentStatus.RUNNING, DeploymentStatus.HIBERNATED])}}
+            )
+            await mark_deployments_changed(deployment_id)
+
+    writes = asyncio.create_task(writer())
+    try:
+        await asyncio.gather(*(dashboard() for _ in range(clients)))
+    finally:
+        writes.cancel()
+
+    return {
+        "deployments": deployments,
+        "clients": clients,
+        "not_modified_ratio": round(not_modified / max(len(list_latency), 1), 3),
+        **_flatten("list", summarize(list_latency)),
+        **_flatten("status", summarize(status_latency))
+    }
+
+async def seed_build_logs(deployment_id: str, lines: int):
+    db = get_database()
+    for start in range(0, lines, 10000):
+        await db.build_logs.insert_many([
+            BuildLogModel(
+                deployment_id=deployment_id,
+                message=f"Step {index}: compiling module {index % 977} of the application bundle",
+                log_level=LogLevel.INFO
+            ).dict(by_alias=True)
+            for index in range(start, min(start + 10000, lines))
+        ])
+
+async def log_tailing(
+    harness: Harness,
+    lines: int = 100000,
+    tailers: int = 10,
+    reads: int = 5,
+    storage: str = "lines"
+) -> Dict[str, Any]:
+    """Dashboards reading one deployment's large build log in full, then polling for new lines after the last id"""
+    deployment_id = (await seed_deployments(1))[0]
+    await seed_build_logs(deployment_id, lines)
+    log_writer.storage = storage
+    if storage == "chunks":
+        await chunk_raw_logs(deployment_id, log_writer.chunk_lines)
+
+    full_latency: List[float] = []
+    tail_latency: List[float] = []
+    response_bytes = 0
+
+    async def tail():
+        nonlocal response_bytes
+        started = time.monotonic()
+        response = await harness.client.get(f"/deployments/{deployment_id}/logs")
+        full_latency.append(time.monotonic() - started)
+        response.raise_for_status()
+        response_bytes = len(response.content)
+        last_id = response.json()[-1]["id"]
+        for _ in range(reads):
+            await write_line()
+            started = time.monotonic()
+            response = await harness.client.get(f"/deployments/{deployment_id}/logs", params={"after": last_id})
+            tail_latency.append(time.monotonic() - started)
+            response.raise_for_status()
+            if response.json():
+                last_id = response.json()[-1]["id"]
+
+    async def write_line():
+        await log_writer.write(deployment_id, "Step n: still building")
+
+    try:
+        await asyncio.gather(*(tail() for _ in range(tailers)))
+    finally:
+        log_writer.storage = "lines"
+    return {
+        "lines": lines,
+        "tailers": tailers,
+        "response_kb": round(response_bytes / 1024, 1),
+        **_flatten("full_read", summarize(full_latency)),
+        **_flatten("tail", summarize(tail_latency))
+    }
+
+async def json_throughput(
+    harness: Harness,
+    deployments: int = 1000,
+    lines: int = 20000,
+    requests: int = 40,
+    concurrency: int = 4
+) -> Dict[str, Any]:
+    """A full page of the list and a full build log, read repeatedly with FAST_JSON off and then on"""
+    deployment_ids = await seed_deployments(deployments)
+    await seed_build_logs(deployment_ids[0], lines)
+    endpoints = {
+        "list": ("/deployments/", {"limit": min(deployments, 1000)}),
+        "logs": (f"/deployments/{deployment_ids[0]}/logs", {})
+    }
+
+    async def measure(path: str, params: Dict[str, Any]):
+        latencies: List[float] = []
+        slots = asyncio.Semaphore(concurrency)
+
+        async def read() -> bytes:
+            async with slots:
+                started = time.monotonic()
+                response = await harness.client.get(path, params=params)
+                latencies.append(time.monotonic() - started)
+                response.raise_for_status()
+                return response.content
+
+        started = time.monotonic()
+        bodies = await asyncio.gather(*(read() for _ in range(requests)))
+        return latencies, requests / (time.monotonic() - started), bodies[0]
+
+    results: Dict[str, Any] = {"deployments": deployments, "lines": lines, "requests": requests}
+    throughput: Dict[Tuple[str, str], float] = {}
+    bodies: Dict[Tuple[str, str], Any] = {}
+    saved = os.environ.get("FAST_JSON")
+    try:
+        for mode in ("standard", "fast"):
+            os.environ["FAST_JSON"] = "true" if mode == "fast" else "false"
+            for endpoint, (path, params) in endpoints.items():
+                latencies, per_second, body = await measure(path, params)
+                results.update(_flatten(f"{mode}_{endpoint}", summarize(latencies)))
+                results[f"{mode}_{endpoint}_rps"] = round(per_second, 1)
+                throughput[(mode, endpoint)] = per_second
+                bodies[(mode, endpoint)] = json.loads(body)
+    finally:
+        if saved is None:
+            os.environ.pop("FAST_JSON", None)
+        else:
+            os.environ["FAST_JSON"] = saved
+
+    for endpoint in endpoints:
+        results[f"{endpoint}_speedup"] = round(throughput[("fast", endpoint)] / throughput[("standard", endpoint)], 2)
+        # Both paths must answer with the same document
+        results[f"{endpoint}_identical"] = bodies[("fast", endpoint)] == bodies[("standard", endpoint)]
+    return results
+
+SCENARIOS = {
+    "deploy_burst": deploy_burst,
+    "deploy_lifecycle": deploy_lifecycle,
+    "polling_fanout": polling_fanout,
+    "log_tailing": log_tailing,
+    "json_throughput": json_throughput
+}
@@ -2,10 +2,17 @@ from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 import time
+import asyncio
 import logging
-from models import connect_to_mongo, close_mongo_connection, create_indexes
+from models import connect_to_mongo, close_mongo_connection, create_indexes, deployment_cache
 from app.auth import router as auth_router
-from app.deployments import router as deployments_router
+from app.deployments import router as deployments_router, run_deploy_resumer
+from app.nodes import router as nodes_router
+from app.wake import router as wake_router
+from app.metrics import router as metrics_router
+from services import HibernationService, LogService, ReconcileService, CloudflareService, stats_sampler
+from services.log_service import log_writer
+from services.metrics import REQUEST_DURATION, REQUESTS
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -16,8 +23,23 @@ async def lifespan(app: FastAPI):
     # Startup
     await connect_to_mongo()
     await create_indexes()
+    # With CLOUDFLARE_WILDCARD, deploys skip the Cloudflare steps once the wildcard is verified
+    await CloudflareService().ensure_wildcard()
+    resumer = asyncio.create_task(run_deploy_resumer())
+    idle_monitor = asyncio.create_task(HibernationService().run_idle_monitor())
+    cache_watcher = asyncio.create_task(deployment_cache.watch())
+    log_archiver = asyncio.create_task(LogService().run_archiver())
+    sampler = asyncio.create_task(stats_sampler.run())
+    reconciler = asyncio.create_task(ReconcileService().run_reconciler())
     yield
     # Shutdown
+    resumer.cancel()
+    idle_monitor.cancel()
+    cache_watcher.cancel()
+    log_archiver.cancel()
+    sampler.cancel()
+    reconciler.cancel()
+    await log_writer.flush()
     await close_mongo_connection()
 
 app = FastAPI(
@@ -38,6 +60,12 @@ async def log_requests(request: Request, call_next):
     process_time = time.time() - start_time
     logger.info(f"{request.method} {request.url.path} -> {response.status_code} ({process_time:.3f}s)")
     
+    # Label by route template, not the raw path, to keep the series count bounded
+    route = request.scope.get("route")
+    route_path = route.path if route else "unmatched"
+    REQUEST_DURATION.observe(process_time, request.method, route_path)
+    REQUESTS.inc(request.method, route_path, response.status_code)
+    
     return response
 
 # CORS middleware
@@ -47,11 +75,15 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Next-Cursor"],
 )
 
 # Include routers
 app.include_router(auth_router)
 app.include_router(deployments_router)
+app.include_router(nodes_router)
+app.include_router(wake_router)
+app.include_router(metrics_router)
 
 @app.get("/")
 async def read_root():
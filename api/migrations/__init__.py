@@ -0,0 +1 @@
+"""One-off data migrations, run from api/ with `python -m migrations.<name>`."""
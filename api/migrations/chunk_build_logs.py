@@ -0,0 +1,33 @@
+"""
+Move existing build_logs lines into log_chunks.
+
+Set LOG_STORAGE=chunks on the API first, so no new per-line documents are
+written while this runs. Safe to interrupt and rerun:
+
+    python -m migrations.chunk_build_logs [--dry-run]
+"""
+import sys
+import asyncio
+from models import connect_to_mongo, close_mongo_connection, create_indexes, get_database
+from services.log_service import log_writer, chunk_raw_logs
+
+async def migrate(dry_run: bool = False) -> int:
+    await connect_to_mongo()
+    try:
+        await create_indexes()
+        db = get_database()
+        total = 0
+        for deployment_id in await db.build_logs.distinct("deployment_id"):
+            if dry_run:
+                lines = await db.build_logs.count_documents({"deployment_id": deployment_id})
+            else:
+                lines = await chunk_raw_logs(deployment_id, log_writer.chunk_lines)
+            print(f"{deployment_id}: {lines} lines")
+            total += lines
+        print(f"{'Would migrate' if dry_run else 'Migrated'} {total} lines into chunks of up to {log_writer.chunk_lines}")
+        return total
+    finally:
+        await close_mongo_connection()
+
+if __name__ == "__main__":
+    asyncio.run(migrate(dry_run="--dry-run" in sys.argv[1:]))
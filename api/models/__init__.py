@@ -1,13 +1,29 @@
-from .database import mongodb, get_database, connect_to_mongo, close_mongo_connection, create_indexes
+from .database import (
+    mongodb,
+    get_database,
+    connect_to_mongo,
+    close_mongo_connection,
+    create_indexes,
+    mark_deployments_changed,
+    get_deployments_version
+)
+from .cache import deployment_cache, DeploymentCache
 from .schemas import (
     UserModel, 
     DeploymentModel, 
     PortRegistryModel, 
     BuildLogModel, 
     DeploymentStatus, 
+    BuildLane,
     LogLevel,
     DeploymentCreate,
     DeploymentResponse,
+    ResourceProfile,
+    PlacementConstraints,
+    ProxySettings,
+    NodeModel,
+    NodeStatus,
+    ReplicaInstance,
     PyObjectId
 )
 
@@ -17,13 +33,24 @@ __all__ = [
     "connect_to_mongo", 
     "close_mongo_connection",
     "create_indexes",
+    "mark_deployments_changed",
+    "get_deployments_version",
+    "deployment_cache",
+    "DeploymentCache",
     "UserModel",
     "DeploymentModel", 
     "PortRegistryModel",
     "BuildLogModel",
     "DeploymentStatus",
+    "BuildLane",
     "LogLevel",
     "DeploymentCreate",
     "DeploymentResponse",
+    "ResourceProfile",
+    "PlacementConstraints",
+    "ProxySettings",
+    "NodeModel",
+    "NodeStatus",
+    "ReplicaInstance",
     "PyObjectId"
 ]
\ No newline at end of file
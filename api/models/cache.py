@@ -0,0 +1,124 @@
+import os
+import time
+import asyncio
+from collections import OrderedDict
+from typing import Dict, Any, Optional
+from pymongo.errors import OperationFailure
+from .database import get_database
+
+class DeploymentCache:
+    """
+    Read-through cache of deployment documents by id, bounded by a TTL and an
+    LRU size limit. Our own writes invalidate entries through
+    mark_deployments_changed; writes from other processes are picked up by the
+    change stream watcher when Mongo runs as a replica set, and by the TTL
+    otherwise. Cached documents are shared, so callers must not mutate them.
+    """
+
+    def __init__(self):
+        self.ttl = float(os.getenv("DEPLOYMENT_CACHE_TTL", "30"))
+        self.max_size = int(os.getenv("DEPLOYMENT_CACHE_SIZE", "1000"))
+        self.watch_enabled = os.getenv("DEPLOYMENT_CACHE_WATCH", "true").lower() == "true"
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._loading: Dict[str, asyncio.Future] = {}
+        # Bumped on every invalidation so a load that raced a write isn't stored
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.watching = False
+
+    async def get(self, deployment_id: str) -> Optional[Dict[str, Any]]:
+        from bson import ObjectId
+        if not ObjectId.is_valid(deployment_id):
+            return None
+
+        entry = self._entries.get(deployment_id)
+        if entry and entry[1] > time.monotonic():
+            self._entries.move_to_end(deployment_id)
+            self.hits += 1
+            return entry[0]
+
+        self.misses += 1
+        loading = self._loading.get(deployment_id)
+        if loading:
+            self.coalesced += 1
+            return await asyncio.shield(loading)
+
+        # Concurrent misses for the same id share one query
+        loading = asyncio.ensure_future(self._load(deployment_id))
+        self._loading[deployment_id] = loading
+        return await asyncio.shield(loading)
+
+    async def _load(self, deployment_id: str) -> Optional[Dict[str, Any]]:
+        from bson import ObjectId
+        generation = self._generation
+        try:
+            db = get_database()
+            deployment = await db.deployments.find_one({"_id": ObjectId(deployment_id)})
+            if deployment and generation == self._generation:
+                self._entries[deployment_id] = (deployment, time.monotonic() + self.ttl)
+                self._entries.move_to_end(deployment_id)
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+            return deployment
+        finally:
+            self._loading.pop(deployment_id, None)
+
+    def invalidate(self, *deployment_ids: str):
+        """Drop the given deployments, or everything when called without ids"""
+        self._generation += 1
+        if not deployment_ids:
+            self._entries.clear()
+            return
+        for deployment_id in deployment_ids:
+            self._entries.pop(str(deployment_id), None)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+            "change_stream": self.watching
+        }
+
+    async def watch(self):
+        """Background loop started with the API: invalidate on writes made by other processes"""
+        if not self.watch_enabled:
+            return
+
+        while True:
+            try:
+                db = get_database()
+                async with db.deployments.watch() as stream:
+                    self.watching = True
+                    # Anything written while we weren't watching may be stale
+                    self.invalidate()
+                    async for change in stream:
+                        document_key = change.get("documentKey") or {}
+                        if "_id" in document_key:
+                            self.invalidate(str(document_key["_id"]))
+                        else:
+                            self.invalidate()
+            except asyncio.CancelledError:
+                raise
+            except OperationFailure as e:
+                self.watching = False
+                # Change streams need a replica set; a standalone server relies on the TTL
+                if e.code in (40573, 40324):
+                    print("Deployment cache: change streams unavailable, relying on TTL expiry")
+                    return
+                print(f"Deployment cache change stream failed: {e}")
+            except Exception as e:
+                self.watching = False
+                print(f"Deployment cache change stream failed: {e}")
+
+            self.invalidate()
+            await asyncio.sleep(5)
+
+deployment_cache = DeploymentCache()
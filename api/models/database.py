@@ -1,12 +1,15 @@
 import os
 from motor.motor_asyncio import AsyncIOMotorClient
 from pymongo import MongoClient
+from pymongo.errors import OperationFailure
 from dotenv import load_dotenv
 
 load_dotenv()
 
 MONGODB_URL = os.getenv("MONGODB_URL", "mongodb://localhost:27017")
 DATABASE_NAME = os.getenv("DATABASE_NAME", "deployment_lab")
+# Raw build log lines expire after this many days (0 keeps them); the archiver moves them out first
+BUILD_LOG_RETENTION_DAYS = float(os.getenv("BUILD_LOG_RETENTION_DAYS", "14"))
 
 class MongoDB:
     client: AsyncIOMotorClient = None
@@ -34,10 +37,53 @@ async def close_mongo_connection():
 def get_database():
     return mongodb.database
 
+async def mark_deployments_changed(*deployment_ids):
+    """
+    Call after every write to deployments: drops the written ids (or, without
+    ids, every entry) from the deployment cache and advances the collection version
+    """
+    from .cache import deployment_cache
+    deployment_cache.invalidate(*deployment_ids)
+    db = get_database()
+    await db.counters.update_one({"_id": "deployments"}, {"$inc": {"version": 1}}, upsert=True)
+
+async def get_deployments_version() -> int:
+    db = get_database()
+    counter = await db.counters.find_one({"_id": "deployments"})
+    return counter["version"] if counter else 0
+
+async def _ensure_ttl_index(collection, field: str, name: str, expire_after: int):
+    try:
+        await collection.create_index(field, name=name, expireAfterSeconds=expire_after)
+    except OperationFailure:
+        # The index exists with an older retention; change it in place
+        await get_database().command("collMod", collection.name, index={"name": name, "expireAfterSeconds": expire_after})
+
 async def create_indexes():
     db = get_database()
     
     await db.deployments.create_index("subdomain", unique=True)
     await db.deployments.create_index("port", unique=True)
     await db.port_registry.create_index("port", unique=True)
-    await db.users.create_index("username", unique=True)
\ No newline at end of file
+    await db.users.create_index("username", unique=True)
+    await db.nodes.create_index("name", unique=True)
+    await db.deployments.create_index("node")
+    await db.deployments.create_index([("status", 1), ("created_at", 1), ("_id", 1)])
+    await db.deployments.create_index([("created_at", 1), ("_id", 1)])
+    await db.deployments.create_index([("name", 1), ("_id", 1)])
+    await db.deployment_timelines.create_index([("deployment_id", 1), ("started_at", 1)])
+    await db.deployment_timelines.create_index([("kind", 1), ("started_at", -1)])
+    await db.build_logs.create_index([("deployment_id", 1), ("timestamp", 1)])
+    # No stemming or stop words: log text is identifiers, paths and error codes, not prose
+    await db.build_logs.create_index([("message", "text")], default_language="none")
+    await db.log_chunks.create_index([("deployment_id", 1), ("started_at", 1), ("_id", 1)])
+    await db.log_chunks.create_index([("messages", "text")], default_language="none")
+    await db.log_archives.create_index("deployment_id", unique=True)
+    await db.build_queue.create_index([("state", 1), ("user_id", 1)])
+    await db.build_queue.create_index([("user_id", 1), ("finish_tag", -1)])
+    
+    if BUILD_LOG_RETENTION_DAYS > 0:
+        expire_after = int(BUILD_LOG_RETENTION_DAYS * 86400)
+        await _ensure_ttl_index(db.build_logs, "timestamp", "build_logs_ttl", expire_after)
+        # A chunk expires with its newest line
+        await _ensure_ttl_index(db.log_chunks, "ended_at", "log_chunks_ttl", expire_after)
\ No newline at end of file
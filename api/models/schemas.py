@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field, ConfigDict, field_validator
-from typing import Optional, Dict, Any, Annotated
+from typing import Optional, Dict, Any, List, Annotated
 from datetime import datetime
 from enum import Enum
 from bson import ObjectId
@@ -21,6 +21,16 @@ class DeploymentStatus(str, Enum):
     RUNNING = "running"
     FAILED = "failed"
     STOPPED = "stopped"
+    HIBERNATED = "hibernated"
+
+class NodeStatus(str, Enum):
+    ACTIVE = "active"
+    DRAINING = "draining"
+    DRAINED = "drained"
+
+class BuildLane(str, Enum):
+    PRODUCTION = "production"
+    PREVIEW = "preview"
 
 class LogLevel(str, Enum):
     INFO = "info"
@@ -28,6 +38,42 @@ class LogLevel(str, Enum):
     DEBUG = "debug"
     WARNING = "warning"
 
+class ResourceProfile(BaseModel):
+    # Zero would mean "unlimited" to Docker while counting as nothing against capacity.
+    # The upper bounds are what a single host can have (pids: the kernel's PID_MAX_LIMIT).
+    cpus: float = Field(default=0.5, gt=0, le=1024)
+    memory_mb: int = Field(default=512, gt=0, le=4 * 1024 * 1024)
+    pids: int = Field(default=256, gt=0, le=4 * 1024 * 1024)
+
+class PlacementConstraints(BaseModel):
+    # Node labels that must all match for a node to be eligible
+    labels: Dict[str, str] = Field(default_factory=dict)
+    # Node label to spread a group across (e.g. "zone"); None spreads across nodes
+    spread_by: Optional[str] = None
+    # Deployments sharing a spread group avoid landing in the same domain; defaults to the repo URL
+    spread_group: Optional[str] = None
+
+# nginx time values such as 500ms, 30s or 5m
+NGINX_TIME = r"^\d+(ms|s|m|h|d)?$"
+
+class ProxySettings(BaseModel):
+    # Unset values fall back to the UPSTREAM_* and PROXY_* environment defaults
+    keepalive: Optional[int] = Field(default=None, ge=0)
+    keepalive_timeout: Optional[str] = Field(default=None, pattern=NGINX_TIME)
+    keepalive_requests: Optional[int] = Field(default=None, ge=1)
+    # Per container; 0 is unlimited
+    max_conns: Optional[int] = Field(default=None, ge=0)
+    max_fails: Optional[int] = Field(default=None, ge=0)
+    fail_timeout: Optional[str] = Field(default=None, pattern=NGINX_TIME)
+    connect_timeout: Optional[str] = Field(default=None, pattern=NGINX_TIME)
+    read_timeout: Optional[str] = Field(default=None, pattern=NGINX_TIME)
+    send_timeout: Optional[str] = Field(default=None, pattern=NGINX_TIME)
+
+class ReplicaInstance(BaseModel):
+    index: int
+    port: int
+    container_id: str
+
 class UserModel(BaseModel):
     model_config = ConfigDict(
         populate_by_name=True,
@@ -60,6 +106,41 @@ class DeploymentModel(BaseModel):
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
     env_vars: Dict[str, Any] = Field(default_factory=dict)
+    resources: ResourceProfile = Field(default_factory=ResourceProfile)
+    placement: PlacementConstraints = Field(default_factory=PlacementConstraints)
+    node: Optional[str] = None
+    readiness_path: Optional[str] = None
+    ready_at: Optional[datetime] = None
+    time_to_ready: Optional[float] = None
+    scale_to_zero: bool = False
+    last_request_at: Optional[datetime] = None
+    hibernated_at: Optional[datetime] = None
+    replicas: int = 1
+    lane: BuildLane = BuildLane.PREVIEW
+    # Cache GET responses in nginx for NGINX_MICROCACHE_SECONDS
+    micro_cache: bool = False
+    # nginx upstream pool and timeouts (services/nginx_service.py)
+    proxy: ProxySettings = Field(default_factory=ProxySettings)
+    # Containers beyond the primary one (port/container_id above)
+    replica_instances: List[ReplicaInstance] = Field(default_factory=list)
+    # Step journal of the current or last deploy attempt (services/journal_service.py)
+    pipeline: Optional[Dict[str, Any]] = None
+
+class NodeModel(BaseModel):
+    model_config = ConfigDict(
+        populate_by_name=True,
+        arbitrary_types_allowed=True,
+        json_encoders={ObjectId: str}
+    )
+    
+    id: Optional[PyObjectId] = Field(default_factory=PyObjectId, alias="_id")
+    name: str
+    docker_url: str
+    address: str
+    labels: Dict[str, str] = Field(default_factory=dict)
+    capacity: ResourceProfile
+    status: NodeStatus = NodeStatus.ACTIVE
+    created_at: datetime = Field(default_factory=datetime.utcnow)
 
 class PortRegistryModel(BaseModel):
     model_config = ConfigDict(
@@ -90,6 +171,14 @@ class DeploymentCreate(BaseModel):
     github_url: str
     subdomain: str
     env_vars: Dict[str, Any] = Field(default_factory=dict)
+    resources: Optional[ResourceProfile] = None
+    placement: Optional[PlacementConstraints] = None
+    readiness_path: Optional[str] = None
+    scale_to_zero: Optional[bool] = None
+    replicas: int = Field(default=1, ge=1)
+    lane: BuildLane = BuildLane.PREVIEW
+    micro_cache: bool = False
+    proxy: Optional[ProxySettings] = None
 
 class DeploymentResponse(BaseModel):
     model_config = ConfigDict(json_encoders={ObjectId: str})
@@ -101,4 +190,11 @@ class DeploymentResponse(BaseModel):
     port: int
     status: DeploymentStatus
     created_at: datetime
-    updated_at: datetime
\ No newline at end of file
+    updated_at: datetime
+    resources: Optional[ResourceProfile] = None
+    node: Optional[str] = None
+    time_to_ready: Optional[float] = None
+    scale_to_zero: bool = False
+    last_request_at: Optional[datetime] = None
+    replicas: int = 1
+    replica_ports: List[int] = Field(default_factory=list)
\ No newline at end of file
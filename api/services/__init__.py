@@ -3,11 +3,53 @@ from .nginx_service import NginxService
 from .cloudflare_service import CloudflareService
 from .port_service import PortService
 from .cleanup_service import CleanupService
+from .capacity_service import CapacityService
+from .readiness_service import ReadinessService
+from .scheduler_service import PlacementScheduler
+from .node_service import NodeService
+from .activity_service import ActivityService
+from .hibernation_service import HibernationService
+from .replica_service import ReplicaService
+from .event_service import EventBus, event_bus
+from .timeline_service import PipelineTimeline, TimelineService
+from .log_service import LogService, LogWriter, log_writer
+from .runtime_log_service import RuntimeLogHub, TooManyLogStreams, runtime_logs
+from .stats_service import StatsSampler, stats_sampler
+from .reconcile_service import ReconcileService
+from .journal_service import StepJournal
+from .lease_service import lease, LeaseUnavailable, LeaseLost
+from .build_queue_service import BuildScheduler, BuildQuotaExceeded
 
 __all__ = [
     "DockerService",
     "NginxService", 
     "CloudflareService",
     "PortService",
-    "CleanupService"
+    "CleanupService",
+    "CapacityService",
+    "ReadinessService",
+    "PlacementScheduler",
+    "NodeService",
+    "ActivityService",
+    "HibernationService",
+    "ReplicaService",
+    "EventBus",
+    "event_bus",
+    "PipelineTimeline",
+    "TimelineService",
+    "LogService",
+    "LogWriter",
+    "log_writer",
+    "RuntimeLogHub",
+    "TooManyLogStreams",
+    "runtime_logs",
+    "StatsSampler",
+    "stats_sampler",
+    "ReconcileService",
+    "StepJournal",
+    "lease",
+    "LeaseUnavailable",
+    "LeaseLost",
+    "BuildScheduler",
+    "BuildQuotaExceeded"
 ]
\ No newline at end of file
@@ -0,0 +1,87 @@
+import os
+import asyncio
+from datetime import datetime
+from typing import Dict
+from pymongo import UpdateOne
+from models import get_database, mark_deployments_changed
+
+# Read position in the nginx activity log, shared by every ActivityService in this process
+_log_cursor = {"position": 0, "inode": None}
+
+class ActivityService:
+    """
+    Tracks when each deployment last served a request by tailing the compact
+    activity log written by the wildcard nginx server ("$msec $host" per line).
+    """
+
+    def __init__(self):
+        self.log_path = os.getenv("NGINX_ACTIVITY_LOG", "/var/log/nginx/deployment-activity.log")
+        self.base_domain = os.getenv("BASE_DOMAIN", "ao2395.com")
+        self.max_read_bytes = int(os.getenv("ACTIVITY_MAX_READ_BYTES", str(8 * 1024 * 1024)))
+
+    def _read_new_activity(self) -> Dict[str, float]:
+        """Return the latest request timestamp per host seen since the last call"""
+        try:
+            stat = os.stat(self.log_path)
+        except FileNotFoundError:
+            return {}
+
+        # Start over after logrotate replaced or truncated the file
+        if stat.st_ino != _log_cursor["inode"] or stat.st_size < _log_cursor["position"]:
+            _log_cursor["inode"] = stat.st_ino
+            _log_cursor["position"] = 0
+
+        with open(self.log_path, "rb") as f:
+            f.seek(_log_cursor["position"])
+            data = f.read(self.max_read_bytes)
+
+        # Only consume complete lines; a partial last line is picked up next time
+        end = data.rfind(b"\n")
+        if end == -1:
+            return {}
+        _log_cursor["position"] += end + 1
+
+        latest: Dict[str, float] = {}
+        for line in data[:end].split(b"\n"):
+            parts = line.split()
+            if len(parts) < 2:
+                continue
+            try:
+                timestamp = float(parts[0])
+            except ValueError:
+                continue
+            host = parts[1].decode("utf-8", "replace").lower()
+            if timestamp > latest.get(host, 0):
+                latest[host] = timestamp
+
+        return latest
+
+    async def ingest(self) -> int:
+        """Fold new log lines into deployments.last_request_at; returns the number of subdomains updated"""
+        try:
+            loop = asyncio.get_event_loop()
+            latest = await loop.run_in_executor(None, self._read_new_activity)
+        except Exception as e:
+            print(f"Failed to read activity log {self.log_path}: {e}")
+            return 0
+
+        suffix = f".{self.base_domain}"
+        operations = []
+        for host, timestamp in latest.items():
+            if not host.endswith(suffix):
+                continue
+            subdomain = host[:-len(suffix)]
+            operations.append(UpdateOne(
+                {"subdomain": subdomain},
+                {"$max": {"last_request_at": datetime.utcfromtimestamp(timestamp)}}
+            ))
+
+        if not operations:
+            return 0
+
+        db = get_database()
+        result = await db.deployments.bulk_write(operations, ordered=False)
+        # last_request_at is listed, so a visit is a change; idle polls leave the version alone
+        if result.modified_count:
+            await mark_deployments_changed()
+        return len(operations)
@@ -0,0 +1,255 @@
+import os
+import math
+import asyncio
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Dict, Any, List
+from pymongo import ReturnDocument
+from models import get_database, BuildLane
+from .lease_service import lease, LeaseUnavailable
+
+# Lower sorts first: production builds are started before previews
+LANE_RANK = {BuildLane.PRODUCTION.value: 0, BuildLane.PREVIEW.value: 1}
+
+# Set when a build slot frees up, so local waiters check right away instead of at their next poll
+_slot_freed = asyncio.Event()
+
+class BuildQuotaExceeded(Exception):
+    """A new build would go over a queue limit; retry_after is when a slot is likely to free up"""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+class BuildScheduler:
+    """
+    Shares build slots between users with weighted fair queuing. Every deploy
+    holds a ticket in the `build_queue` collection from the moment it is
+    accepted until its pipeline ends. Tickets carry a virtual finish tag:
+    each user's builds are spaced 1/weight apart on a shared virtual clock,
+    so a user with one build waits behind at most a build or two of each
+    other user, however many a batch job has queued. The production lane is
+    started before previews; a preview waiting longer than
+    BUILD_PRIORITY_AGING_SECONDS is treated as production so it can't starve.
+    State lives in MongoDB (changes under the `build-queue` lease), so the
+    limits hold across workers.
+    """
+
+    def __init__(self):
+        self.max_concurrent = int(os.getenv("BUILD_MAX_CONCURRENT", "4"))
+        self.max_concurrent_per_user = int(os.getenv("BUILD_MAX_CONCURRENT_PER_USER", "2"))
+        self.max_queued = int(os.getenv("BUILD_MAX_QUEUED", "100"))
+        self.max_queued_per_user = int(os.getenv("BUILD_MAX_QUEUED_PER_USER", "10"))
+        self.poll_interval = float(os.getenv("BUILD_QUEUE_POLL_INTERVAL", "2"))
+        self.aging_seconds = float(os.getenv("BUILD_PRIORITY_AGING_SECONDS", "300"))
+        # user_id=weight pairs; users not listed weigh 1
+        self.weights: Dict[str, float] = {}
+        for entry in os.getenv("BUILD_USER_WEIGHTS", "").split(","):
+            user_id, _, weight = entry.partition("=")
+            if user_id.strip() and weight.strip():
+                self.weights[user_id.strip()] = float(weight)
+        # Users whose deploys may jump ahead of previews; nobody by default
+        self.production_users = {
+            user_id.strip() for user_id in os.getenv("BUILD_PRODUCTION_USERS", "").split(",") if user_id.strip()
+        }
+
+    def weight(self, user_id: str) -> float:
+        return max(self.weights.get(user_id, 1.0), 0.01)
+
+    def may_use_lane(self, user_id: str, lane: str) -> bool:
+        return lane != BuildLane.PRODUCTION.value or user_id in self.production_users
+
+    async def _clock(self) -> Dict[str, Any]:
+        db = get_database()
+        return await db.build_scheduler.find_one_and_update(
+            {"_id": "clock"},
+            {"$setOnInsert": {"virtual_time": 0.0, "avg_build_seconds": 120.0}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def _live_deploys(self, deployment_ids: List[str]) -> set:
+        """Deployments whose pipeline is running somewhere: their deploy lease is held and unexpired"""
+        if not deployment_ids:
+            return set()
+        db = get_database()
+        held = await db.leases.find(
+            {
+                "_id": {"$in": [f"deploy:{deployment_id}" for deployment_id in deployment_ids]},
+                "owner": {"$ne": None},
+                "expires_at": {"$gt": datetime.utcnow()}
+            },
+            {"_id": 1}
+        ).to_list(length=None)
+        return {doc["_id"].split(":", 1)[1] for doc in held}
+
+    async def _retry_after(self, slots: int) -> int:
+        clock = await self._clock()
+        return max(math.ceil(clock["avg_build_seconds"] / max(slots, 1)), 1)
+
+    async def enqueue(self, deployment_id: str, user_id: str, lane: str = BuildLane.PREVIEW.value, enforce_quota: bool = True) -> Dict[str, Any]:
+        """
+        Give a deployment its ticket. New deploys are checked against the queue
+        limits first (BuildQuotaExceeded); a deploy that already has a ticket,
+        such as one being resumed, keeps it and its place.
+        """
+        db = get_database()
+        async with lease("build-queue") as held:
+            existing = await db.build_queue.find_one({"_id": deployment_id})
+            if existing:
+                if existing["state"] == "running":
+                    # Its previous pipeline stopped mid-build; the build starts over in its old place
+                    await held.check()
+                    await db.build_queue.update_one({"_id": deployment_id}, {"$set": {"state": "queued", "started_at": None}})
+                    existing["state"] = "queued"
+                return existing
+
+            if enforce_quota:
+                queued = await db.build_queue.count_documents({"state": "queued"})
+                if queued >= self.max_queued:
+                    raise BuildQuotaExceeded(
+                        f"The build queue is full ({self.max_queued} builds waiting)",
+                        await self._retry_after(self.max_concurrent)
+                    )
+                user_queued = await db.build_queue.count_documents({"state": "queued", "user_id": user_id})
+                if user_queued >= self.max_queued_per_user:
+                    raise BuildQuotaExceeded(
+                        f"You already have {user_queued} builds waiting (limit {self.max_queued_per_user})",
+                        await self._retry_after(self.max_concurrent_per_user)
+                    )
+
+            # A user's next build starts where their last one finishes on the virtual clock, or now if they are idle
+            clock = await self._clock()
+            last = await db.build_queue.find({"user_id": user_id}, {"finish_tag": 1}).sort("finish_tag", -1).limit(1).to_list(length=1)
+            start_tag = max(clock["virtual_time"], last[0]["finish_tag"] if last else 0.0)
+            ticket = {
+                "_id": deployment_id,
+                "user_id": user_id,
+                "lane": lane,
+                "state": "queued",
+                "start_tag": start_tag,
+                "finish_tag": start_tag + 1 / self.weight(user_id),
+                "enqueued_at": datetime.utcnow(),
+                "started_at": None
+            }
+            await held.check()
+            await db.build_queue.insert_one(ticket)
+            return ticket
+
+    def _order(self, ticket: Dict[str, Any], now: datetime):
+        lane = LANE_RANK.get(ticket.get("lane"), LANE_RANK[BuildLane.PREVIEW.value])
+        if (now - ticket["enqueued_at"]).total_seconds() >= self.aging_seconds:
+            lane = LANE_RANK[BuildLane.PRODUCTION.value]
+        return (lane, ticket["finish_tag"], ticket["enqueued_at"])
+
+    async def _try_start(self, deployment_id: str) -> bool:
+        """Start this deployment's build if a slot is free and it is next in line"""
+        db = get_database()
+        async with lease("build-queue", wait=self.poll_interval) as held:
+            running = await db.build_queue.find({"state": "running"}).to_list(length=None)
+            queued = await db.build_queue.find({"state": "queued"}).to_list(length=None)
+            if not any(ticket["_id"] == deployment_id for ticket in queued):
+                # Deleting the deployment drops its ticket
+                raise LookupError(f"Deployment {deployment_id} is no longer in the build queue")
+            live = await self._live_deploys([ticket["_id"] for ticket in running + queued])
+
+            # Slots held by a pipeline that stopped free up; the resumer re-queues it
+            stale = [ticket["_id"] for ticket in running if ticket["_id"] not in live]
+            if stale:
+                await held.check()
+                await db.build_queue.update_many({"_id": {"$in": stale}, "state": "running"}, {"$set": {"state": "queued", "started_at": None}})
+            running = [ticket for ticket in running if ticket["_id"] in live]
+            if len(running) >= self.max_concurrent:
+                return False
+
+            per_user: Dict[str, int] = {}
+            for ticket in running:
+                per_user[ticket["user_id"]] = per_user.get(ticket["user_id"], 0) + 1
+            # Only tickets whose pipeline is actually waiting can be next
+            eligible = [
+                ticket for ticket in queued
+                if ticket["_id"] in live and per_user.get(ticket["user_id"], 0) < self.max_concurrent_per_user
+            ]
+            if not eligible:
+                return False
+            now = datetime.utcnow()
+            head = min(eligible, key=lambda ticket: self._order(ticket, now))
+            if head["_id"] != deployment_id:
+                return False
+
+            await held.check()
+            await db.build_queue.update_one({"_id": deployment_id}, {"$set": {"state": "running", "started_at": now}})
+            await db.build_scheduler.update_one({"_id": "clock"}, {"$max": {"virtual_time": head["start_tag"]}})
+        # Whoever is next may be startable too
+        _slot_freed.set()
+        _slot_freed.clear()
+        return True
+
+    async def wait_for_slot(self, deployment_id: str):
+        while True:
+            try:
+                if await self._try_start(deployment_id):
+                    return
+            except LeaseUnavailable:
+                # Other waiters are checking; try again after them
+                pass
+            try:
+                await asyncio.wait_for(_slot_freed.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def release(self, deployment_id: str):
+        """Drop the deployment's ticket, freeing its slot or its place in the queue; safe to call twice"""
+        db = get_database()
+        ticket = await db.build_queue.find_one_and_delete({"_id": deployment_id})
+        if ticket and ticket.get("started_at"):
+            # Moving average of build time, for Retry-After
+            seconds = (datetime.utcnow() - ticket["started_at"]).total_seconds()
+            clock = await self._clock()
+            await db.build_scheduler.update_one(
+                {"_id": "clock"},
+                {"$set": {"avg_build_seconds": round(clock["avg_build_seconds"] * 0.8 + seconds * 0.2, 1)}}
+            )
+        _slot_freed.set()
+        _slot_freed.clear()
+
+    @asynccontextmanager
+    async def slot(self, deployment_id: str):
+        """Hold a build slot for the block; the ticket must already exist (see enqueue)"""
+        await self.wait_for_slot(deployment_id)
+        try:
+            yield
+        finally:
+            await self.release(deployment_id)
+
+    async def get_queue_report(self) -> Dict[str, Any]:
+        db = get_database()
+        tickets = await db.build_queue.find().to_list(length=None)
+        now = datetime.utcnow()
+        queued = sorted((ticket for ticket in tickets if ticket["state"] == "queued"), key=lambda ticket: self._order(ticket, now))
+        users: Dict[str, Dict[str, int]] = {}
+        for ticket in tickets:
+            counts = users.setdefault(ticket["user_id"], {"running": 0, "queued": 0})
+            counts[ticket["state"]] += 1
+        clock = await self._clock()
+        return {
+            "limits": {
+                "concurrent": self.max_concurrent,
+                "concurrent_per_user": self.max_concurrent_per_user,
+                "queued": self.max_queued,
+                "queued_per_user": self.max_queued_per_user
+            },
+            "running": sum(1 for ticket in tickets if ticket["state"] == "running"),
+            "avg_build_seconds": clock["avg_build_seconds"],
+            "users": users,
+            "queue": [
+                {
+                    "deployment_id": ticket["_id"],
+                    "user_id": ticket["user_id"],
+                    "lane": ticket["lane"],
+                    "waiting_seconds": round((now - ticket["enqueued_at"]).total_seconds(), 1)
+                }
+                for ticket in queued
+            ]
+        }
@@ -0,0 +1,212 @@
+import os
+import asyncio
+from typing import Dict, Any, Optional
+from models import get_database, mark_deployments_changed, DeploymentStatus, ResourceProfile, LogLevel
+from .event_service import event_bus
+from .log_service import write_log
+from .lease_service import lease
+
+# Statuses whose resource profile counts against host capacity. In queue mode
+# pending deployments are waiting for admission, so they don't hold capacity yet.
+ACTIVE_STATUSES = [DeploymentStatus.BUILDING.value, DeploymentStatus.RUNNING.value]
+
+class CapacityService:
+    def __init__(self):
+        self.host_cpus = float(os.getenv("HOST_CPUS", str(os.cpu_count() or 1)))
+        self.host_memory_mb = int(os.getenv("HOST_MEMORY_MB", str(self._detect_memory_mb())))
+        self.host_pids = int(os.getenv("HOST_PIDS", "32768"))
+        self.overcommit_ratio = float(os.getenv("OVERCOMMIT_RATIO", "1.5"))
+        self.admission_mode = os.getenv("ADMISSION_MODE", "reject")  # reject | queue
+        self.queue_poll_interval = float(os.getenv("ADMISSION_POLL_INTERVAL", "10"))
+
+        self.committed_statuses = list(ACTIVE_STATUSES)
+        if self.admission_mode != "queue":
+            self.committed_statuses.append(DeploymentStatus.PENDING.value)
+
+    def _detect_memory_mb(self) -> int:
+        try:
+            with open("/proc/meminfo") as f:
+                for line in f:
+                    if line.startswith("MemTotal:"):
+                        return int(line.split()[1]) // 1024
+        except Exception:
+            pass
+        try:
+            return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") // (1024 * 1024)
+        except Exception:
+            return 4096
+
+    async def log_operation(self, deployment_id: str, message: str, level: LogLevel = LogLevel.INFO):
+        await write_log(deployment_id, message, level)
+
+    def limits(self, node: Optional[Dict[str, Any]] = None) -> Dict[str, float]:
+        """Maximum commitments allowed on this host (or a registered node) after applying the overcommit ratio"""
+        if node:
+            capacity = ResourceProfile(**node["capacity"])
+            cpus, memory_mb, pids = capacity.cpus, capacity.memory_mb, capacity.pids
+        else:
+            cpus, memory_mb, pids = self.host_cpus, self.host_memory_mb, self.host_pids
+
+        return {
+            "cpus": cpus * self.overcommit_ratio,
+            "memory_mb": memory_mb * self.overcommit_ratio,
+            "pids": pids * self.overcommit_ratio
+        }
+
+    def footprint(self, profile: ResourceProfile, replicas: int) -> ResourceProfile:
+        """Total resources held by a deployment running the given number of replicas"""
+        # A sum, not a request: it may exceed the per-deployment bounds
+        return ResourceProfile.model_construct(
+            cpus=profile.cpus * replicas,
+            memory_mb=profile.memory_mb * replicas,
+            pids=profile.pids * replicas
+        )
+
+    async def committed(self, exclude_id: Optional[str] = None, node: Optional[str] = None) -> Dict[str, float]:
+        """Sum the resource profiles of all deployments currently holding capacity"""
+        db = get_database()
+        defaults = ResourceProfile()
+
+        match: Dict[str, Any] = {"status": {"$in": self.committed_statuses}}
+        if exclude_id:
+            from bson import ObjectId
+            match["_id"] = {"$ne": ObjectId(exclude_id)}
+        if node:
+            match["node"] = node
+
+        # Each replica holds a full profile. Deployments created before resource
+        # profiles or replicas existed fall back to the defaults.
+        replicas = {"$ifNull": ["$replicas", 1]}
+        pipeline = [
+            {"$match": match},
+            {
+                "$group": {
+                    "_id": None,
+                    "cpus": {"$sum": {"$multiply": [{"$ifNull": ["$resources.cpus", defaults.cpus]}, replicas]}},
+                    "memory_mb": {"$sum": {"$multiply": [{"$ifNull": ["$resources.memory_mb", defaults.memory_mb]}, replicas]}},
+                    "pids": {"$sum": {"$multiply": [{"$ifNull": ["$resources.pids", defaults.pids]}, replicas]}},
+                    "deployments": {"$sum": 1},
+                    "containers": {"$sum": replicas}
+                }
+            }
+        ]
+
+        result = await db.deployments.aggregate(pipeline).to_list(length=1)
+        if not result:
+            return {"cpus": 0.0, "memory_mb": 0, "pids": 0, "deployments": 0, "containers": 0}
+
+        totals = result[0]
+        totals.pop("_id", None)
+        return totals
+
+    async def can_admit(
+        self,
+        profile: ResourceProfile,
+        exclude_id: Optional[str] = None,
+        node: Optional[Dict[str, Any]] = None
+    ) -> bool:
+        committed = await self.committed(exclude_id, node["name"] if node else None)
+        limits = self.limits(node)
+
+        return (
+            committed["cpus"] + profile.cpus <= limits["cpus"] and
+            committed["memory_mb"] + profile.memory_mb <= limits["memory_mb"] and
+            committed["pids"] + profile.pids <= limits["pids"]
+        )
+
+    async def admit(self, profile: ResourceProfile, deployment_id: str, node: Optional[Dict[str, Any]] = None) -> None:
+        """
+        Wait until the host (or the deployment's node) can take this deployment's
+        profile, then commit it by moving the deployment to building. Used when
+        ADMISSION_MODE=queue.
+        """
+        from bson import ObjectId
+        db = get_database()
+        waiting_logged = False
+
+        while True:
+            # The `capacity` lease serializes check-and-commit across workers, so two
+            # deployments (queued or newly created) can't both take the last slot
+            async with lease("capacity"):
+                if await self.can_admit(profile, exclude_id=deployment_id, node=node):
+                    await db.deployments.update_one(
+                        {"_id": ObjectId(deployment_id)},
+                        {"$set": {"status": DeploymentStatus.BUILDING}}
+                    )
+                    await mark_deployments_changed(deployment_id)
+                    event_bus.publish_status(deployment_id, DeploymentStatus.BUILDING)
+                    if waiting_logged:
+                        await self.log_operation(deployment_id, "Host capacity available, starting deployment")
+                    return
+
+            if not waiting_logged:
+                await self.log_operation(
+                    deployment_id,
+                    f"Queued: host capacity exhausted (cpus={profile.cpus}, memory={profile.memory_mb}MB, pids={profile.pids})",
+                    LogLevel.WARNING
+                )
+                waiting_logged = True
+
+            await asyncio.sleep(self.queue_poll_interval)
+
+    def host_utilization(self) -> Dict[str, Any]:
+        """Actual host usage, read from the kernel rather than from commitments"""
+        utilization: Dict[str, Any] = {}
+
+        try:
+            load_1, load_5, load_15 = os.getloadavg()
+            utilization["load_average"] = [load_1, load_5, load_15]
+            utilization["cpu_percent"] = round(min(load_1 / self.host_cpus, 1.0) * 100, 1)
+        except OSError:
+            utilization["load_average"] = None
+            utilization["cpu_percent"] = None
+
+        try:
+            meminfo = {}
+            with open("/proc/meminfo") as f:
+                for line in f:
+                    key, value = line.split(":", 1)
+                    meminfo[key] = int(value.split()[0]) // 1024
+            used_mb = meminfo["MemTotal"] - meminfo.get("MemAvailable", meminfo.get("MemFree", 0))
+            utilization["memory_used_mb"] = used_mb
+            utilization["memory_percent"] = round(used_mb / meminfo["MemTotal"] * 100, 1)
+        except Exception:
+            utilization["memory_used_mb"] = None
+            utilization["memory_percent"] = None
+
+        return utilization
+
+    async def get_capacity_report(self) -> Dict[str, Any]:
+        committed = await self.committed()
+        limits = self.limits()
+
+        db = get_database()
+        nodes = await db.nodes.find().to_list(length=None)
+        node_reports = []
+        for node in nodes:
+            node_committed = await self.committed(node=node["name"])
+            node_reports.append({
+                "name": node["name"],
+                "status": node["status"],
+                "limits": self.limits(node),
+                "committed": node_committed
+            })
+
+        return {
+            "host": {
+                "cpus": self.host_cpus,
+                "memory_mb": self.host_memory_mb,
+                "pids": self.host_pids
+            },
+            "overcommit_ratio": self.overcommit_ratio,
+            "admission_mode": self.admission_mode,
+            "limits": limits,
+            "committed": committed,
+            "committed_percent": {
+                "cpus": round(committed["cpus"] / limits["cpus"] * 100, 1) if limits["cpus"] else None,
+                "memory_mb": round(committed["memory_mb"] / limits["memory_mb"] * 100, 1) if limits["memory_mb"] else None,
+                "pids": round(committed["pids"] / limits["pids"] * 100, 1) if limits["pids"] else None
+            },
+            "utilization": self.host_utilization(),
+            "nodes": node_reports
+        }
@@ -1,9 +1,15 @@
 from typing import Optional
 from .docker_service import DockerService
 from .nginx_service import NginxService
-from .cloudflare_service import CloudflareService
+from .cloudflare_service import CloudflareService, wildcard_active
 from .port_service import PortService
-from models import get_database, DeploymentModel, BuildLogModel, LogLevel
+from .node_service import NodeService
+from .replica_service import ReplicaService
+from .event_service import event_bus
+from .timeline_service import PipelineTimeline, span
+from .log_service import write_log
+from .journal_service import workspace_path
+from models import get_database, mark_deployments_changed, DeploymentModel, LogLevel
 
 class CleanupService:
     def __init__(self):
@@ -11,26 +17,20 @@ class CleanupService:
         self.nginx_service = NginxService()
         self.cloudflare_service = CloudflareService()
         self.port_service = PortService()
+        self.node_service = NodeService()
+        self.replica_service = ReplicaService()
     
     async def log_cleanup(self, deployment_id: str, message: str, level: LogLevel = LogLevel.INFO):
-        db = get_database()
-        log_entry = BuildLogModel(
-            deployment_id=deployment_id,
-            message=message,
-            log_level=level
-        )
-        await db.build_logs.insert_one(log_entry.dict(by_alias=True))
+        await write_log(deployment_id, message, level)
     
     async def delete_deployment(self, deployment_id: str) -> bool:
+        timeline = None
         try:
             db = get_database()
             
-            # Get deployment info  
+            # Read from the database, not the cache: another worker may have replaced the container, port or node
             from bson import ObjectId
-            try:
-                deployment_doc = await db.deployments.find_one({"_id": ObjectId(deployment_id)})
-            except Exception:
-                deployment_doc = None
+            deployment_doc = await db.deployments.find_one({"_id": ObjectId(deployment_id)})
             if not deployment_doc:
                 print(f"Deployment {deployment_id} not found")
                 return False
@@ -49,100 +49,125 @@ class CleanupService:
                     self.env_vars = doc.get("env_vars", {})
             
             deployment = SimpleDeployment(deployment_doc)
+            docker_service = await self.node_service.get_docker_service(deployment_doc.get("node"))
             
             await self.log_cleanup(deployment_id, f"Starting cleanup for deployment: {deployment.name}")
+            timeline = await PipelineTimeline.start(deployment_id, "delete")
             
             success = True
             
             # 1. Stop and remove Docker container
-            if deployment.container_id:
-                await self.log_cleanup(deployment_id, "Stopping Docker container...")
-                container_stopped = await self.docker_service.stop_container(deployment.container_id)
-                if container_stopped:
-                    await self.log_cleanup(deployment_id, "Container stopped successfully")
-                else:
-                    await self.log_cleanup(deployment_id, "Failed to stop container", LogLevel.ERROR)
-                    success = False
+            async with span("container"):
+                if deployment.container_id:
+                    await self.log_cleanup(deployment_id, "Stopping Docker container...")
+                    container_stopped = await docker_service.stop_container(deployment.container_id)
+                    if container_stopped:
+                        await self.log_cleanup(deployment_id, "Container stopped successfully")
+                    else:
+                        await self.log_cleanup(deployment_id, "Failed to stop container", LogLevel.ERROR)
+                        success = False
                 
-                await self.log_cleanup(deployment_id, "Removing Docker container...")
-                container_removed = await self.docker_service.remove_container(deployment.container_id)
-                if container_removed:
-                    await self.log_cleanup(deployment_id, "Container removed successfully")
-                else:
-                    await self.log_cleanup(deployment_id, "Failed to remove container", LogLevel.ERROR)
-                    success = False
+                    await self.log_cleanup(deployment_id, "Removing Docker container...")
+                    container_removed = await docker_service.remove_container(deployment.container_id)
+                    if container_removed:
+                        await self.log_cleanup(deployment_id, "Container removed successfully")
+                    else:
+                        await self.log_cleanup(deployment_id, "Failed to remove container", LogLevel.ERROR)
+                        success = False
+            
+            # Extra replicas: containers and their ports
+            async with span("replicas"):
+                replica_instances = deployment_doc.get("replica_instances", [])
+                if replica_instances:
+                    await self.log_cleanup(deployment_id, f"Removing {len(replica_instances)} replica containers...")
+                    await self.replica_service.remove_replicas(deployment_doc, replica_instances)
             
             # 2. Remove Docker image
-            if deployment.docker_image:
-                await self.log_cleanup(deployment_id, "Removing Docker image...")
-                image_removed = await self.docker_service.remove_image(deployment.docker_image)
-                if image_removed:
-                    await self.log_cleanup(deployment_id, "Docker image removed successfully")
-                else:
-                    await self.log_cleanup(deployment_id, "Failed to remove Docker image", LogLevel.ERROR)
-                    success = False
+            async with span("image"):
+                if deployment.docker_image:
+                    await self.log_cleanup(deployment_id, "Removing Docker image...")
+                    image_removed = await docker_service.remove_image(deployment.docker_image)
+                    if image_removed:
+                        await self.log_cleanup(deployment_id, "Docker image removed successfully")
+                    else:
+                        await self.log_cleanup(deployment_id, "Failed to remove Docker image", LogLevel.ERROR)
+                        success = False
             
             # 3. Remove Nginx configuration
-            await self.log_cleanup(deployment_id, "Removing Nginx configuration...")
-            nginx_removed = await self.nginx_service.remove_config(deployment.subdomain, deployment_id)
-            if nginx_removed:
-                await self.log_cleanup(deployment_id, "Nginx config removed successfully")
+            async with span("nginx"):
+                await self.log_cleanup(deployment_id, "Removing Nginx configuration...")
+                nginx_removed = await self.nginx_service.remove_config(deployment.subdomain, deployment_id)
+                if nginx_removed:
+                    await self.log_cleanup(deployment_id, "Nginx config removed successfully")
                 
-                # Reload nginx
-                nginx_reloaded = await self.nginx_service.reload_nginx(deployment_id)
-                if nginx_reloaded:
-                    await self.log_cleanup(deployment_id, "Nginx reloaded successfully")
+                    # Reload nginx
+                    nginx_reloaded = await self.nginx_service.reload_nginx(deployment_id)
+                    if nginx_reloaded:
+                        await self.log_cleanup(deployment_id, "Nginx reloaded successfully")
+                    else:
+                        await self.log_cleanup(deployment_id, "Failed to reload Nginx", LogLevel.ERROR)
+                        success = False
                 else:
-                    await self.log_cleanup(deployment_id, "Failed to reload Nginx", LogLevel.ERROR)
+                    await self.log_cleanup(deployment_id, "Failed to remove Nginx config", LogLevel.ERROR)
                     success = False
-            else:
-                await self.log_cleanup(deployment_id, "Failed to remove Nginx config", LogLevel.ERROR)
-                success = False
             
             # 4. Remove Cloudflare DNS record and tunnel route
-            await self.log_cleanup(deployment_id, "Removing Cloudflare DNS record...")
-            dns_removed = await self.cloudflare_service.remove_dns_record(deployment.subdomain, deployment_id)
-            if dns_removed:
-                await self.log_cleanup(deployment_id, "DNS record removed successfully")
-            else:
-                await self.log_cleanup(deployment_id, "Failed to remove DNS record", LogLevel.ERROR)
-                success = False
-            
-            await self.log_cleanup(deployment_id, "Removing Cloudflare tunnel route...")
-            tunnel_removed = await self.cloudflare_service.remove_tunnel_route(deployment.subdomain, deployment_id)
-            if tunnel_removed:
-                await self.log_cleanup(deployment_id, "Tunnel route removed successfully")
-            else:
-                await self.log_cleanup(deployment_id, "Failed to remove tunnel route", LogLevel.ERROR)
-                success = False
+            async with span("cloudflare"):
+                if wildcard_active() and not self.cloudflare_service.has_hostname_route(deployment.subdomain):
+                    # Served by the wildcard; there is nothing of its own to remove
+                    await self.log_cleanup(deployment_id, "Deployment was routed by the Cloudflare wildcard; no DNS record or tunnel route to remove")
+                else:
+                    await self.log_cleanup(deployment_id, "Removing Cloudflare DNS record...")
+                    dns_removed = await self.cloudflare_service.remove_dns_record(deployment.subdomain, deployment_id)
+                    if dns_removed:
+                        await self.log_cleanup(deployment_id, "DNS record removed successfully")
+                    else:
+                        await self.log_cleanup(deployment_id, "Failed to remove DNS record", LogLevel.ERROR)
+                        success = False
+            
+                    await self.log_cleanup(deployment_id, "Removing Cloudflare tunnel route...")
+                    tunnel_removed = await self.cloudflare_service.remove_tunnel_route(deployment.subdomain, deployment_id)
+                    if tunnel_removed:
+                        await self.log_cleanup(deployment_id, "Tunnel route removed successfully")
+                    else:
+                        await self.log_cleanup(deployment_id, "Failed to remove tunnel route", LogLevel.ERROR)
+                        success = False
             
             # 5. Free up port
-            await self.log_cleanup(deployment_id, f"Releasing port {deployment.port}...")
-            port_released = await self.port_service.release_port(deployment.port)
-            if port_released:
-                await self.log_cleanup(deployment_id, f"Port {deployment.port} released successfully")
-            else:
-                await self.log_cleanup(deployment_id, f"Failed to release port {deployment.port}", LogLevel.ERROR)
-                success = False
-            
-            # 6. Remove from database (keep logs for reference)
-            await self.log_cleanup(deployment_id, "Removing deployment from database...")
-            delete_result = await db.deployments.delete_one({"_id": ObjectId(deployment_id)})
-            if delete_result.deleted_count > 0:
-                await self.log_cleanup(deployment_id, "Deployment removed from database successfully")
-            else:
-                await self.log_cleanup(deployment_id, "Failed to remove deployment from database", LogLevel.ERROR)
-                success = False
+            async with span("port"):
+                await self.log_cleanup(deployment_id, f"Releasing port {deployment.port}...")
+                port_released = await self.port_service.release_port(deployment.port)
+                if port_released:
+                    await self.log_cleanup(deployment_id, f"Port {deployment.port} released successfully")
+                else:
+                    await self.log_cleanup(deployment_id, f"Failed to release port {deployment.port}", LogLevel.ERROR)
+                    success = False
+            
+            # 6. Remove from database (logs are kept; the log archiver compresses them)
+            async with span("database"):
+                await self.log_cleanup(deployment_id, "Removing deployment from database...")
+                delete_result = await db.deployments.delete_one({"_id": ObjectId(deployment_id)})
+                await db.build_queue.delete_one({"_id": deployment_id})
+                await mark_deployments_changed(deployment_id)
+                event_bus.publish("deleted", deployment_id)
+                if delete_result.deleted_count > 0:
+                    await self.log_cleanup(deployment_id, "Deployment removed from database successfully")
+                else:
+                    await self.log_cleanup(deployment_id, "Failed to remove deployment from database", LogLevel.ERROR)
+                    success = False
             
             if success:
                 await self.log_cleanup(deployment_id, "Deployment cleanup completed successfully!")
             else:
                 await self.log_cleanup(deployment_id, "Deployment cleanup completed with some errors", LogLevel.WARNING)
             
+            await timeline.finish("success" if success else "partial")
             return success
             
         except Exception as e:
             await self.log_cleanup(deployment_id, f"Cleanup failed with exception: {str(e)}", LogLevel.ERROR)
+            if timeline:
+                await timeline.finish("error")
             return False
     
     async def cleanup_failed_deployment(self, deployment_id: str) -> bool:
@@ -175,24 +200,36 @@ class CleanupService:
                     self.env_vars = doc.get("env_vars", {})
             
             deployment = SimpleDeployment(deployment_doc)
+            docker_service = await self.node_service.get_docker_service(deployment_doc.get("node"))
             
             await self.log_cleanup(deployment_id, "Starting cleanup for failed deployment...")
             
             # Try to clean up any resources that might have been created
             if deployment.container_id:
-                await self.docker_service.stop_container(deployment.container_id)
-                await self.docker_service.remove_container(deployment.container_id)
+                await docker_service.stop_container(deployment.container_id)
+                await docker_service.remove_container(deployment.container_id)
+            
+            if deployment_doc.get("replica_instances"):
+                await self.replica_service.remove_replicas(deployment_doc, deployment_doc["replica_instances"])
+            
+            # An image built but never started is only recorded in the step journal
+            built_image = ((deployment_doc.get("pipeline") or {}).get("steps") or {}).get("built", {}).get("image_tag")
+            for image_tag in {deployment.docker_image, built_image} - {None}:
+                await docker_service.remove_image(image_tag)
             
-            if deployment.docker_image:
-                await self.docker_service.remove_image(deployment.docker_image)
+            # The clone an interrupted or failed build left behind
+            await docker_service.cleanup_build_files(workspace_path(deployment_id))
             
             await self.nginx_service.remove_config(deployment.subdomain, deployment_id)
-            await self.cloudflare_service.remove_dns_record(deployment.subdomain, deployment_id)
-            await self.cloudflare_service.remove_tunnel_route(deployment.subdomain, deployment_id)
+            if not wildcard_active() or self.cloudflare_service.has_hostname_route(deployment.subdomain):
+                await self.cloudflare_service.remove_dns_record(deployment.subdomain, deployment_id)
+                await self.cloudflare_service.remove_tunnel_route(deployment.subdomain, deployment_id)
             await self.port_service.release_port(deployment.port)
             
             # Remove from database
             await db.deployments.delete_one({"_id": ObjectId(deployment_id)})
+            await mark_deployments_changed(deployment_id)
+            event_bus.publish("deleted", deployment_id)
             
             await self.log_cleanup(deployment_id, "Failed deployment cleanup completed")
             return True
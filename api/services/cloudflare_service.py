@@ -1,7 +1,20 @@
 import os
 import httpx
-from typing import Optional, Dict, Any
-from models import BuildLogModel, LogLevel, get_database
+from typing import Optional, Dict, Any, List
+from models import LogLevel
+from .metrics import CLOUDFLARE_ERRORS
+from .timeline_service import span
+from .log_service import write_log
+from .lease_service import lease
+
+# Tags the DNS records this platform creates; the reconciler only deletes records carrying it
+DNS_RECORD_COMMENT = "managed by deployment-lab"
+
+# Set once this process has verified the wildcard DNS record and tunnel ingress (see ensure_wildcard)
+_wildcard_active = False
+
+def wildcard_active() -> bool:
+    return _wildcard_active
 
 class CloudflareService:
     def __init__(self):
@@ -9,19 +22,16 @@ class CloudflareService:
         self.zone_id = os.getenv("CLOUDFLARE_ZONE_ID")
         self.tunnel_id = os.getenv("CLOUDFLARE_TUNNEL_ID")
         self.base_domain = os.getenv("BASE_DOMAIN", "yourdomain.com")
-        self.base_url = "https://api.cloudflare.com/client/v4"
+        self.base_url = os.getenv("CLOUDFLARE_API_URL", "https://api.cloudflare.com/client/v4")
+        self.tunnel_config_path = os.path.expanduser(os.getenv("CLOUDFLARED_CONFIG", "~/.cloudflared/config.yml"))
+        # One *.BASE_DOMAIN record and ingress rule instead of one per deployment
+        self.wildcard_enabled = os.getenv("CLOUDFLARE_WILDCARD", "false").lower() == "true"
         
         if not all([self.api_token, self.zone_id, self.tunnel_id]):
             print("Warning: Cloudflare credentials not fully configured")
     
     async def log_operation(self, deployment_id: str, message: str, level: LogLevel = LogLevel.INFO):
-        db = get_database()
-        log_entry = BuildLogModel(
-            deployment_id=deployment_id,
-            message=message,
-            log_level=level
-        )
-        await db.build_logs.insert_one(log_entry.dict(by_alias=True))
+        await write_log(deployment_id, message, level)
     
     async def _make_request(self, method: str, endpoint: str, data: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
         headers = {
@@ -47,12 +57,19 @@ class CloudflareService:
                 if response.status_code in [200, 201]:
                     return response.json()
                 else:
+                    CLOUDFLARE_ERRORS.inc(method.upper())
                     print(f"Cloudflare API error: {response.status_code} - {response.text}")
                     return None
         except Exception as e:
+            CLOUDFLARE_ERRORS.inc(method.upper())
             print(f"Cloudflare API request failed: {e}")
             return None
     
+    def reload_tunnel(self, check: bool = True):
+        """Ask cloudflared to re-read its config (SIGHUP); raises CalledProcessError if check and none is running"""
+        import subprocess
+        subprocess.run(['pkill', '-HUP', 'cloudflared'], check=check)
+    
     async def create_dns_record(self, subdomain: str, deployment_id: str) -> bool:
         try:
             await self.log_operation(deployment_id, f"Creating DNS record for {subdomain}")
@@ -75,7 +92,8 @@ class CloudflareService:
                 "name": subdomain,
                 "content": f"{self.tunnel_id}.cfargotunnel.com",
                 "ttl": 1,  # Auto TTL
-                "proxied": True
+                "proxied": True,
+                "comment": DNS_RECORD_COMMENT
             }
             
             result = await self._make_request(
@@ -100,54 +118,58 @@ class CloudflareService:
             await self.log_operation(deployment_id, f"Creating tunnel route for {subdomain}")
             
             hostname = f"{subdomain}.{self.base_domain}"
-            config_path = os.path.expanduser("~/.cloudflared/config.yml")
-            
-            # Read current config as text
-            with open(config_path, 'r') as f:
-                lines = f.readlines()
-            
-            # Check if hostname already exists
-            hostname_exists = any(f"hostname: {hostname}" in line for line in lines)
+            config_path = self.tunnel_config_path
             
-            if not hostname_exists:
-                # Find the last service line (before catch-all)
-                insert_index = -1
-                for i, line in enumerate(lines):
-                    if 'service: http_status:404' in line:
-                        insert_index = i
-                        break
+            # Edits of the shared config file are serialized across workers and hosts
+            async with lease("tunnel") as held:
+                # Read current config as text
+                with open(config_path, 'r') as f:
+                    lines = f.readlines()
                 
-                if insert_index > 0:
-                    # Insert new route before catch-all with proper YAML formatting
-                    new_lines = [
-                        f"  - hostname: {hostname}\n",
-                        f"    service: http://localhost:80\n"
-                    ]
-                    lines[insert_index:insert_index] = new_lines
-                    
-                    # Write updated config
-                    with open(config_path, 'w') as f:
-                        f.writelines(lines)
+                # Check if hostname already exists
+                hostname_exists = any(f"hostname: {hostname}" in line for line in lines)
                 
-                await self.log_operation(deployment_id, f"Added tunnel route for {hostname}")
+                if not hostname_exists:
+                    # Find the last service line (before catch-all)
+                    insert_index = -1
+                    for i, line in enumerate(lines):
+                        if 'service: http_status:404' in line:
+                            insert_index = i
+                            break
+                    
+                    if insert_index > 0:
+                        # Insert new route before catch-all with proper YAML formatting
+                        new_lines = [
+                            f"  - hostname: {hostname}\n",
+                            f"    service: http://localhost:80\n"
+                        ]
+                        lines[insert_index:insert_index] = new_lines
+                        
+                        await held.check()
+                        # Write updated config
+                        with open(config_path, 'w') as f:
+                            f.writelines(lines)
+                    
+                    await self.log_operation(deployment_id, f"Added tunnel route for {hostname}")
+                    
+                    # Send reload signal to tunnel (graceful reload without killing)
+                    import subprocess
+                    try:
+                        # Send SIGHUP to reload config without restarting
+                        self.reload_tunnel()
+                        await self.log_operation(deployment_id, f"Tunnel configuration reloaded for {hostname}")
+                    except subprocess.CalledProcessError:
+                        # If no cloudflared process found, that's okay
+                        await self.log_operation(deployment_id, f"Tunnel route added (tunnel will pick up config on next start)")
+                    except Exception as e:
+                        await self.log_operation(deployment_id, f"Warning: Could not reload tunnel config: {e}", LogLevel.WARNING)
+                else:
+                    await self.log_operation(deployment_id, f"Tunnel route already exists for {hostname}")
                 
-                # Send reload signal to tunnel (graceful reload without killing)
-                import subprocess
-                try:
-                    # Send SIGHUP to reload config without restarting
-                    subprocess.run(['pkill', '-HUP', 'cloudflared'], check=True)
-                    await self.log_operation(deployment_id, f"Tunnel configuration reloaded for {hostname}")
-                except subprocess.CalledProcessError:
-                    # If no cloudflared process found, that's okay
-                    await self.log_operation(deployment_id, f"Tunnel route added (tunnel will pick up config on next start)")
-                except Exception as e:
-                    await self.log_operation(deployment_id, f"Warning: Could not reload tunnel config: {e}", LogLevel.WARNING)
-            else:
-                await self.log_operation(deployment_id, f"Tunnel route already exists for {hostname}")
-            
             return True
                 
         except Exception as e:
+            CLOUDFLARE_ERRORS.inc("tunnel_add")
             await self.log_operation(deployment_id, f"Tunnel route creation failed: {str(e)}", LogLevel.ERROR)
             return False
     
@@ -199,66 +221,236 @@ class CloudflareService:
                 await self.log_operation(deployment_id, f"Removing tunnel route for {subdomain}")
             
             hostname = f"{subdomain}.{self.base_domain}"
-            config_path = os.path.expanduser("~/.cloudflared/config.yml")
-            
-            # Read current config as text
-            with open(config_path, 'r') as f:
-                lines = f.readlines()
-            
-            # Remove lines that contain this hostname
-            original_length = len(lines)
-            filtered_lines = []
-            skip_next = False
+            config_path = self.tunnel_config_path
             
-            for line in lines:
-                if f"hostname: {hostname}" in line:
-                    skip_next = True  # Skip the service line too
-                    continue
-                elif skip_next and "service:" in line:
-                    skip_next = False
-                    continue
-                else:
-                    filtered_lines.append(line)
-            
-            if len(filtered_lines) < original_length:
-                # Write updated config
-                with open(config_path, 'w') as f:
-                    f.writelines(filtered_lines)
+            async with lease("tunnel") as held:
+                # Read current config as text
+                with open(config_path, 'r') as f:
+                    lines = f.readlines()
                 
-                if deployment_id:
-                    await self.log_operation(deployment_id, f"Removed tunnel route for {hostname}")
+                # Remove lines that contain this hostname
+                original_length = len(lines)
+                filtered_lines = []
+                skip_next = False
                 
-                # Send reload signal to tunnel (graceful reload without killing)
-                import subprocess
-                try:
-                    # Send SIGHUP to reload config without restarting
-                    subprocess.run(['pkill', '-HUP', 'cloudflared'], check=False)
+                for line in lines:
+                    if f"hostname: {hostname}" in line:
+                        skip_next = True  # Skip the service line too
+                        continue
+                    elif skip_next and "service:" in line:
+                        skip_next = False
+                        continue
+                    else:
+                        filtered_lines.append(line)
+                
+                if len(filtered_lines) < original_length:
+                    await held.check()
+                    # Write updated config
+                    with open(config_path, 'w') as f:
+                        f.writelines(filtered_lines)
+                    
                     if deployment_id:
-                        await self.log_operation(deployment_id, f"Tunnel configuration reloaded after removing {hostname}")
-                except Exception as e:
+                        await self.log_operation(deployment_id, f"Removed tunnel route for {hostname}")
+                    
+                    # Send reload signal to tunnel (graceful reload without killing)
+                    try:
+                        # Send SIGHUP to reload config without restarting
+                        self.reload_tunnel(check=False)
+                        if deployment_id:
+                            await self.log_operation(deployment_id, f"Tunnel configuration reloaded after removing {hostname}")
+                    except Exception as e:
+                        if deployment_id:
+                            await self.log_operation(deployment_id, f"Warning: Could not reload tunnel config: {e}", LogLevel.WARNING)
+                else:
                     if deployment_id:
-                        await self.log_operation(deployment_id, f"Warning: Could not reload tunnel config: {e}", LogLevel.WARNING)
-            else:
-                if deployment_id:
-                    await self.log_operation(deployment_id, f"No tunnel route found for {hostname}")
-            
+                        await self.log_operation(deployment_id, f"No tunnel route found for {hostname}")
+                
             return True
         except Exception as e:
+            CLOUDFLARE_ERRORS.inc("tunnel_remove")
             if deployment_id:
                 await self.log_operation(deployment_id, f"Tunnel route removal failed: {str(e)}", LogLevel.ERROR)
             else:
                 print(f"Tunnel route removal failed: {e}")
             return False
     
+    def read_tunnel_routes(self) -> Dict[str, str]:
+        """hostname -> service for every ingress rule in the tunnel config"""
+        routes = {}
+        hostname = None
+        with open(self.tunnel_config_path, 'r') as f:
+            for line in f:
+                entry = line.strip().lstrip("-").strip()
+                if entry.startswith("hostname:"):
+                    # Wildcard hostnames are quoted, as YAML reads a leading * as an alias
+                    hostname = entry.split(":", 1)[1].strip().strip("\"'")
+                elif entry.startswith("service:") and hostname:
+                    routes[hostname] = entry.split(":", 1)[1].strip()
+                    hostname = None
+        return routes
+    
+    async def update_tunnel_routes(self, add: List[str], remove: List[str]) -> bool:
+        """Add and remove several hostnames with a single config write and tunnel reload"""
+        try:
+            async with lease("tunnel") as held:
+                with open(self.tunnel_config_path, 'r') as f:
+                    lines = f.readlines()
+                
+                removed = set(remove)
+                kept_lines = []
+                skip_next = False
+                for line in lines:
+                    entry = line.strip().lstrip("-").strip()
+                    if entry.startswith("hostname:") and entry.split(":", 1)[1].strip() in removed:
+                        skip_next = True
+                        continue
+                    if skip_next and "service:" in line:
+                        skip_next = False
+                        continue
+                    kept_lines.append(line)
+                
+                existing = {line.strip().lstrip("-").strip().split(":", 1)[1].strip() for line in kept_lines if "hostname:" in line}
+                insert_index = next((i for i, line in enumerate(kept_lines) if 'service: http_status:404' in line), -1)
+                new_lines = []
+                for hostname in add:
+                    if hostname not in existing:
+                        new_lines += [f"  - hostname: {hostname}\n", "    service: http://localhost:80\n"]
+                if new_lines and insert_index > 0:
+                    kept_lines[insert_index:insert_index] = new_lines
+                
+                if kept_lines != lines:
+                    await held.check()
+                    with open(self.tunnel_config_path, 'w') as f:
+                        f.writelines(kept_lines)
+                    self.reload_tunnel(check=False)
+            return True
+        
+        except Exception as e:
+            CLOUDFLARE_ERRORS.inc("tunnel_update")
+            print(f"Tunnel config update failed: {e}")
+            return False
+    
+    async def list_tunnel_dns_records(self) -> Optional[List[Dict[str, Any]]]:
+        """Every CNAME record in the zone that points at this tunnel, or None if the listing failed"""
+        target = f"{self.tunnel_id}.cfargotunnel.com"
+        records = []
+        page = 1
+        while True:
+            response = await self._make_request(
+                "GET",
+                f"/zones/{self.zone_id}/dns_records?type=CNAME&content={target}&per_page=500&page={page}"
+            )
+            if response is None:
+                return None
+            records.extend(record for record in response.get("result") or [] if record.get("content") == target)
+            if page >= (response.get("result_info") or {}).get("total_pages", 1):
+                return records
+            page += 1
+    
+    async def delete_dns_record(self, record_id: str) -> bool:
+        result = await self._make_request("DELETE", f"/zones/{self.zone_id}/dns_records/{record_id}")
+        return bool(result and result.get("success"))
+    
+    def has_hostname_route(self, subdomain: str) -> bool:
+        """Whether the deployment got its own tunnel route (and with it a DNS record) rather than relying on the wildcard"""
+        try:
+            return f"{subdomain}.{self.base_domain}" in self.read_tunnel_routes()
+        except OSError:
+            return False
+    
+    async def _ensure_wildcard_dns(self, hostname: str) -> bool:
+        target = f"{self.tunnel_id}.cfargotunnel.com"
+        
+        async def lookup() -> Optional[List[Dict[str, Any]]]:
+            existing = await self._make_request("GET", f"/zones/{self.zone_id}/dns_records?name={hostname}")
+            return None if existing is None else existing.get("result") or []
+        
+        records = await lookup()
+        if records is None:
+            return False
+        if not records:
+            result = await self._make_request(
+                "POST",
+                f"/zones/{self.zone_id}/dns_records",
+                {"type": "CNAME", "name": "*", "content": target, "ttl": 1, "proxied": True, "comment": DNS_RECORD_COMMENT}
+            )
+            if result and result.get("success"):
+                return True
+            # Rejected as a duplicate when someone else created it first; what matters is what exists now
+            records = await lookup()
+            if not records:
+                return False
+        
+        if any(record.get("type") == "CNAME" and record.get("content") == target for record in records):
+            return True
+        # Someone else's wildcard record; leave it alone and keep using per-hostname records
+        print(f"Wildcard DNS record {hostname} exists but does not point at the tunnel")
+        return False
+    
+    async def _ensure_wildcard_ingress(self, hostname: str) -> bool:
+        async with lease("tunnel") as held:
+            if hostname in self.read_tunnel_routes():
+                return True
+            
+            with open(self.tunnel_config_path, 'r') as f:
+                lines = f.readlines()
+            # After every per-hostname rule (cloudflared uses the first match), before the catch-all
+            insert_index = next((i for i, line in enumerate(lines) if 'service: http_status:404' in line), -1)
+            if insert_index <= 0:
+                print(f"No catch-all rule in {self.tunnel_config_path}; cannot add the wildcard ingress")
+                return False
+            lines[insert_index:insert_index] = [f'  - hostname: "{hostname}"\n', "    service: http://localhost:80\n"]
+            
+            await held.check()
+            with open(self.tunnel_config_path, 'w') as f:
+                f.writelines(lines)
+            self.reload_tunnel(check=False)
+        return True
+    
+    async def ensure_wildcard(self) -> bool:
+        """
+        Create the *.BASE_DOMAIN DNS record and tunnel ingress rule if they
+        are missing, and record whether deploys can rely on them. Runs at
+        startup and when the reconciler finds either gone; until it succeeds,
+        deploys create per-hostname records and routes as before.
+        """
+        global _wildcard_active
+        if not self.wildcard_enabled:
+            _wildcard_active = False
+            return False
+        
+        hostname = f"*.{self.base_domain}"
+        try:
+            # Workers starting together would otherwise all try to create the record
+            async with lease("tunnel"):
+                active = await self._ensure_wildcard_dns(hostname) and await self._ensure_wildcard_ingress(hostname)
+        except Exception as e:
+            CLOUDFLARE_ERRORS.inc("wildcard")
+            print(f"Wildcard Cloudflare setup failed: {e}")
+            active = False
+        
+        if not active:
+            print(f"Cloudflare wildcard for {hostname} is not in place; deploys will create per-hostname routes")
+        _wildcard_active = active
+        return active
+    
     async def setup_deployment_cloudflare(self, subdomain: str, port: int, deployment_id: str) -> bool:
         try:
+            if wildcard_active():
+                await self.log_operation(deployment_id, f"{subdomain}.{self.base_domain} is served by the wildcard DNS record and tunnel route")
+                return True
+            
             # Create DNS record
-            dns_success = await self.create_dns_record(subdomain, deployment_id)
+            async with span("dns") as stage:
+                dns_success = await self.create_dns_record(subdomain, deployment_id)
+                stage["status"] = "ok" if dns_success else "failed"
             if not dns_success:
                 return False
             
             # Create tunnel route
-            tunnel_success = await self.create_tunnel_route(subdomain, port, deployment_id)
+            async with span("tunnel") as stage:
+                tunnel_success = await self.create_tunnel_route(subdomain, port, deployment_id)
+                stage["status"] = "ok" if tunnel_success else "failed"
             if not tunnel_success:
                 # Cleanup DNS record if tunnel fails
                 await self.remove_dns_record(subdomain, deployment_id)
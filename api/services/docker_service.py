@@ -1,24 +1,88 @@
 import docker
 import os
+import time
 import tempfile
 import shutil
+import socket
 import asyncio
+import threading
 from typing import Optional, Dict, Any
-from git import Repo
-from models import get_database, DeploymentModel, BuildLogModel, DeploymentStatus, LogLevel
+from models import get_database, mark_deployments_changed, DeploymentModel, DeploymentStatus, LogLevel
+from .readiness_service import ReadinessService
+from .event_service import event_bus
+from .metrics import STAGE_DURATION, DOCKER_ERRORS, BUILDS_IN_FLIGHT
+from .timeline_service import span, current_timeline
+from .log_service import write_log
+from .journal_service import StepJournal
+
+LOCAL_ENGINE = "local"
+
+# Set on every container the platform starts, so the reconciler can tell its containers from anything else
+DEPLOYMENT_LABEL = "deployment-lab.deployment-id"
+REPLICA_LABEL = "deployment-lab.replica"
+
+# One client per Docker endpoint, shared across requests; LOCAL_ENGINE is the engine from the environment
+_engine_clients: Dict[str, Any] = {}
+
+def register_engine_client(docker_url: str, client: Any):
+    """Pin a client for an endpoint URL, e.g. a fake engine stand-in for local testing"""
+    _engine_clients[docker_url] = client
+
+def get_engine_client(docker_url: str = LOCAL_ENGINE):
+    client = _engine_clients.get(docker_url)
+    if client is None:
+        client = docker.from_env() if docker_url == LOCAL_ENGINE else docker.DockerClient(base_url=docker_url)
+        _engine_clients[docker_url] = client
+    return client
+
+def forget_engine_client(docker_url: str):
+    _engine_clients.pop(docker_url, None)
+
+class BuildAbort:
+    """
+    Stops a build running in an executor thread. Setting it shuts down the
+    socket of the build's response, so a read blocked on a build that prints
+    nothing fails at once instead of after BUILD_STALL_TIMEOUT.
+    """
 
-class DockerService:
     def __init__(self):
-        self.client = docker.from_env()
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._socket = None
+
+    def attach(self, sock):
+        with self._lock:
+            self._socket = sock
+            if self._event.is_set():
+                self._shutdown()
+
+    def set(self):
+        with self._lock:
+            self._event.set()
+            self._shutdown()
+
+    def is_set(self) -> bool:
+        return self._event.is_set()
+
+    def _shutdown(self):
+        if self._socket is None:
+            return
+        try:
+            self._socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+class DockerService:
+    def __init__(self, client=None):
+        # Defaults to the local engine; NodeService passes clients for remote nodes
+        self.client = client or get_engine_client()
+        self.clone_timeout = float(os.getenv("CLONE_TIMEOUT", "300"))
+        self.build_timeout = float(os.getenv("BUILD_TIMEOUT", "1800"))
+        # A build with no output for this long is abandoned (a hung `npm ci` prints nothing)
+        self.build_stall_timeout = float(os.getenv("BUILD_STALL_TIMEOUT", "600"))
         
     async def log_build(self, deployment_id: str, message: str, level: LogLevel = LogLevel.INFO):
-        db = get_database()
-        log_entry = BuildLogModel(
-            deployment_id=deployment_id,
-            message=message,
-            log_level=level
-        )
-        await db.build_logs.insert_one(log_entry.dict(by_alias=True))
+        await write_log(deployment_id, message, level)
         
     async def update_deployment_status(self, deployment_id: str, status: DeploymentStatus):
         from bson import ObjectId
@@ -27,17 +91,48 @@ class DockerService:
             {"_id": ObjectId(deployment_id)},
             {"$set": {"status": status}}
         )
+        await mark_deployments_changed(deployment_id)
+        event_bus.publish_status(deployment_id, status)
     
-    async def clone_repository(self, github_url: str, deployment_id: str) -> Optional[str]:
+    async def clone_repository(self, github_url: str, deployment_id: str, path: Optional[str] = None) -> Optional[str]:
+        """
+        Clone into path (replacing whatever a failed attempt left there), or a
+        new temp dir. git runs as a child process, so a clone that exceeds
+        CLONE_TIMEOUT or whose deploy is cancelled is killed rather than left
+        holding a thread.
+        """
+        process = None
         try:
-            temp_dir = tempfile.mkdtemp()
+            if path:
+                shutil.rmtree(path, ignore_errors=True)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp_dir = path or tempfile.mkdtemp()
             await self.log_build(deployment_id, f"Cloning repository: {github_url}")
             
-            loop = asyncio.get_event_loop()
-            await loop.run_in_executor(None, Repo.clone_from, github_url, temp_dir)
+            process = await asyncio.create_subprocess_exec(
+                "git", "clone", "--quiet", github_url, temp_dir,
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.PIPE,
+                # A private repository must fail, not wait for a password
+                env={**os.environ, "GIT_TERMINAL_PROMPT": "0"}
+            )
+            try:
+                _, stderr = await asyncio.wait_for(process.communicate(), self.clone_timeout)
+            except asyncio.TimeoutError:
+                process.kill()
+                await process.wait()
+                shutil.rmtree(temp_dir, ignore_errors=True)
+                await self.log_build(deployment_id, f"Clone timed out after {self.clone_timeout:.0f}s", LogLevel.ERROR)
+                return None
+            if process.returncode != 0:
+                raise RuntimeError(stderr.decode(errors="replace").strip() or f"git exited with status {process.returncode}")
             
             await self.log_build(deployment_id, f"Repository cloned to: {temp_dir}")
             return temp_dir
+        except asyncio.CancelledError:
+            if process and process.returncode is None:
+                process.kill()
+            raise
         except Exception as e:
             await self.log_build(deployment_id, f"Failed to clone repository: {str(e)}", LogLevel.ERROR)
             return None
@@ -222,31 +317,134 @@ CMD ["nginx", "-g", "daemon off;"]
                 
             image_tag = f"{safe_name}:{deployment.id}"
             
+            # Set on timeout or cancellation; see _run_build
+            abort = BuildAbort()
             loop = asyncio.get_event_loop()
-            image = await loop.run_in_executor(
-                None, 
-                lambda: self.client.images.build(
-                    path=repo_path, 
-                    tag=image_tag,
-                    rm=True
-                )[0]
-            )
+            try:
+                steps = await asyncio.wait_for(
+                    loop.run_in_executor(None, self._run_build, repo_path, image_tag, deployment.id, abort),
+                    self.build_timeout
+                )
+            except asyncio.TimeoutError:
+                abort.set()
+                DOCKER_ERRORS.inc("build")
+                await self.log_build(deployment.id, f"Docker build timed out after {self.build_timeout:.0f}s", LogLevel.ERROR)
+                await self.discard_build(image_tag, deployment.id)
+                return None
+            except asyncio.CancelledError:
+                abort.set()
+                await self.discard_build(image_tag, deployment.id)
+                raise
+            finished = time.monotonic()
+            
+            # Each Dockerfile step lasts until the next one starts
+            timeline = current_timeline()
+            if timeline:
+                for index, (started, step) in enumerate(steps):
+                    step_finished = steps[index + 1][0] if index + 1 < len(steps) else finished
+                    instruction = step.split(" : ", 1)[-1].split(" ", 1)[0].upper()
+                    await timeline.add_span({"name": f"build.{instruction}", "detail": {"step": step}}, started, step_finished)
             
             await self.log_build(deployment.id, f"Docker image built: {image_tag}")
             return image_tag
             
         except Exception as e:
+            DOCKER_ERRORS.inc("build")
             await self.log_build(deployment.id, f"Docker build failed: {str(e)}", LogLevel.ERROR)
             return None
     
-    async def run_container(self, image_tag: str, deployment: DeploymentModel) -> Optional[str]:
+    def _open_build_stream(self, repo_path: str, image_tag: str, deployment_id: str, abort: BuildAbort):
+        """Start the build and hand its response's socket to `abort`"""
+        api = self.client.api
+        build_thread = threading.get_ident()
+        
+        # The SDK doesn't expose the build's HTTP response; catch it as it arrives, on this thread only
+        def capture(response, *args, **kwargs):
+            if threading.get_ident() == build_thread and "/build" in response.request.path_url:
+                try:
+                    abort.attach(api._get_raw_response_socket(response))
+                except Exception:
+                    # Without the socket a silent build still ends at the read timeout
+                    pass
+        
+        api.hooks["response"].append(capture)
+        try:
+            return api.build(
+                path=repo_path,
+                tag=image_tag,
+                rm=True,
+                forcerm=True,
+                decode=True,
+                labels={DEPLOYMENT_LABEL: deployment_id},
+                # Reads never outlast the build deadline either
+                timeout=min(self.build_stall_timeout, self.build_timeout)
+            )
+        finally:
+            api.hooks["response"].remove(capture)
+    
+    def _run_build(self, repo_path: str, image_tag: str, deployment_id: str, abort: BuildAbort) -> list:
+        """
+        Build through the streaming API; returns (monotonic start time, "Step
+        n/m : ...") per Dockerfile step. Stops as soon as `abort` is set, or
+        after BUILD_STALL_TIMEOUT seconds without output; closing the stream
+        makes the engine stop the build.
+        """
+        steps = []
+        stream = self._open_build_stream(repo_path, image_tag, deployment_id, abort)
+        try:
+            for chunk in stream:
+                if abort.is_set():
+                    break
+                if "error" in chunk:
+                    raise docker.errors.BuildError(chunk["error"], [])
+                line = chunk.get("stream", "")
+                if line.startswith("Step "):
+                    steps.append((time.monotonic(), line.strip()))
+        except Exception:
+            # An aborted build's read fails on the shut-down socket
+            if not abort.is_set():
+                raise
+        finally:
+            stream.close()
+        if abort.is_set():
+            # The build may have finished before it noticed; don't leave the image behind
+            self._discard_build(image_tag, deployment_id)
+        return steps
+    
+    def _discard_build(self, image_tag: str, deployment_id: str):
+        try:
+            self.client.images.remove(image_tag, force=True)
+        except Exception:
+            pass
+        try:
+            # Untagged layers of an aborted build carry the deployment label
+            self.client.images.prune(filters={"dangling": True, "label": f"{DEPLOYMENT_LABEL}={deployment_id}"})
+        except Exception as e:
+            print(f"Failed to prune images of deployment {deployment_id}: {e}")
+    
+    async def discard_build(self, image_tag: str, deployment_id: str):
+        """Remove the image of an abandoned build and its untagged layers"""
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(None, self._discard_build, image_tag, deployment_id)
+    
+    async def run_container(
+        self,
+        image_tag: str,
+        deployment: DeploymentModel,
+        port: Optional[int] = None,
+        replica: int = 0
+    ) -> Optional[str]:
+        """Start a container for the deployment; extra replicas pass their own host port and index"""
         try:
+            host_port = port or deployment.port
             await self.log_build(deployment.id, f"Starting container from image: {image_tag}")
             
             # Clean up any orphaned containers using this port first
-            await self.cleanup_orphaned_containers_on_port(deployment.port)
+            await self.cleanup_orphaned_containers_on_port(host_port)
             
             container_name = f"{deployment.name}-{deployment.id}"
+            if replica:
+                container_name = f"{container_name}-r{replica}"
             
             env_vars = deployment.env_vars.copy()
             # Don't set PORT - let it use the hardcoded PORT=3000 from Dockerfile
@@ -258,16 +456,28 @@ CMD ["nginx", "-g", "daemon off;"]
                 masked_value = value[:4] + "***" if len(value) > 4 else "***"
                 await self.log_build(deployment.id, f"  {key}={masked_value}")
             
+            resources = deployment.resources
+            await self.log_build(
+                deployment.id,
+                f"Resource limits: cpus={resources.cpus}, memory={resources.memory_mb}MB, pids={resources.pids}"
+            )
+            
             loop = asyncio.get_event_loop()
             container = await loop.run_in_executor(
                 None,
                 lambda: self.client.containers.run(
                     image_tag,
                     name=container_name,
-                    ports={'3000/tcp': deployment.port},
+                    ports={'3000/tcp': host_port},
                     environment=env_vars,
+                    labels={DEPLOYMENT_LABEL: deployment.id, REPLICA_LABEL: str(replica)},
                     detach=True,
-                    restart_policy={"Name": "unless-stopped"}
+                    restart_policy={"Name": "unless-stopped"},
+                    nano_cpus=int(resources.cpus * 1_000_000_000),
+                    mem_limit=f"{resources.memory_mb}m",
+                    # Same as mem_limit so the container can't spill into swap
+                    memswap_limit=f"{resources.memory_mb}m",
+                    pids_limit=resources.pids
                 )
             )
             
@@ -275,9 +485,21 @@ CMD ["nginx", "-g", "daemon off;"]
             return container.id
             
         except Exception as e:
+            DOCKER_ERRORS.inc("run")
             await self.log_build(deployment.id, f"Failed to start container: {str(e)}", LogLevel.ERROR)
             return None
     
+    async def start_container(self, container_id: str) -> bool:
+        try:
+            loop = asyncio.get_event_loop()
+            container = await loop.run_in_executor(None, self.client.containers.get, container_id)
+            await loop.run_in_executor(None, container.start)
+            return True
+        except Exception as e:
+            DOCKER_ERRORS.inc("start")
+            print(f"Failed to start container {container_id}: {e}")
+            return False
+    
     async def stop_container(self, container_id: str) -> bool:
         try:
             loop = asyncio.get_event_loop()
@@ -285,6 +507,7 @@ CMD ["nginx", "-g", "daemon off;"]
             await loop.run_in_executor(None, container.stop)
             return True
         except Exception as e:
+            DOCKER_ERRORS.inc("stop")
             print(f"Failed to stop container {container_id}: {e}")
             return False
     
@@ -295,6 +518,7 @@ CMD ["nginx", "-g", "daemon off;"]
             await loop.run_in_executor(None, container.remove)
             return True
         except Exception as e:
+            DOCKER_ERRORS.inc("remove_container")
             print(f"Failed to remove container {container_id}: {e}")
             return False
     
@@ -304,6 +528,7 @@ CMD ["nginx", "-g", "daemon off;"]
             await loop.run_in_executor(None, self.client.images.remove, image_tag)
             return True
         except Exception as e:
+            DOCKER_ERRORS.inc("remove_image")
             print(f"Failed to remove image {image_tag}: {e}")
             return False
     
@@ -338,43 +563,126 @@ CMD ["nginx", "-g", "daemon off;"]
         except Exception as e:
             print(f"Failed to cleanup orphaned containers on port {port}: {e}")
     
-    async def deploy_from_github(self, deployment: DeploymentModel) -> bool:
+    async def image_exists(self, image_tag: str) -> bool:
         try:
+            loop = asyncio.get_event_loop()
+            await loop.run_in_executor(None, self.client.images.get, image_tag)
+            return True
+        except Exception:
+            return False
+    
+    async def container_exists(self, container_id: str) -> bool:
+        try:
+            loop = asyncio.get_event_loop()
+            await loop.run_in_executor(None, self.client.containers.get, container_id)
+            return True
+        except Exception:
+            return False
+    
+    async def deploy_from_github(
+        self,
+        deployment: DeploymentModel,
+        host: str = "127.0.0.1",
+        journal: Optional[StepJournal] = None
+    ) -> bool:
+        """Clone, build, start and wait for readiness, skipping the steps the journal says an earlier attempt finished"""
+        journal = journal or StepJournal(deployment.id, persist=False)
+        repo_path = journal.workspace
+        BUILDS_IN_FLIGHT.inc()
+        try:
+            from datetime import datetime
+            if journal.done("ready"):
+                return True
             await self.update_deployment_status(deployment.id, DeploymentStatus.BUILDING)
             
-            repo_path = await self.clone_repository(deployment.github_url, deployment.id)
-            if not repo_path:
-                await self.update_deployment_status(deployment.id, DeploymentStatus.FAILED)
-                return False
+            # Resources recorded by an interrupted attempt may have been removed since
+            container_id = journal.get("container_started").get("container_id")
+            if container_id and not await self.container_exists(container_id):
+                await self.log_build(deployment.id, "Container from the previous attempt is gone; starting a new one")
+                await journal.forget("container_started")
+                container_id = None
+            image_tag = journal.get("built").get("image_tag")
+            if not container_id and image_tag and not await self.image_exists(image_tag):
+                await self.log_build(deployment.id, "Image from the previous attempt is gone; rebuilding")
+                await journal.forget("built")
+                image_tag = None
             
-            image_tag = await self.build_image(repo_path, deployment)
-            if not image_tag:
-                await self.cleanup_build_files(repo_path)
-                await self.update_deployment_status(deployment.id, DeploymentStatus.FAILED)
-                return False
+            if not container_id and not image_tag:
+                if journal.done("cloned") and os.path.isdir(os.path.join(repo_path, ".git")):
+                    await self.log_build(deployment.id, f"Reusing the clone in {repo_path}")
+                else:
+                    event_bus.publish("stage", deployment.id, stage="clone")
+                    started = time.monotonic()
+                    async with span("clone") as stage:
+                        cloned = await self.clone_repository(deployment.github_url, deployment.id, repo_path)
+                        stage["status"] = "ok" if cloned else "failed"
+                    STAGE_DURATION.observe(time.monotonic() - started, "clone")
+                    if not cloned:
+                        await self.update_deployment_status(deployment.id, DeploymentStatus.FAILED)
+                        return False
+                    await journal.complete("cloned", workspace=repo_path)
+                
+                event_bus.publish("stage", deployment.id, stage="build")
+                started = time.monotonic()
+                async with span("build") as stage:
+                    image_tag = await self.build_image(repo_path, deployment)
+                    stage["status"] = "ok" if image_tag else "failed"
+                STAGE_DURATION.observe(time.monotonic() - started, "build")
+                if not image_tag:
+                    await self.cleanup_build_files(repo_path)
+                    await self.update_deployment_status(deployment.id, DeploymentStatus.FAILED)
+                    return False
+                await journal.complete("built", image_tag=image_tag)
             
-            container_id = await self.run_container(image_tag, deployment)
             if not container_id:
-                # Clean up the Docker image since container failed to start
-                await self.remove_image(image_tag)
-                await self.cleanup_build_files(repo_path)
+                event_bus.publish("stage", deployment.id, stage="run")
+                started = time.monotonic()
+                async with span("container_start") as stage:
+                    container_id = await self.run_container(image_tag, deployment)
+                    stage["status"] = "ok" if container_id else "failed"
+                STAGE_DURATION.observe(time.monotonic() - started, "run")
+                if not container_id:
+                    # Clean up the Docker image since container failed to start
+                    await self.remove_image(image_tag)
+                    await self.cleanup_build_files(repo_path)
+                    await self.update_deployment_status(deployment.id, DeploymentStatus.FAILED)
+                    return False
+                
+                # Record the container but keep it out of the nginx map until it is ready
+                await journal.complete(
+                    "container_started",
+                    {"container_id": container_id, "docker_image": image_tag},
+                    container_id=container_id
+                )
+            
+            await self.cleanup_build_files(repo_path)
+            
+            event_bus.publish("stage", deployment.id, stage="readiness")
+            readiness_service = ReadinessService(self.client)
+            async with span("readiness") as stage:
+                time_to_ready = await readiness_service.wait_until_ready(
+                    deployment.id,
+                    container_id,
+                    host,
+                    deployment.port,
+                    getattr(deployment, "readiness_path", None)
+                )
+                stage["status"] = "ok" if time_to_ready is not None else "failed"
+            if time_to_ready is None:
                 await self.update_deployment_status(deployment.id, DeploymentStatus.FAILED)
                 return False
+            STAGE_DURATION.observe(time_to_ready, "readiness")
             
-            from bson import ObjectId
-            db = get_database()
-            await db.deployments.update_one(
-                {"_id": ObjectId(deployment.id)},
+            await journal.complete(
+                "ready",
                 {
-                    "$set": {
-                        "container_id": container_id,
-                        "docker_image": image_tag,
-                        "status": DeploymentStatus.RUNNING
-                    }
+                    "status": DeploymentStatus.RUNNING,
+                    "ready_at": datetime.utcnow(),
+                    "time_to_ready": round(time_to_ready, 3)
                 }
             )
+            event_bus.publish_status(deployment.id, DeploymentStatus.RUNNING, time_to_ready=round(time_to_ready, 3))
             
-            await self.cleanup_build_files(repo_path)
             await self.log_build(deployment.id, "Deployment completed successfully!")
             
             return True
@@ -382,4 +690,6 @@ CMD ["nginx", "-g", "daemon off;"]
         except Exception as e:
             await self.log_build(deployment.id, f"Deployment failed: {str(e)}", LogLevel.ERROR)
             await self.update_deployment_status(deployment.id, DeploymentStatus.FAILED)
-            return False
\ No newline at end of file
+            return False
+        finally:
+            BUILDS_IN_FLIGHT.dec()
\ No newline at end of file
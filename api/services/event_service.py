@@ -0,0 +1,76 @@
+import os
+import asyncio
+from collections import deque
+from datetime import datetime
+from typing import Dict, Any, Optional, List
+
+class EventBus:
+    """
+    In-process pub/sub for deployment events (status changes, creates,
+    deletes and pipeline stages). Recent events are kept in a ring buffer so
+    a reconnecting client can replay what it missed from its last event id.
+    Each subscriber has a bounded queue; one that falls behind is dropped and
+    left to reconnect and replay, so publishing never blocks the pipeline.
+    """
+
+    def __init__(self):
+        self.buffer_size = int(os.getenv("EVENT_BUFFER_SIZE", "500"))
+        self.queue_size = int(os.getenv("EVENT_QUEUE_SIZE", "100"))
+        self._recent: deque = deque(maxlen=self.buffer_size)
+        self._subscribers: List[asyncio.Queue] = []
+        self._sequence = 0
+
+    def publish(self, event_type: str, deployment_id: Optional[str] = None, **data: Any) -> Dict[str, Any]:
+        self._sequence += 1
+        event = {
+            "id": self._sequence,
+            "type": event_type,
+            "deployment_id": str(deployment_id) if deployment_id else None,
+            "timestamp": datetime.utcnow().isoformat(),
+            **data
+        }
+        self._recent.append(event)
+
+        for queue in list(self._subscribers):
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # Slow consumer: drop it and end its stream; the client replays on reconnect
+                self._subscribers.remove(queue)
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(None)
+        return event
+
+    def publish_status(self, deployment_id: str, status: str, **data: Any):
+        self.publish("status", deployment_id, status=status, **data)
+
+    def replay(self, last_event_id: Optional[int]) -> Optional[List[Dict[str, Any]]]:
+        """Buffered events after last_event_id, or None if some of them were already evicted"""
+        if last_event_id is None:
+            return []
+        if last_event_id > self._sequence:
+            # The server restarted and its numbering began again
+            return None
+        if self._recent and last_event_id < self._recent[0]["id"] - 1:
+            return None
+        return [event for event in self._recent if event["id"] > last_event_id]
+
+    def subscribe(self) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers.append(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        if queue in self._subscribers:
+            self._subscribers.remove(queue)
+
+    @property
+    def sequence(self) -> int:
+        return self._sequence
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+event_bus = EventBus()
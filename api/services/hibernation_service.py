@@ -0,0 +1,229 @@
+import os
+import asyncio
+from contextlib import AsyncExitStack
+from datetime import datetime, timedelta
+from typing import Dict
+from models import get_database, mark_deployments_changed, DeploymentStatus, ResourceProfile, LogLevel
+from .nginx_service import NginxService
+from .node_service import NodeService
+from .capacity_service import CapacityService
+from .readiness_service import ReadinessService
+from .activity_service import ActivityService
+from .event_service import event_bus
+from .log_service import write_log
+from .lease_service import lease, LeaseUnavailable
+
+# In-flight wakes by deployment id, so concurrent visitors share one container start
+_wake_tasks: Dict[str, asyncio.Task] = {}
+
+class HibernationService:
+    def __init__(self):
+        self.idle_timeout = timedelta(minutes=int(os.getenv("IDLE_TIMEOUT_MINUTES", "30")))
+        self.check_interval = int(os.getenv("HIBERNATE_CHECK_INTERVAL", "60"))
+        self.nginx_service = NginxService()
+        self.node_service = NodeService()
+        self.capacity_service = CapacityService()
+        self.activity_service = ActivityService()
+
+    async def log_operation(self, deployment_id: str, message: str, level: LogLevel = LogLevel.INFO):
+        await write_log(deployment_id, message, level)
+
+    async def _refresh_routes(self, deployment_id: str) -> bool:
+        if not await self.nginx_service.generate_mapping_file(deployment_id):
+            return False
+        return await self.nginx_service.reload_nginx(deployment_id)
+
+    async def hibernate_many(self, deployment_docs: list) -> int:
+        """
+        Hibernate several deployments with a single map rewrite and nginx reload.
+        Containers are stopped but kept, along with their image and port.
+        Each deployment is only hibernated if it is still running and has seen
+        no request since it was read, checked under its power lease so a wake
+        can't slip in between.
+        """
+        db = get_database()
+        if not deployment_docs:
+            return 0
+
+        async with AsyncExitStack() as held:
+            claimed = []
+            now = datetime.utcnow()
+            for doc in deployment_docs:
+                try:
+                    # A deployment being woken right now is skipped, not waited for
+                    await held.enter_async_context(lease(f"power:{doc['_id']}", wait=0))
+                except LeaseUnavailable:
+                    continue
+                result = await db.deployments.update_one(
+                    {"_id": doc["_id"], "status": DeploymentStatus.RUNNING, "last_request_at": doc.get("last_request_at")},
+                    {"$set": {"status": DeploymentStatus.HIBERNATED, "hibernated_at": now}}
+                )
+                if result.modified_count:
+                    claimed.append(doc)
+            if not claimed:
+                return 0
+
+            # Swap the routes to the wake endpoint before stopping anything
+            ids = [doc["_id"] for doc in claimed]
+            await mark_deployments_changed(*ids)
+            for deployment_id in ids:
+                event_bus.publish_status(deployment_id, DeploymentStatus.HIBERNATED)
+            await self._refresh_routes(str(ids[0]))
+
+            async def stop(doc):
+                deployment_id = str(doc["_id"])
+                docker_service = await self.node_service.get_docker_service(doc.get("node"))
+                container_ids = [doc.get("container_id")] + [instance["container_id"] for instance in doc.get("replica_instances", [])]
+                if not container_ids[0]:
+                    return False
+                results = await asyncio.gather(*(docker_service.stop_container(container_id) for container_id in container_ids))
+                if all(results):
+                    await self.log_operation(deployment_id, "Deployment hibernated: containers stopped, images and ports kept")
+                    return True
+                await self.log_operation(deployment_id, "Failed to stop container while hibernating", LogLevel.ERROR)
+                return False
+
+            results = await asyncio.gather(*(stop(doc) for doc in claimed))
+            return sum(1 for stopped in results if stopped)
+
+    async def hibernate(self, deployment_id: str) -> bool:
+        from bson import ObjectId
+        db = get_database()
+        deployment_doc = await db.deployments.find_one({"_id": ObjectId(deployment_id)})
+        if not deployment_doc or deployment_doc["status"] != DeploymentStatus.RUNNING:
+            return False
+
+        return await self.hibernate_many([deployment_doc]) == 1
+
+    async def wake(self, deployment_id: str) -> bool:
+        """Start a hibernated deployment; concurrent callers wait on the same wake"""
+        task = _wake_tasks.get(deployment_id)
+        if task is None or task.done():
+            task = asyncio.ensure_future(self._wake(deployment_id))
+            _wake_tasks[deployment_id] = task
+
+            def forget(finished_task, deployment_id=deployment_id):
+                if _wake_tasks.get(deployment_id) is finished_task:
+                    _wake_tasks.pop(deployment_id, None)
+
+            task.add_done_callback(forget)
+
+        # Shielded so one client disconnecting doesn't cancel the wake for everyone else
+        return await asyncio.shield(task)
+
+    async def _wake(self, deployment_id: str) -> bool:
+        # Serialized with hibernate_many, which would otherwise stop the containers being started
+        try:
+            async with lease(f"power:{deployment_id}"):
+                return await self._start_hibernated(deployment_id)
+        except LeaseUnavailable:
+            await self.log_operation(deployment_id, "Cannot wake deployment: it is being hibernated", LogLevel.WARNING)
+            return False
+
+    async def _start_hibernated(self, deployment_id: str) -> bool:
+        from bson import ObjectId
+        db = get_database()
+        deployment_doc = await db.deployments.find_one({"_id": ObjectId(deployment_id)})
+        if not deployment_doc:
+            return False
+        if deployment_doc["status"] == DeploymentStatus.RUNNING:
+            return True
+        if deployment_doc["status"] != DeploymentStatus.HIBERNATED or not deployment_doc.get("container_id"):
+            return False
+
+        try:
+            node = await self.node_service.get_node(deployment_doc["node"]) if deployment_doc.get("node") else None
+            resources = self.capacity_service.footprint(
+                ResourceProfile(**(deployment_doc.get("resources") or {})),
+                deployment_doc.get("replicas", 1)
+            )
+            if not await self.capacity_service.can_admit(resources, exclude_id=deployment_id, node=node):
+                await self.log_operation(deployment_id, "Cannot wake deployment: host capacity exhausted", LogLevel.WARNING)
+                return False
+
+            await self.log_operation(deployment_id, "Waking hibernated deployment")
+            docker_service = await self.node_service.get_docker_service(deployment_doc.get("node"))
+            instances = [{"port": deployment_doc["port"], "container_id": deployment_doc["container_id"]}]
+            instances += deployment_doc.get("replica_instances", [])
+
+            started = await asyncio.gather(*(docker_service.start_container(instance["container_id"]) for instance in instances))
+            if not all(started):
+                await self.log_operation(deployment_id, "Failed to start container while waking", LogLevel.ERROR)
+                await asyncio.gather(*(docker_service.stop_container(instance["container_id"]) for instance in instances))
+                return False
+
+            # Replicas boot in parallel; the wake takes as long as the slowest one
+            readiness_service = ReadinessService(docker_service.client)
+            ready_times = await asyncio.gather(*(
+                readiness_service.wait_until_ready(
+                    deployment_id,
+                    instance["container_id"],
+                    node["address"] if node else "127.0.0.1",
+                    instance["port"],
+                    deployment_doc.get("readiness_path")
+                )
+                for instance in instances
+            ))
+            if any(ready_time is None for ready_time in ready_times):
+                await asyncio.gather(*(docker_service.stop_container(instance["container_id"]) for instance in instances))
+                return False
+            time_to_ready = max(ready_times)
+
+            now = datetime.utcnow()
+            await db.deployments.update_one(
+                {"_id": ObjectId(deployment_id)},
+                {
+                    "$set": {
+                        "status": DeploymentStatus.RUNNING,
+                        "last_request_at": now,
+                        "ready_at": now,
+                        "time_to_ready": round(time_to_ready, 3)
+                    },
+                    "$unset": {"hibernated_at": ""}
+                }
+            )
+            await mark_deployments_changed(deployment_id)
+            event_bus.publish_status(deployment_id, DeploymentStatus.RUNNING, time_to_ready=round(time_to_ready, 3))
+            await self._refresh_routes(deployment_id)
+            await self.log_operation(deployment_id, f"Deployment woke in {time_to_ready:.1f}s")
+            return True
+
+        except Exception as e:
+            await self.log_operation(deployment_id, f"Wake failed: {str(e)}", LogLevel.ERROR)
+            return False
+
+    async def hibernate_idle(self) -> int:
+        """Hibernate scale-to-zero deployments that have served no request within the idle timeout"""
+        await self.activity_service.ingest()
+
+        db = get_database()
+        cutoff = datetime.utcnow() - self.idle_timeout
+        idle = await db.deployments.find(
+            {
+                "status": DeploymentStatus.RUNNING,
+                "scale_to_zero": True,
+                "$or": [
+                    {"last_request_at": {"$lt": cutoff}},
+                    # Never visited since it came up
+                    {"last_request_at": None, "ready_at": {"$lt": cutoff}}
+                ]
+            },
+            {"_id": 1, "node": 1, "container_id": 1, "replica_instances": 1, "last_request_at": 1}
+        ).to_list(length=None)
+
+        return await self.hibernate_many(idle)
+
+    async def run_idle_monitor(self):
+        """Background loop started with the API"""
+        while True:
+            try:
+                # One worker hibernates per pass; the others skip it
+                async with lease("idle-monitor", wait=0):
+                    hibernated = await self.hibernate_idle()
+                if hibernated:
+                    print(f"Hibernated {hibernated} idle deployments")
+            except LeaseUnavailable:
+                pass
+            except Exception as e:
+                print(f"Idle monitor failed: {e}")
+            await asyncio.sleep(self.check_interval)
@@ -0,0 +1,120 @@
+import os
+from datetime import datetime
+from typing import Dict, Any, List, Optional
+from models import get_database, mark_deployments_changed, DeploymentStatus
+
+# In pipeline order; each is recorded once its effect is durable
+PIPELINE_STEPS = ("cloned", "built", "container_started", "ready", "routed", "dns_ready")
+
+def workspace_path(deployment_id: str) -> str:
+    """Where a deployment's repository is cloned and built; the same path on every attempt"""
+    root = os.path.expanduser(os.getenv("BUILD_WORKSPACE_DIR", "~/.deployment-lab/builds"))
+    return os.path.join(root, deployment_id)
+
+class StepJournal:
+    """
+    The deploy pipeline's progress, kept on the deployment document as
+    `pipeline.steps.<step>`. A step is recorded in the same write as its
+    effect (the container id, the running status), so after a restart the
+    pipeline resumes after the last step it completed. Steps themselves are
+    idempotent: resuming re-checks what each recorded resource still exists.
+    """
+
+    def __init__(self, deployment_id: str, pipeline: Optional[Dict[str, Any]] = None, persist: bool = True):
+        self.deployment_id = deployment_id
+        pipeline = pipeline or {}
+        self.steps: Dict[str, Dict[str, Any]] = dict(pipeline.get("steps") or {})
+        self.attempt = pipeline.get("attempt", 0)
+        self.persist = persist
+
+    @classmethod
+    async def open(cls, deployment_doc: Dict[str, Any]) -> "StepJournal":
+        """Start the next attempt, keeping the steps an interrupted attempt completed"""
+        from bson import ObjectId
+        deployment_id = str(deployment_doc["_id"])
+        pipeline = deployment_doc.get("pipeline") or {}
+        if pipeline.get("finished_at"):
+            # A finished pipeline is never resumed; redeploying starts over
+            pipeline = {}
+        journal = cls(deployment_id, pipeline)
+        journal.attempt += 1
+
+        db = get_database()
+        await db.deployments.update_one(
+            {"_id": ObjectId(deployment_id)},
+            {"$set": {"pipeline": {
+                "steps": journal.steps,
+                "attempt": journal.attempt,
+                "started_at": pipeline.get("started_at") or datetime.utcnow(),
+                "resumed_at": datetime.utcnow() if journal.steps else None,
+                "finished_at": None,
+                "outcome": None
+            }}}
+        )
+        await mark_deployments_changed(deployment_id)
+        return journal
+
+    @property
+    def workspace(self) -> str:
+        return workspace_path(self.deployment_id)
+
+    @property
+    def last_step(self) -> Optional[str]:
+        completed = [step for step in PIPELINE_STEPS if step in self.steps]
+        return completed[-1] if completed else None
+
+    def done(self, step: str) -> bool:
+        return step in self.steps
+
+    def get(self, step: str) -> Dict[str, Any]:
+        return self.steps.get(step) or {}
+
+    async def complete(self, step: str, fields: Optional[Dict[str, Any]] = None, **data: Any):
+        """Record a step along with the deployment fields it produced, in one update"""
+        from bson import ObjectId
+        entry = {"at": datetime.utcnow(), **data}
+        self.steps[step] = entry
+        update = dict(fields or {})
+        if self.persist:
+            update[f"pipeline.steps.{step}"] = entry
+        if update:
+            db = get_database()
+            await db.deployments.update_one({"_id": ObjectId(self.deployment_id)}, {"$set": update})
+            await mark_deployments_changed(self.deployment_id)
+
+    async def forget(self, *steps: str):
+        """Drop steps whose resource turned out to be gone, so they run again"""
+        from bson import ObjectId
+        for step in steps:
+            self.steps.pop(step, None)
+        if self.persist:
+            db = get_database()
+            await db.deployments.update_one(
+                {"_id": ObjectId(self.deployment_id)},
+                {"$unset": {f"pipeline.steps.{step}": "" for step in steps}}
+            )
+            await mark_deployments_changed(self.deployment_id)
+
+    async def finish(self, outcome: str):
+        if not self.persist:
+            return
+        from bson import ObjectId
+        db = get_database()
+        await db.deployments.update_one(
+            {"_id": ObjectId(self.deployment_id)},
+            {"$set": {"pipeline.finished_at": datetime.utcnow(), "pipeline.outcome": outcome}}
+        )
+        await mark_deployments_changed(self.deployment_id)
+
+async def find_interrupted_deployments() -> List[str]:
+    """Deployments whose deploy pipeline was running when the API stopped"""
+    db = get_database()
+    docs = await db.deployments.find(
+        {"$or": [
+            {"pipeline.started_at": {"$ne": None}, "pipeline.finished_at": None},
+            # Created before pipelines were journaled
+            {"pipeline": None, "status": {"$in": [DeploymentStatus.PENDING, DeploymentStatus.BUILDING]}}
+        ]},
+        {"_id": 1}
+    ).to_list(length=None)
+    return [str(doc["_id"]) for doc in docs]
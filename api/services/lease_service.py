@@ -0,0 +1,130 @@
+import os
+import uuid
+import socket
+import asyncio
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from models import get_database
+
+# Leases held by the current task, so nested sections that need the same lease don't wait on themselves
+_held: ContextVar[Dict[str, "Lease"]] = ContextVar("held_leases", default={})
+
+# Identifies this process in lease documents; a uuid per acquisition keeps tasks of one process apart
+PROCESS_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+class LeaseUnavailable(Exception):
+    """Another holder kept the lease for longer than we were willing to wait"""
+
+class LeaseLost(Exception):
+    """The lease expired or was taken over; whatever it protected must not be written any more"""
+
+class Lease:
+    """
+    A named lock in the `leases` collection, held until released or until
+    LEASE_TTL_SECONDS pass without a renewal. Every acquisition increments
+    the lease's fencing token, so a holder that stalled past its expiry can
+    tell (check() raises LeaseLost) that someone newer has taken over before
+    it writes.
+    """
+
+    def __init__(self, name: str, owner: str, token: int, ttl: float):
+        self.name = name
+        self.owner = owner
+        self.token = token
+        self.ttl = ttl
+        self.lost = False
+        self._renewer: Optional[asyncio.Task] = None
+
+    async def check(self):
+        """Raise LeaseLost unless this lease is still the current holder; call right before each protected write"""
+        if self.lost:
+            raise LeaseLost(self.name)
+        db = get_database()
+        current = await db.leases.find_one({"_id": self.name}, {"owner": 1, "token": 1, "expires_at": 1})
+        if not current or current["owner"] != self.owner or current["token"] != self.token or current["expires_at"] <= datetime.utcnow():
+            self.lost = True
+            raise LeaseLost(self.name)
+
+    async def _renew(self):
+        db = get_database()
+        while True:
+            await asyncio.sleep(self.ttl / 3)
+            try:
+                result = await db.leases.update_one(
+                    {"_id": self.name, "owner": self.owner, "token": self.token},
+                    {"$set": {"expires_at": datetime.utcnow() + timedelta(seconds=self.ttl)}}
+                )
+            except Exception as e:
+                # Keep trying until the lease would have expired anyway; check() catches that
+                print(f"Failed to renew lease {self.name}: {e}")
+                continue
+            if result.matched_count == 0:
+                self.lost = True
+                print(f"Lost lease {self.name} (token {self.token})")
+                return
+
+    async def release(self):
+        if self._renewer:
+            self._renewer.cancel()
+        # Expire rather than delete, so the token keeps increasing for the next holder
+        db = get_database()
+        await db.leases.update_one(
+            {"_id": self.name, "owner": self.owner, "token": self.token},
+            {"$set": {"owner": None, "expires_at": datetime.utcnow()}}
+        )
+
+async def try_acquire(name: str, ttl: Optional[float] = None) -> Optional[Lease]:
+    """Take the lease if it is free or expired; None if someone else holds it"""
+    ttl = ttl or float(os.getenv("LEASE_TTL_SECONDS", "30"))
+    owner = f"{PROCESS_ID}:{uuid.uuid4().hex[:8]}"
+    now = datetime.utcnow()
+    db = get_database()
+    try:
+        doc = await db.leases.find_one_and_update(
+            {"_id": name, "$or": [{"expires_at": {"$lte": now}}, {"owner": None}]},
+            {"$set": {"owner": owner, "acquired_at": now, "expires_at": now + timedelta(seconds=ttl)}, "$inc": {"token": 1}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+    except DuplicateKeyError:
+        # The lease exists and is held: the filter didn't match, so the upsert tried to insert
+        return None
+    lease = Lease(name, owner, doc["token"], ttl)
+    lease._renewer = asyncio.create_task(lease._renew())
+    return lease
+
+@asynccontextmanager
+async def lease(name: str, wait: Optional[float] = None, ttl: Optional[float] = None):
+    """
+    Hold a lease for the duration of the block, renewing it in the background.
+    Waits up to `wait` seconds (LEASE_WAIT_SECONDS by default; 0 tries once)
+    and raises LeaseUnavailable if it stays held. Re-entering a lease the
+    current task already holds yields the same lease.
+    """
+    held = _held.get()
+    if name in held:
+        yield held[name]
+        return
+
+    wait = float(os.getenv("LEASE_WAIT_SECONDS", "60")) if wait is None else wait
+    deadline = asyncio.get_event_loop().time() + wait
+    delay = 0.05
+    while True:
+        acquired = await try_acquire(name, ttl)
+        if acquired:
+            break
+        if asyncio.get_event_loop().time() >= deadline:
+            raise LeaseUnavailable(name)
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, 1.0)
+
+    token = _held.set({**held, name: acquired})
+    try:
+        yield acquired
+    finally:
+        _held.reset(token)
+        await acquired.release()
@@ -0,0 +1,579 @@
+import os
+import re
+import gzip
+import json
+import shlex
+import base64
+import asyncio
+from enum import Enum
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Optional, Tuple, AsyncIterator
+from models import get_database, BuildLogModel, LogLevel
+from .lease_service import lease, LeaseUnavailable
+
+# Chunks store one character per line instead of the level name
+LEVEL_CODES = {"info": "i", "error": "e", "debug": "d", "warning": "w"}
+LEVEL_NAMES = {code: name for name, code in LEVEL_CODES.items()}
+
+def _level_name(level) -> str:
+    return level.value if isinstance(level, Enum) else str(level)
+
+def _raw_line(log: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "id": str(log["_id"]),
+        "message": log["message"],
+        "log_level": log["log_level"],
+        "timestamp": log["timestamp"].isoformat()
+    }
+
+def _line_time(chunk: Dict[str, Any], index: int) -> datetime:
+    return chunk["started_at"] + timedelta(milliseconds=chunk["offsets_ms"][index])
+
+def _chunk_line(chunk: Dict[str, Any], index: int) -> Dict[str, Any]:
+    return {
+        "id": f"{chunk['_id']}.{index}",
+        "message": chunk["messages"][index],
+        "log_level": LEVEL_NAMES.get(chunk["levels"][index], "info"),
+        "timestamp": _line_time(chunk, index).isoformat()
+    }
+
+def _encode_position(position: Dict[str, Any]) -> str:
+    payload = json.dumps(position, separators=(",", ":"), default=lambda value: value.isoformat())
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+def _decode_position(cursor: str) -> Dict[str, Any]:
+    """Raises ValueError for anything that isn't a cursor this service produced"""
+    from bson import ObjectId
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        position["t"] = datetime.fromisoformat(position["t"])
+        position["id"] = ObjectId(position["id"])
+        return position
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+def _highlight_patterns(text: str) -> Tuple[List["re.Pattern"], List["re.Pattern"]]:
+    """Patterns for the positive and the excluded terms and phrases of a $text query"""
+    try:
+        parts = shlex.split(text)
+    except ValueError:
+        parts = text.split()
+    patterns, excluded = [], []
+    for part in parts:
+        target = excluded if part.startswith("-") else patterns
+        part = part.lstrip("-")
+        if not part:
+            continue
+        if " " in part:
+            target.append(re.compile(re.escape(part), re.IGNORECASE))
+        else:
+            # The index has no language, so a term matches whole words regardless of case
+            target.append(re.compile(r"\b" + re.escape(part) + r"\b", re.IGNORECASE))
+    return patterns, excluded
+
+def _snippet(message: str, patterns: List["re.Pattern"], width: int) -> Tuple[str, List[List[int]]]:
+    """A window of the message around its first match, and [start, end) offsets of every match in it"""
+    matches = sorted((m.start(), m.end()) for pattern in patterns for m in pattern.finditer(message))
+    start = 0
+    if matches and len(message) > width:
+        start = max(0, min(matches[0][0] - width // 4, len(message) - width))
+    end = min(len(message), start + width)
+    prefix = "…" if start else ""
+    snippet = prefix + message[start:end] + ("…" if end < len(message) else "")
+
+    highlights: List[List[int]] = []
+    for match_start, match_end in matches:
+        if match_start < start or match_end > end:
+            continue
+        offset = len(prefix) - start
+        if highlights and match_start + offset < highlights[-1][1]:
+            # Overlapping matches from different terms merge into one highlight
+            highlights[-1][1] = max(highlights[-1][1], match_end + offset)
+        else:
+            highlights.append([match_start + offset, match_end + offset])
+    return snippet, highlights
+
+class LogWriter:
+    """
+    The one place build log lines are written. With LOG_STORAGE=lines each line
+    is its own build_logs document. With LOG_STORAGE=chunks, lines are buffered
+    per deployment for up to LOG_FLUSH_INTERVAL and appended to log_chunks
+    documents of up to LOG_CHUNK_LINES lines: parallel arrays of messages,
+    millisecond offsets from the chunk's start and one-letter levels.
+    """
+
+    def __init__(self):
+        self.storage = os.getenv("LOG_STORAGE", "lines")  # lines | chunks
+        self.chunk_lines = int(os.getenv("LOG_CHUNK_LINES", "500"))
+        self.flush_interval = float(os.getenv("LOG_FLUSH_INTERVAL", "0.2"))
+        self._pending: Dict[str, List[Tuple[datetime, str, str]]] = {}
+        # The chunk this process is appending to for each deployment
+        self._open: Dict[str, Dict[str, Any]] = {}
+        self._flusher: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+
+    async def write(self, deployment_id: str, message: str, level: LogLevel = LogLevel.INFO):
+        if self.storage != "chunks":
+            db = get_database()
+            log_entry = BuildLogModel(
+                deployment_id=deployment_id,
+                message=message,
+                log_level=level
+            )
+            await db.build_logs.insert_one(log_entry.dict(by_alias=True))
+            return
+
+        self._pending.setdefault(deployment_id, []).append((datetime.utcnow(), message, _level_name(level)))
+        if len(self._pending[deployment_id]) >= self.chunk_lines:
+            await self.flush(deployment_id)
+        elif self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_interval)
+        try:
+            await self.flush()
+        except Exception as e:
+            print(f"Failed to flush build logs: {e}")
+
+    async def flush(self, deployment_id: Optional[str] = None):
+        """Write buffered lines now (for one deployment, or all of them)"""
+        async with self._lock:
+            deployment_ids = [deployment_id] if deployment_id else list(self._pending)
+            for pending_id in deployment_ids:
+                lines = self._pending.pop(pending_id, None)
+                if lines:
+                    await self._append(pending_id, lines)
+
+    async def _append(self, deployment_id: str, lines: List[Tuple[datetime, str, str]]):
+        from bson import ObjectId
+        db = get_database()
+        while lines:
+            chunk = self._open.get(deployment_id)
+            if chunk is not None:
+                batch, lines = lines[:self.chunk_lines - chunk["count"]], lines[self.chunk_lines - chunk["count"]:]
+                result = await db.log_chunks.update_one(
+                    {"_id": chunk["_id"]},
+                    {
+                        "$push": {
+                            "messages": {"$each": [message for _, message, _ in batch]},
+                            "offsets_ms": {"$each": [
+                                int((timestamp - chunk["started_at"]).total_seconds() * 1000) for timestamp, _, _ in batch
+                            ]},
+                            "levels": {"$each": [LEVEL_CODES.get(level, "i") for _, _, level in batch]}
+                        },
+                        "$inc": {"count": len(batch)},
+                        "$set": {"ended_at": batch[-1][0]}
+                    }
+                )
+                if result.matched_count == 0:
+                    # Archived or expired underneath us; start a new chunk with these lines
+                    self._open.pop(deployment_id, None)
+                    lines = batch + lines
+                    continue
+                chunk["count"] += len(batch)
+            else:
+                batch, lines = lines[:self.chunk_lines], lines[self.chunk_lines:]
+                started_at = batch[0][0]
+                chunk = {"_id": ObjectId(), "started_at": started_at, "count": len(batch)}
+                await db.log_chunks.insert_one({
+                    "_id": chunk["_id"],
+                    "deployment_id": deployment_id,
+                    "started_at": started_at,
+                    "ended_at": batch[-1][0],
+                    "count": len(batch),
+                    "messages": [message for _, message, _ in batch],
+                    "offsets_ms": [int((timestamp - started_at).total_seconds() * 1000) for timestamp, _, _ in batch],
+                    "levels": [LEVEL_CODES.get(level, "i") for _, _, level in batch]
+                })
+            if chunk["count"] >= self.chunk_lines:
+                self._open.pop(deployment_id, None)
+            else:
+                self._open[deployment_id] = chunk
+
+log_writer = LogWriter()
+
+async def write_log(deployment_id: str, message: str, level: LogLevel = LogLevel.INFO):
+    await log_writer.write(deployment_id, message, level)
+
+async def chunk_raw_logs(deployment_id: str, chunk_lines: int) -> int:
+    """
+    Migrate a deployment's build_logs lines into log_chunks. Each chunk takes
+    the _id of its first line, so a rerun after a crash skips chunks already
+    written and only finishes deleting their lines.
+    """
+    from pymongo.errors import DuplicateKeyError
+    db = get_database()
+    migrated = 0
+    while True:
+        batch = await db.build_logs.find(
+            {"deployment_id": deployment_id}
+        ).sort([("timestamp", 1), ("_id", 1)]).limit(chunk_lines).to_list(length=chunk_lines)
+        if not batch:
+            return migrated
+        started_at = batch[0]["timestamp"]
+        try:
+            await db.log_chunks.insert_one({
+                "_id": batch[0]["_id"],
+                "deployment_id": deployment_id,
+                "started_at": started_at,
+                "ended_at": batch[-1]["timestamp"],
+                "count": len(batch),
+                "messages": [log["message"] for log in batch],
+                "offsets_ms": [int((log["timestamp"] - started_at).total_seconds() * 1000) for log in batch],
+                "levels": [LEVEL_CODES.get(_level_name(log["log_level"]), "i") for log in batch]
+            })
+        except DuplicateKeyError:
+            pass
+        await db.build_logs.delete_many({"_id": {"$in": [log["_id"] for log in batch]}})
+        migrated += len(batch)
+
+class LogService:
+    """
+    Reads build logs and keeps their storage bounded.
+
+    Lines live in build_logs (one document per line) or log_chunks (batches,
+    see LogWriter); both expire through TTL indexes (BUILD_LOG_RETENTION_DAYS,
+    see create_indexes). Before that, the archiver moves lines older than
+    LOG_ARCHIVE_AFTER_DAYS, and every line of a deleted deployment, into
+    gzip-compressed JSON-lines archives on disk or in GridFS. A deployment's
+    log reads as its archive, then its build_logs lines, then its chunks.
+    """
+
+    def __init__(self):
+        self.backend = os.getenv("LOG_ARCHIVE_BACKEND", "disk")  # disk | gridfs
+        self.archive_dir = os.path.expanduser(os.getenv("LOG_ARCHIVE_DIR", "~/.deployment-lab/log-archives"))
+        self.archive_after = timedelta(days=float(os.getenv("LOG_ARCHIVE_AFTER_DAYS", "7")))
+        self.batch_size = int(os.getenv("LOG_ARCHIVE_BATCH", "5000"))
+        self.check_interval = float(os.getenv("LOG_ARCHIVE_INTERVAL", "3600"))
+        self.snippet_chars = int(os.getenv("LOG_SNIPPET_CHARS", "160"))
+
+    def _archive_path(self, deployment_id: str) -> str:
+        return os.path.join(self.archive_dir, f"{deployment_id}.jsonl.gz")
+
+    def _bucket(self):
+        from motor.motor_asyncio import AsyncIOMotorGridFSBucket
+        return AsyncIOMotorGridFSBucket(get_database(), bucket_name="log_archives")
+
+    @staticmethod
+    def _encode(lines: List[Dict[str, Any]]) -> bytes:
+        payload = "\n".join(json.dumps(line, separators=(",", ":")) for line in lines) + "\n"
+        return gzip.compress(payload.encode())
+
+    def _append_to_disk(self, deployment_id: str, data: bytes):
+        # Concatenated gzip members read back as one stream, so each batch is a plain append
+        os.makedirs(self.archive_dir, exist_ok=True)
+        with open(self._archive_path(deployment_id), "ab") as f:
+            f.write(data)
+
+    def _read_from_disk(self, deployment_id: str) -> bytes:
+        with gzip.open(self._archive_path(deployment_id), "rb") as f:
+            return f.read()
+
+    async def _store_segment(self, deployment_id: str, lines: List[Dict[str, Any]]):
+        db = get_database()
+        archive = await db.log_archives.find_one({"deployment_id": deployment_id}, {"segments": 1})
+        segment = archive["segments"] if archive else 0
+        data = self._encode(lines)
+        if self.backend == "gridfs":
+            await self._bucket().upload_from_stream(
+                f"{deployment_id}/{segment}",
+                data,
+                metadata={"deployment_id": deployment_id, "segment": segment}
+            )
+        else:
+            loop = asyncio.get_event_loop()
+            await loop.run_in_executor(None, self._append_to_disk, deployment_id, data)
+        await db.log_archives.update_one(
+            {"deployment_id": deployment_id},
+            {
+                "$set": {"backend": self.backend, "updated_at": datetime.utcnow(), "last_timestamp": lines[-1]["timestamp"]},
+                "$setOnInsert": {"first_timestamp": lines[0]["timestamp"]},
+                "$inc": {"segments": 1, "lines": len(lines)}
+            },
+            upsert=True
+        )
+
+    async def _load_archive(self, archive: Dict[str, Any]) -> List[Dict[str, Any]]:
+        deployment_id = archive["deployment_id"]
+        if archive.get("backend") == "gridfs":
+            bucket = self._bucket()
+            chunks = []
+            cursor = bucket.find({"metadata.deployment_id": deployment_id}, sort=[("metadata.segment", 1)])
+            async for grid_out in cursor:
+                stream = await bucket.open_download_stream(grid_out._id)
+                chunks.append(gzip.decompress(await stream.read()))
+            raw = b"".join(chunks)
+        else:
+            loop = asyncio.get_event_loop()
+            try:
+                raw = await loop.run_in_executor(None, self._read_from_disk, deployment_id)
+            except OSError as e:
+                print(f"Log archive for {deployment_id} is unreadable: {e}")
+                return []
+        return [json.loads(line) for line in raw.decode().splitlines() if line]
+
+    async def iter_logs(self, deployment_id: str, after: Optional[str] = None) -> AsyncIterator[Dict[str, Any]]:
+        """
+        A deployment's log lines in order, as id/message/log_level/timestamp
+        dicts, starting after the line whose id is `after`. Ids of lines still
+        in MongoDB seek straight to their position; an archived id is found by
+        reading the archive. Raises ValueError for an id that isn't in the log.
+        """
+        from bson import ObjectId
+        db = get_database()
+        await log_writer.flush(deployment_id)
+
+        raw_query: Dict[str, Any] = {"deployment_id": deployment_id}
+        chunk_query: Dict[str, Any] = {"deployment_id": deployment_id}
+        # (chunk _id, first line index) when resuming inside a chunk
+        resume_at: Optional[Tuple[Any, int]] = None
+        read_archive, read_raw = True, True
+        if after:
+            chunk_id, _, index = after.partition(".")
+            if not ObjectId.is_valid(chunk_id) or (index and not index.isdigit()):
+                raise ValueError("Invalid cursor")
+            if index:
+                chunk = await db.log_chunks.find_one({"_id": ObjectId(chunk_id)}, {"started_at": 1})
+                if chunk:
+                    read_archive = read_raw = False
+                    chunk_query["$or"] = [
+                        {"started_at": {"$gt": chunk["started_at"]}},
+                        {"started_at": chunk["started_at"], "_id": {"$gte": chunk["_id"]}}
+                    ]
+                    resume_at = (chunk["_id"], int(index) + 1)
+            else:
+                line = await db.build_logs.find_one({"_id": ObjectId(chunk_id)}, {"timestamp": 1})
+                if line:
+                    read_archive = False
+                    raw_query["$or"] = [
+                        {"timestamp": {"$gt": line["timestamp"]}},
+                        {"timestamp": line["timestamp"], "_id": {"$gt": line["_id"]}}
+                    ]
+
+        if read_archive:
+            archive = await db.log_archives.find_one({"deployment_id": deployment_id})
+            lines = await self._load_archive(archive) if archive else []
+            if after:
+                ids = [line["id"] for line in lines]
+                if after not in ids:
+                    raise ValueError("Unknown cursor")
+                lines = lines[ids.index(after) + 1:]
+            for line in lines:
+                yield line
+
+        if read_raw:
+            async for log in db.build_logs.find(raw_query).sort([("timestamp", 1), ("_id", 1)]):
+                yield _raw_line(log)
+
+        async for chunk in db.log_chunks.find(chunk_query).sort([("started_at", 1), ("_id", 1)]):
+            start = resume_at[1] if resume_at and chunk["_id"] == resume_at[0] else 0
+            for index in range(start, len(chunk["messages"])):
+                yield _chunk_line(chunk, index)
+
+    async def get_logs(self, deployment_id: str, after: Optional[str] = None, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Up to `limit` lines after the line `after` (or from the start); see iter_logs"""
+        logs = []
+        async for line in self.iter_logs(deployment_id, after):
+            logs.append(line)
+            if limit and len(logs) >= limit:
+                break
+        return logs
+
+    async def search(
+        self,
+        text: str,
+        levels: Optional[List[str]] = None,
+        deployment_id: Optional[str] = None,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+        limit: int = 50,
+        cursor: Optional[str] = None
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """
+        Newest-first text search over build log lines still in MongoDB (archived
+        lines are not indexed). Returns the hits and the cursor of the next page,
+        if there is one; raises ValueError for a malformed cursor.
+        """
+        db = get_database()
+        position = _decode_position(cursor) if cursor else None
+        patterns, excluded = _highlight_patterns(text)
+        level_names = [_level_name(level) for level in levels] if levels else None
+        hits: List[Dict[str, Any]] = []
+
+        # Chunks hold the newest lines, so they come first
+        if not position or position["s"] == "chunk":
+            conditions: List[Dict[str, Any]] = [{"$text": {"$search": text}}]
+            if deployment_id:
+                conditions.append({"deployment_id": deployment_id})
+            if since:
+                conditions.append({"ended_at": {"$gte": since}})
+            if until:
+                conditions.append({"started_at": {"$lt": until}})
+            if position:
+                conditions.append({"$or": [
+                    {"ended_at": {"$lt": position["t"]}},
+                    {"ended_at": position["t"], "_id": {"$lte": position["id"]}}
+                ]})
+            level_codes = {LEVEL_CODES.get(name, "i") for name in level_names} if level_names else None
+
+            async for chunk in db.log_chunks.find({"$and": conditions}).sort([("ended_at", -1), ("_id", -1)]):
+                last = len(chunk["messages"]) - 1
+                if position and chunk["_id"] == position["id"]:
+                    last = position["i"] - 1
+                for index in range(last, -1, -1):
+                    if level_codes and chunk["levels"][index] not in level_codes:
+                        continue
+                    timestamp = _line_time(chunk, index)
+                    if (since and timestamp < since) or (until and timestamp >= until):
+                        continue
+                    # The chunk matched as a whole; keep the lines that match on their own
+                    message = chunk["messages"][index]
+                    if not any(p.search(message) for p in patterns) or any(p.search(message) for p in excluded):
+                        continue
+                    if len(hits) == limit:
+                        return await self._finish_hits(hits, patterns), _encode_position(hits[-1]["position"])
+                    hits.append({
+                        "id": f"{chunk['_id']}.{index}",
+                        "deployment_id": chunk["deployment_id"],
+                        "log_level": LEVEL_NAMES.get(chunk["levels"][index], "info"),
+                        "timestamp": timestamp,
+                        "message": message,
+                        "position": {"s": "chunk", "t": chunk["ended_at"], "id": str(chunk["_id"]), "i": index}
+                    })
+            position = None
+
+        conditions = [{"$text": {"$search": text}}]
+        if level_names:
+            conditions.append({"log_level": {"$in": level_names}})
+        if deployment_id:
+            conditions.append({"deployment_id": deployment_id})
+        if since or until:
+            timestamp_range: Dict[str, datetime] = {}
+            if since:
+                timestamp_range["$gte"] = since
+            if until:
+                timestamp_range["$lt"] = until
+            conditions.append({"timestamp": timestamp_range})
+        if position:
+            conditions.append({"$or": [
+                {"timestamp": {"$lt": position["t"]}},
+                {"timestamp": position["t"], "_id": {"$lt": position["id"]}}
+            ]})
+
+        wanted = limit - len(hits)
+        logs = await db.build_logs.find({"$and": conditions}).sort(
+            [("timestamp", -1), ("_id", -1)]
+        ).limit(wanted + 1).to_list(length=wanted + 1)
+        for log in logs[:wanted]:
+            hits.append({
+                "id": str(log["_id"]),
+                "deployment_id": log["deployment_id"],
+                "log_level": log["log_level"],
+                "timestamp": log["timestamp"],
+                "message": log["message"],
+                "position": {"s": "raw", "t": log["timestamp"], "id": str(log["_id"])}
+            })
+        next_cursor = _encode_position(hits[-1]["position"]) if len(logs) > wanted and hits else None
+        return await self._finish_hits(hits, patterns), next_cursor
+
+    async def _finish_hits(self, hits: List[Dict[str, Any]], patterns: List["re.Pattern"]) -> List[Dict[str, Any]]:
+        """Add snippets, highlights and each hit's deployment name so triage doesn't need a lookup per row"""
+        from bson import ObjectId
+        db = get_database()
+        deployment_ids = {hit["deployment_id"] for hit in hits if ObjectId.is_valid(hit["deployment_id"])}
+        deployments = {
+            str(doc["_id"]): doc
+            for doc in await db.deployments.find(
+                {"_id": {"$in": [ObjectId(value) for value in deployment_ids]}},
+                {"name": 1, "subdomain": 1}
+            ).to_list(length=None)
+        }
+        for hit in hits:
+            hit.pop("position", None)
+            hit["snippet"], hit["highlights"] = _snippet(hit.pop("message"), patterns, self.snippet_chars)
+            deployment = deployments.get(hit["deployment_id"], {})
+            hit["deployment_name"] = deployment.get("name")
+            hit["subdomain"] = deployment.get("subdomain")
+        return hits
+
+    async def has_logs(self, deployment_id: str) -> bool:
+        """Whether anything is kept for a deployment, e.g. one that has since been deleted"""
+        db = get_database()
+        for collection in (db.log_archives, db.build_logs, db.log_chunks):
+            if await collection.count_documents({"deployment_id": deployment_id}, limit=1):
+                return True
+        return False
+
+    async def archive_deployment(self, deployment_id: str, before: Optional[datetime] = None) -> int:
+        """Move a deployment's lines (only those older than `before`, if given) into its archive"""
+        db = get_database()
+        await log_writer.flush(deployment_id)
+        archived = 0
+
+        raw_query: Dict[str, Any] = {"deployment_id": deployment_id}
+        if before:
+            raw_query["timestamp"] = {"$lt": before}
+        while True:
+            batch = await db.build_logs.find(raw_query).sort(
+                [("timestamp", 1), ("_id", 1)]
+            ).limit(self.batch_size).to_list(length=self.batch_size)
+            if not batch:
+                break
+            await self._store_segment(deployment_id, [_raw_line(log) for log in batch])
+            # Only delete once the segment is stored and recorded, so a crash never loses lines
+            await db.build_logs.delete_many({"_id": {"$in": [log["_id"] for log in batch]}})
+            archived += len(batch)
+
+        # Whole chunks whose last line is past the cutoff
+        chunk_query: Dict[str, Any] = {"deployment_id": deployment_id}
+        if before:
+            chunk_query["ended_at"] = {"$lt": before}
+        chunks_per_segment = max(1, self.batch_size // log_writer.chunk_lines)
+        while True:
+            chunks = await db.log_chunks.find(chunk_query).sort(
+                [("started_at", 1), ("_id", 1)]
+            ).limit(chunks_per_segment).to_list(length=chunks_per_segment)
+            if not chunks:
+                return archived
+            lines = [_chunk_line(chunk, index) for chunk in chunks for index in range(len(chunk["messages"]))]
+            if lines:
+                await self._store_segment(deployment_id, lines)
+            await db.log_chunks.delete_many({"_id": {"$in": [chunk["_id"] for chunk in chunks]}})
+            archived += len(lines)
+
+    async def archive_old_logs(self) -> int:
+        """One archiver pass: deleted deployments in full, live deployments up to the age cutoff"""
+        db = get_database()
+        live_ids = {
+            str(doc["_id"])
+            for doc in await db.deployments.find({}, {"_id": 1}).to_list(length=None)
+        }
+        cutoff = datetime.utcnow() - self.archive_after
+
+        archived = 0
+        stored_ids = set(await db.build_logs.distinct("deployment_id")) | set(await db.log_chunks.distinct("deployment_id"))
+        for deployment_id in stored_ids - live_ids:
+            archived += await self.archive_deployment(deployment_id)
+        aged_ids = (
+            set(await db.build_logs.distinct("deployment_id", {"timestamp": {"$lt": cutoff}}))
+            | set(await db.log_chunks.distinct("deployment_id", {"ended_at": {"$lt": cutoff}}))
+        )
+        for deployment_id in aged_ids & live_ids:
+            archived += await self.archive_deployment(deployment_id, before=cutoff)
+        return archived
+
+    async def run_archiver(self):
+        """Background loop started with the API"""
+        while True:
+            try:
+                # One worker archives per pass; the others skip it
+                async with lease("log-archiver", wait=0):
+                    archived = await self.archive_old_logs()
+                if archived:
+                    print(f"Archived {archived} build log lines")
+            except LeaseUnavailable:
+                pass
+            except Exception as e:
+                print(f"Log archiver failed: {e}")
+            await asyncio.sleep(self.check_interval)
@@ -0,0 +1,159 @@
+"""
+Prometheus metrics kept in process and rendered in the text exposition format.
+
+Recording is a dict lookup plus an in-place increment: series are created on
+first use and histogram buckets are preallocated, so observing a value on the
+request path allocates nothing beyond the label tuple.
+"""
+from bisect import bisect_left
+from typing import Dict, List, Tuple
+
+_registry: List["_Metric"] = []
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names: Tuple[str, ...], values: Tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+class _Metric:
+    metric_type = ""
+
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        _registry.append(self)
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.metric_type}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+class Counter(_Metric):
+    metric_type = "counter"
+
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ()):
+        super().__init__(name, help_text, labelnames)
+        # An unlabelled series is exported as 0 before its first update
+        self._values: Dict[Tuple, float] = {} if self.labelnames else {(): 0}
+
+    def inc(self, *labels, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def _samples(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+            for labels, value in self._values.items()
+        ]
+
+class Gauge(_Metric):
+    metric_type = "gauge"
+
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ()):
+        super().__init__(name, help_text, labelnames)
+        # An unlabelled series is exported as 0 before its first update
+        self._values: Dict[Tuple, float] = {} if self.labelnames else {(): 0}
+
+    def set(self, value: float, *labels):
+        self._values[labels] = value
+
+    def inc(self, *labels, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) - amount
+
+    def _samples(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+            for labels, value in self._values.items()
+        ]
+
+class Histogram(_Metric):
+    metric_type = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = (), buckets: Tuple[float, ...] = ()):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per series: [count per bucket (last slot is +Inf), sum, count]
+        self._series: Dict[Tuple, list] = {}
+
+    def observe(self, value: float, *labels):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def _samples(self) -> List[str]:
+        samples = []
+        for labels, (counts, total, count) in self._series.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                bucket_labels = _format_labels(self.labelnames, labels, 'le="%s"' % bound)
+                samples.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            bucket_labels = _format_labels(self.labelnames, labels, 'le="+Inf"')
+            samples.append(f"{self.name}_bucket{bucket_labels} {count}")
+            samples.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(total)}")
+            samples.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {count}")
+        return samples
+
+def render_metrics() -> str:
+    return "\n".join(metric.render() for metric in _registry) + "\n"
+
+REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "API request latency by route template",
+    ("method", "route"),
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+)
+REQUESTS = Counter(
+    "http_requests_total",
+    "API requests by route template and status code",
+    ("method", "route", "status")
+)
+STAGE_DURATION = Histogram(
+    "deploy_stage_duration_seconds",
+    "Duration of each deploy pipeline stage",
+    ("stage",),
+    buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1200)
+)
+DEPLOY_OUTCOMES = Counter(
+    "deploy_outcomes_total",
+    "Finished deploys by outcome",
+    ("outcome",)
+)
+CLOUDFLARE_ERRORS = Counter(
+    "cloudflare_errors_total",
+    "Failed Cloudflare API calls and tunnel config edits",
+    ("operation",)
+)
+DOCKER_ERRORS = Counter(
+    "docker_errors_total",
+    "Failed Docker engine operations",
+    ("operation",)
+)
+RUNNING_DEPLOYMENTS = Gauge(
+    "deployments_running",
+    "Deployments in the running state"
+)
+ALLOCATED_PORTS = Gauge(
+    "ports_allocated",
+    "Host ports currently allocated to deployments"
+)
+BUILDS_IN_FLIGHT = Gauge(
+    "builds_in_flight",
+    "Deploy pipelines currently running in this process"
+)
@@ -1,148 +1,426 @@
 import os
 import subprocess
 from jinja2 import Template
-from typing import Optional
-from models import BuildLogModel, LogLevel, get_database
+from typing import Dict, Optional, Tuple
+from models import LogLevel, get_database
+from .timeline_service import span
+from .log_service import write_log
+from .lease_service import lease
 
 class NginxService:
     def __init__(self):
         self.config_path = os.getenv("NGINX_CONFIG_PATH", "/etc/nginx/sites-available")
         self.enabled_path = os.getenv("NGINX_ENABLED_PATH", "/etc/nginx/sites-enabled")
         self.base_domain = os.getenv("BASE_DOMAIN", "ao2395.com")
-        self.mapping_file = "/etc/nginx/subdomain-map.conf"
-        self.wildcard_config = "/etc/nginx/sites-available/wildcard-ao2395.com"
+        self.mapping_file = os.getenv("NGINX_MAPPING_FILE", "/etc/nginx/subdomain-map.conf")
+        self.upstreams_file = os.getenv("NGINX_UPSTREAMS_FILE", "/etc/nginx/deployment-upstreams.conf")
+        # One file per running deployment: its upstream pool, plus a server block when its timeouts differ
+        self.upstreams_dir = os.getenv("NGINX_UPSTREAMS_DIR", "/etc/nginx/deployment-upstreams.d")
+        # Locations shared by the wildcard server and the per-deployment server blocks
+        self.proxy_snippet = os.getenv("NGINX_PROXY_SNIPPET", "/etc/nginx/deployment-proxy.conf")
+        # Defaults for each deployment's proxy settings (ProxySettings in models/schemas.py)
+        self.proxy_defaults = {
+            "keepalive": int(os.getenv("UPSTREAM_KEEPALIVE", "16")),
+            "keepalive_timeout": os.getenv("UPSTREAM_KEEPALIVE_TIMEOUT", "60s"),
+            "keepalive_requests": int(os.getenv("UPSTREAM_KEEPALIVE_REQUESTS", "1000")),
+            "max_conns": int(os.getenv("UPSTREAM_MAX_CONNS", "0")),
+            "max_fails": int(os.getenv("UPSTREAM_MAX_FAILS", "3")),
+            "fail_timeout": os.getenv("UPSTREAM_FAIL_TIMEOUT", "10s"),
+            "connect_timeout": os.getenv("PROXY_CONNECT_TIMEOUT", "60s"),
+            "read_timeout": os.getenv("PROXY_READ_TIMEOUT", "86400s"),
+            "send_timeout": os.getenv("PROXY_SEND_TIMEOUT", "60s")
+        }
+        self.wildcard_config = os.getenv("NGINX_WILDCARD_CONFIG", "/etc/nginx/sites-available/wildcard-ao2395.com")
+        self.activity_log = os.getenv("NGINX_ACTIVITY_LOG", "/var/log/nginx/deployment-activity.log")
+        # Hibernated subdomains are proxied here so the first request wakes them
+        self.wake_backend = os.getenv("WAKE_BACKEND", "http://127.0.0.1:8000/wake")
+        # Proxy cache shared by every deployment: static assets, and micro-cached GETs of deployments that opt in
+        self.cache_path = os.getenv("NGINX_CACHE_PATH", "/var/cache/nginx/deployment-lab")
+        self.cache_max_size = os.getenv("NGINX_CACHE_MAX_SIZE", "1g")
+        self.cache_keys_zone = os.getenv("NGINX_CACHE_KEYS_ZONE", "32m")
+        self.cache_inactive = os.getenv("NGINX_CACHE_INACTIVE", "7d")
+        self.static_cache_valid = os.getenv("NGINX_STATIC_CACHE_VALID", "7d")
+        self.microcache_seconds = int(os.getenv("NGINX_MICROCACHE_SECONDS", "0"))
+        self.gzip_enabled = os.getenv("NGINX_GZIP", "true").lower() == "true"
         
     async def log_operation(self, deployment_id: str, message: str, level: LogLevel = LogLevel.INFO):
+        await write_log(deployment_id, message, level)
+    
+    def upstream_name(self, deployment: dict) -> str:
+        return f"deployment_{deployment['_id']}"
+    
+    def proxy_settings(self, deployment: dict) -> dict:
+        """The deployment's proxy settings with unset values taken from the environment defaults"""
+        overrides = {key: value for key, value in (deployment.get("proxy") or {}).items() if value is not None}
+        return {**self.proxy_defaults, **overrides}
+    
+    def upstream_file(self, upstream: str) -> str:
+        return os.path.join(self.upstreams_dir, f"{upstream}.conf")
+    
+    def build_upstream_content(self, deployment: dict, address: str) -> str:
+        """The deployment's upstream pool, and its own server block when its timeouts differ from the wildcard server's"""
+        settings = self.proxy_settings(deployment)
+        upstream = self.upstream_name(deployment)
+        ports = [deployment["port"]] + [instance["port"] for instance in deployment.get("replica_instances", [])]
+        
+        # The primary container plus any replicas, balanced by least connections with passive health checks
+        content = "# Auto-generated by deployment system\n"
+        content += "# Do not edit manually\n\n"
+        content += f"upstream {upstream} {{\n"
+        content += "    least_conn;\n"
+        for port in ports:
+            content += f"    server {address}:{port} max_fails={settings['max_fails']} fail_timeout={settings['fail_timeout']}"
+            if settings["max_conns"]:
+                content += f" max_conns={settings['max_conns']}"
+            content += ";\n"
+        # Idle connections kept open to the pool, so requests skip the TCP handshake
+        if settings["keepalive"]:
+            content += f"    keepalive {settings['keepalive']};\n"
+            content += f"    keepalive_timeout {settings['keepalive_timeout']};\n"
+            content += f"    keepalive_requests {settings['keepalive_requests']};\n"
+        content += "}\n"
+        
+        # proxy_*_timeout can't come from a map, so other timeouts need a server block of their own
+        timeouts = ("connect_timeout", "read_timeout", "send_timeout")
+        if any(settings[key] != self.proxy_defaults[key] for key in timeouts):
+            content += "\nserver {\n"
+            content += "    listen 80;\n"
+            content += f"    server_name {deployment['subdomain']}.{self.base_domain};\n"
+            for key in timeouts:
+                content += f"    proxy_{key} {settings[key]};\n"
+            content += f"    include {self.proxy_snippet};\n"
+            content += "}\n"
+        return content
+    
+    async def build_route_files(self) -> Tuple[Dict[str, str], int]:
+        """
+        Build every routing file from the database; returns
+        ({path: content}, number of deployments mapped). The mapping file maps
+        hosts to upstream names, the upstreams file holds the micro-cache
+        opt-in map and includes one file per running deployment.
+        """
         db = get_database()
-        log_entry = BuildLogModel(
-            deployment_id=deployment_id,
-            message=message,
-            log_level=level
-        )
-        await db.build_logs.insert_one(log_entry.dict(by_alias=True))
+        deployments = await db.deployments.find(
+            {"status": {"$in": ["running", "hibernated"]}}
+        ).to_list(length=None)
+        
+        # Deployments placed on a registered node are proxied to that node's address
+        nodes = await db.nodes.find({}, {"name": 1, "address": 1}).to_list(length=None)
+        node_addresses = {node["name"]: node["address"] for node in nodes}
+        
+        header = "# Auto-generated by deployment system\n"
+        header += "# Do not edit manually\n\n"
+        mapping_content = header
+        upstreams_content = header
+        upstreams_content += f"include {self.upstreams_dir}/*.conf;\n\n"
+        files: Dict[str, str] = {}
+        
+        for deployment in deployments:
+            host = f"{deployment['subdomain']}.{self.base_domain}"
+            if deployment["status"] == "hibernated":
+                mapping_content += f"{host} wake;\n"
+                continue
+            
+            address = node_addresses.get(deployment.get("node"), "127.0.0.1")
+            upstream = self.upstream_name(deployment)
+            files[self.upstream_file(upstream)] = self.build_upstream_content(deployment, address)
+            mapping_content += f"{host} {upstream};\n"
+        
+        # Micro-caching is per deployment: 0 for the hosts that opted in
+        upstreams_content += "map $host $micro_cache_skip {\n    default 1;\n"
+        for deployment in deployments:
+            if deployment["status"] == "running" and deployment.get("micro_cache"):
+                upstreams_content += f"    {deployment['subdomain']}.{self.base_domain} 0;\n"
+        upstreams_content += "}\n"
+        
+        files[self.upstreams_file] = upstreams_content
+        files[self.mapping_file] = mapping_content
+        return files, len(deployments)
+    
+    def run_command(self, args: list) -> subprocess.CompletedProcess:
+        """Every nginx-related shell command goes through here (the benchmark harness swaps it out)"""
+        return subprocess.run(args, capture_output=True, text=True)
+    
+    def install_file(self, content: str, path: str) -> subprocess.CompletedProcess:
+        """Write content to a root-owned nginx path via a temp file and sudo mv"""
+        import tempfile
+        with tempfile.NamedTemporaryFile(mode='w', delete=False, suffix='.conf') as temp_file:
+            temp_file.write(content)
+            temp_file_path = temp_file.name
+        
+        return self.run_command(['sudo', 'mv', temp_file_path, path])
+    
+    def read_installed_files(self) -> Dict[str, str]:
+        """The mapping, upstreams and per-deployment files as they are on disk ("" for a missing shared file)"""
+        paths = [self.mapping_file, self.upstreams_file]
+        if os.path.isdir(self.upstreams_dir):
+            paths += [
+                os.path.join(self.upstreams_dir, name)
+                for name in sorted(os.listdir(self.upstreams_dir))
+                if name.endswith(".conf")
+            ]
+        contents = {}
+        for path in paths:
+            try:
+                with open(path) as f:
+                    contents[path] = f.read()
+            except FileNotFoundError:
+                contents[path] = ""
+        return contents
+    
+    async def write_route_files(self, held) -> Tuple[int, int]:
+        """
+        Bring the routing files in line with the database, under the held
+        nginx lease. Only files whose content changed are written, and files
+        of deployments no longer running are removed; returns (files changed,
+        deployments mapped). Raises RuntimeError when a file can't be installed.
+        """
+        if not self.wildcard_config_current():
+            # Routes generated by this version need the wildcard config of this version
+            await self.install_wildcard_files(held)
+        
+        expected, deployment_count = await self.build_route_files()
+        installed = self.read_installed_files()
+        
+        if not os.path.isdir(self.upstreams_dir):
+            result = self.run_command(['sudo', 'mkdir', '-p', self.upstreams_dir])
+            if result.returncode != 0:
+                raise RuntimeError(f"Failed to create {self.upstreams_dir}: {result.stderr}")
+        
+        # Upstream pools first, then the file including them, then the map naming them,
+        # so nginx never sees a host mapped to an upstream that doesn't exist yet
+        shared = (self.upstreams_file, self.mapping_file)
+        order = [path for path in expected if path not in shared] + list(shared)
+        changed = 0
+        for path in order:
+            if installed.get(path) == expected[path]:
+                continue
+            await held.check()
+            result = self.install_file(expected[path], path)
+            if result.returncode != 0:
+                raise RuntimeError(f"Failed to update {path}: {result.stderr}")
+            changed += 1
+        
+        # Pools of deleted or hibernated deployments go once nothing maps to them
+        stale = [path for path in installed if path not in expected and path not in shared]
+        if stale:
+            await held.check()
+            result = self.run_command(['sudo', 'rm', '-f'] + stale)
+            if result.returncode != 0:
+                raise RuntimeError(f"Failed to remove {', '.join(stale)}: {result.stderr}")
+            changed += len(stale)
+        return changed, deployment_count
+    
+    async def sync_routes(self) -> bool:
+        """Rewrite the routing files from the database and reload, outside any one deployment's log"""
+        try:
+            async with lease("nginx") as held:
+                changed, _ = await self.write_route_files(held)
+                if not changed:
+                    return True
+                
+                for args in (['sudo', 'nginx', '-t'], ['sudo', 'systemctl', 'reload', 'nginx']):
+                    result = self.run_command(args)
+                    if result.returncode != 0:
+                        print(f"{' '.join(args[1:])} failed: {result.stderr}")
+                        return False
+            return True
+        
+        except Exception as e:
+            print(f"Failed to sync nginx routes: {e}")
+            return False
     
     async def generate_mapping_file(self, deployment_id: str) -> bool:
-        """Generate the subdomain mapping file from database"""
+        """Generate the subdomain mapping and upstream files from database"""
         try:
             await self.log_operation(deployment_id, "Generating subdomain mapping file")
             
-            db = get_database()
-            deployments = await db.deployments.find({"status": "running"}).to_list(length=None)
-            
-            # Create mapping content
-            mapping_content = "# Auto-generated by deployment system\n"
-            mapping_content += "# Do not edit manually\n\n"
-            
-            for deployment in deployments:
-                mapping_content += f"{deployment['subdomain']}.{self.base_domain} http://127.0.0.1:{deployment['port']};\n"
-            
-            # Write to temporary file first
-            import tempfile
-            with tempfile.NamedTemporaryFile(mode='w', delete=False, suffix='.conf') as temp_file:
-                temp_file.write(mapping_content)
-                temp_file_path = temp_file.name
-            
-            # Use sudo to move the file
-            result = subprocess.run([
-                'sudo', 'mv', temp_file_path, self.mapping_file
-            ], capture_output=True, text=True)
+            # Built and written under the lease, so the last writer always wrote the latest state
+            async with lease("nginx") as held:
+                changed, deployment_count = await self.write_route_files(held)
             
-            if result.returncode != 0:
-                await self.log_operation(deployment_id, f"Failed to update mapping file: {result.stderr}", LogLevel.ERROR)
-                return False
-            
-            await self.log_operation(deployment_id, f"Mapping file updated with {len(deployments)} deployments")
+            await self.log_operation(deployment_id, f"Mapping file updated with {deployment_count} deployments ({changed} files changed)")
             return True
             
         except Exception as e:
             await self.log_operation(deployment_id, f"Failed to generate mapping file: {str(e)}", LogLevel.ERROR)
             return False
     
+    def generate_proxy_snippet(self) -> str:
+        """Server-level directives and locations shared by every deployment's server block"""
+        proxy_settings = """proxy_pass $backend;
+    proxy_http_version 1.1;
+    proxy_set_header Upgrade $http_upgrade;
+    proxy_set_header Connection $connection_upgrade;
+    proxy_set_header Host $host;
+    proxy_set_header X-Real-IP $remote_addr;
+    proxy_set_header X-Forwarded-For $proxy_add_x_forwarded_for;
+    proxy_set_header X-Forwarded-Proto $scheme;
+    proxy_set_header X-Original-URI $request_uri;
+    # Passive health checks: retry another replica when one fails
+    proxy_next_upstream error timeout http_502 http_503;
+    proxy_next_upstream_tries 2;"""
+        
+        # Responses are only stored with buffering on; apps that stream can send X-Accel-Buffering: no
+        cache_settings = """proxy_buffering on;
+    proxy_cache deployments;
+    proxy_cache_lock on;
+    proxy_cache_use_stale error timeout updating http_502 http_503;
+    add_header X-Cache-Status $upstream_cache_status;"""
+        
+        if self.microcache_seconds > 0:
+            # Deployments opt in with micro_cache; requests with credentials always reach the app
+            root_cache = f"""{cache_settings}
+    proxy_cache_valid 200 301 302 {self.microcache_seconds}s;
+    proxy_cache_bypass $micro_cache_skip $http_upgrade $http_authorization $http_cookie;
+    proxy_no_cache $micro_cache_skip $http_upgrade $http_authorization $http_cookie;"""
+        else:
+            root_cache = """proxy_buffering off;
+    proxy_cache_bypass $http_upgrade;"""
+        
+        gzip = """
+gzip on;
+gzip_vary on;
+gzip_proxied any;
+gzip_comp_level 5;
+gzip_min_length 1024;
+gzip_types text/plain text/css text/xml application/json application/javascript application/xml application/rss+xml image/svg+xml font/ttf font/otf;
+""" if self.gzip_enabled else ""
+        
+        return f"""# Auto-generated by deployment system; included by the wildcard server
+# and by per-deployment server blocks in {self.upstreams_dir}
+access_log /var/log/nginx/access.log;
+access_log {self.activity_log} deployment_activity buffer=32k flush=5s;
+
+# The host keeps deployments' caches apart
+proxy_cache_key $scheme$host$request_uri;
+{gzip}
+# Next.js static files are content-hashed, so they are cached whatever the app says:
+# its cache headers and cookies are ignored, and cookies are never replayed from the cache
+location ^~ /_next/static/ {{
+    {proxy_settings}
+    {cache_settings}
+    proxy_ignore_headers Cache-Control Expires Set-Cookie;
+    proxy_hide_header Set-Cookie;
+    proxy_cache_valid 200 {self.static_cache_valid};
+    proxy_cache_bypass $http_upgrade;
+    proxy_no_cache $static_no_cache;
+    
+    # Cache static files
+    expires $static_expires;
+    add_header Cache-Control $static_cache_control;
+}}
+
+# Other static assets follow the app's headers: cached only when it marks them cacheable,
+# never with Set-Cookie or no-cache/private
+location ~* \\.(?:css|js|mjs|map|woff2?|ttf|otf|eot|png|jpe?g|gif|svg|ico|webp|avif)$ {{
+    {proxy_settings}
+    {cache_settings}
+    proxy_cache_bypass $http_upgrade $http_authorization;
+    proxy_no_cache $static_no_cache $http_authorization;
+}}
+
+# Handle all other requests
+location / {{
+    {proxy_settings}
+    {root_cache}
+}}
+"""
+    
     def generate_wildcard_nginx_config(self) -> str:
         """Generate the wildcard nginx configuration"""
+        defaults = self.proxy_defaults
         config = f"""# Wildcard configuration for {self.base_domain}
-# Load the mapping
-map $host $backend {{
+
+# Shared cache for static assets and micro-cached responses
+proxy_cache_path {self.cache_path} levels=1:2 keys_zone=deployments:{self.cache_keys_zone} max_size={self.cache_max_size} inactive={self.cache_inactive} use_temp_path=off;
+
+# Only send "Connection: upgrade" for websocket requests so other
+# upstream connections stay reusable by the keepalive pools
+map $http_upgrade $connection_upgrade {{
+    default upgrade;
+    '' '';
+}}
+
+# Load the mapping: host -> upstream name, or "wake" for hibernated deployments
+map $host $deployment_upstream {{
     include {self.mapping_file};
-    default http://127.0.0.1:404;
+    default "";
+}}
+
+map $deployment_upstream $backend {{
+    "" http://127.0.0.1:404;
+    wake {self.wake_backend};
+    default http://$deployment_upstream;
+}}
+
+# Wake redirects for hibernated deployments must never be cached
+map $backend $static_expires {{
+    {self.wake_backend} off;
+    default 1y;
 }}
 
+map $backend $static_cache_control {{
+    {self.wake_backend} "";
+    default "public, immutable";
+}}
+
+map $backend $static_no_cache {{
+    {self.wake_backend} 1;
+    default 0;
+}}
+
+# One line per request, used for idle detection of scale-to-zero deployments
+log_format deployment_activity '$msec $host';
+
 server {{
     listen 80;
     server_name *.{self.base_domain};
     
-    # Handle Next.js static files
-    location /_next/static/ {{
-        proxy_pass $backend;
-        proxy_http_version 1.1;
-        proxy_set_header Upgrade $http_upgrade;
-        proxy_set_header Connection 'upgrade';
-        proxy_set_header Host $host;
-        proxy_set_header X-Real-IP $remote_addr;
-        proxy_set_header X-Forwarded-For $proxy_add_x_forwarded_for;
-        proxy_set_header X-Forwarded-Proto $scheme;
-        proxy_cache_bypass $http_upgrade;
-        proxy_read_timeout 86400;
-        proxy_buffering off;
-        proxy_connect_timeout 60;
-        proxy_send_timeout 60;
-        
-        # Cache static files
-        expires 1y;
-        add_header Cache-Control "public, immutable";
-    }}
+    # Deployments with other timeouts have their own server block
+    proxy_connect_timeout {defaults['connect_timeout']};
+    proxy_read_timeout {defaults['read_timeout']};
+    proxy_send_timeout {defaults['send_timeout']};
     
-    # Handle all other requests
-    location / {{
-        proxy_pass $backend;
-        proxy_http_version 1.1;
-        proxy_set_header Upgrade $http_upgrade;
-        proxy_set_header Connection 'upgrade';
-        proxy_set_header Host $host;
-        proxy_set_header X-Real-IP $remote_addr;
-        proxy_set_header X-Forwarded-For $proxy_add_x_forwarded_for;
-        proxy_set_header X-Forwarded-Proto $scheme;
-        proxy_cache_bypass $http_upgrade;
-        proxy_read_timeout 86400;
-        proxy_buffering off;
-        proxy_connect_timeout 60;
-        proxy_send_timeout 60;
-    }}
-}}"""
+    include {self.proxy_snippet};
+}}
+
+# Per-deployment upstream pools and server blocks, and the micro-cache opt-in map;
+# last, as their server blocks use the log format and maps above
+include {self.upstreams_file};"""
         return config
     
+    def wildcard_config_current(self) -> bool:
+        try:
+            with open(self.wildcard_config) as f:
+                if f.read() != self.generate_wildcard_nginx_config():
+                    return False
+            with open(self.proxy_snippet) as f:
+                return f.read() == self.generate_proxy_snippet()
+        except OSError:
+            return False
+    
+    async def install_wildcard_files(self, held):
+        """Install the shared locations and the wildcard site under the held nginx lease; raises RuntimeError on failure"""
+        for content, path in ((self.generate_proxy_snippet(), self.proxy_snippet), (self.generate_wildcard_nginx_config(), self.wildcard_config)):
+            await held.check()
+            result = self.install_file(content, path)
+            if result.returncode != 0:
+                raise RuntimeError(f"Failed to create {path}: {result.stderr}")
+        
+        # Enable the wildcard site
+        enabled_path = os.path.join(self.enabled_path, "wildcard-ao2395.com")
+        result = self.run_command(['sudo', 'ln', '-sf', self.wildcard_config, enabled_path])
+        if result.returncode != 0:
+            raise RuntimeError(f"Failed to enable wildcard site: {result.stderr}")
+    
     async def setup_wildcard_config(self, deployment_id: str) -> bool:
         """Setup the wildcard nginx configuration"""
         try:
             await self.log_operation(deployment_id, "Setting up wildcard nginx configuration")
             
-            # Create wildcard config
-            config_content = self.generate_wildcard_nginx_config()
-            
-            # Write to temporary file first
-            import tempfile
-            with tempfile.NamedTemporaryFile(mode='w', delete=False, suffix='.conf') as temp_file:
-                temp_file.write(config_content)
-                temp_file_path = temp_file.name
-            
-            # Use sudo to move the file
-            result = subprocess.run([
-                'sudo', 'mv', temp_file_path, self.wildcard_config
-            ], capture_output=True, text=True)
-            
-            if result.returncode != 0:
-                await self.log_operation(deployment_id, f"Failed to create wildcard config: {result.stderr}", LogLevel.ERROR)
-                return False
-            
-            # Enable the wildcard site
-            enabled_path = os.path.join(self.enabled_path, "wildcard-ao2395.com")
-            result = subprocess.run([
-                'sudo', 'ln', '-sf', self.wildcard_config, enabled_path
-            ], capture_output=True, text=True)
-            
-            if result.returncode != 0:
-                await self.log_operation(deployment_id, f"Failed to enable wildcard site: {result.stderr}", LogLevel.ERROR)
-                return False
+            async with lease("nginx") as held:
+                await self.install_wildcard_files(held)
             
             await self.log_operation(deployment_id, "Wildcard nginx configuration setup complete")
             return True
@@ -176,15 +454,17 @@ server {{
         try:
             await self.log_operation(deployment_id, "Reloading nginx configuration")
             
-            result = subprocess.run(['sudo', 'nginx', '-t'], capture_output=True, text=True)
-            if result.returncode != 0:
-                await self.log_operation(deployment_id, f"Nginx config test failed: {result.stderr}", LogLevel.ERROR)
-                return False
-            
-            result = subprocess.run(['sudo', 'systemctl', 'reload', 'nginx'], capture_output=True, text=True)
-            if result.returncode != 0:
-                await self.log_operation(deployment_id, f"Nginx reload failed: {result.stderr}", LogLevel.ERROR)
-                return False
+            # Not while another worker is halfway through rewriting the files being tested
+            async with lease("nginx"):
+                result = self.run_command(['sudo', 'nginx', '-t'])
+                if result.returncode != 0:
+                    await self.log_operation(deployment_id, f"Nginx config test failed: {result.stderr}", LogLevel.ERROR)
+                    return False
+                
+                result = self.run_command(['sudo', 'systemctl', 'reload', 'nginx'])
+                if result.returncode != 0:
+                    await self.log_operation(deployment_id, f"Nginx reload failed: {result.stderr}", LogLevel.ERROR)
+                    return False
             
             await self.log_operation(deployment_id, "Nginx reloaded successfully")
             return True
@@ -206,18 +486,8 @@ server {{
                     return False
             else:
                 # For non-deployment operations, just regenerate the mapping
-                db = get_database()
-                deployments = await db.deployments.find({"status": "running"}).to_list(length=None)
-                
-                mapping_content = "# Auto-generated by deployment system\n"
-                mapping_content += "# Do not edit manually\n\n"
-                
-                for deployment in deployments:
-                    mapping_content += f"{deployment['subdomain']}.{self.base_domain} http://127.0.0.1:{deployment['port']};\n"
-                
-                # Write mapping file
-                with open(self.mapping_file, 'w') as f:
-                    f.write(mapping_content)
+                async with lease("nginx") as held:
+                    await self.write_route_files(held)
             
             if deployment_id:
                 await self.log_operation(deployment_id, f"Removed {subdomain} from mapping")
@@ -232,19 +502,25 @@ server {{
     
     async def setup_deployment_nginx(self, subdomain: str, port: int, deployment_id: str) -> bool:
         try:
-            # Ensure wildcard config exists
-            if not os.path.exists(self.wildcard_config):
-                success = await self.setup_wildcard_config(deployment_id)
+            # Ensure wildcard config exists and matches what this version generates
+            if not self.wildcard_config_current():
+                async with span("nginx.wildcard") as stage:
+                    success = await self.setup_wildcard_config(deployment_id)
+                    stage["status"] = "ok" if success else "failed"
                 if not success:
                     return False
             
             # Add to mapping file
-            success = await self.create_config(subdomain, port, deployment_id)
+            async with span("nginx.write") as stage:
+                success = await self.create_config(subdomain, port, deployment_id)
+                stage["status"] = "ok" if success else "failed"
             if not success:
                 return False
             
             # Reload nginx
-            success = await self.reload_nginx(deployment_id)
+            async with span("nginx.reload") as stage:
+                success = await self.reload_nginx(deployment_id)
+                stage["status"] = "ok" if success else "failed"
             if not success:
                 return False
             
@@ -0,0 +1,243 @@
+import asyncio
+from datetime import datetime
+from typing import Optional, Dict, Any, List
+from models import (
+    get_database,
+    mark_deployments_changed,
+    NodeModel,
+    NodeStatus,
+    DeploymentStatus,
+    ResourceProfile,
+    PlacementConstraints,
+    LogLevel
+)
+from .docker_service import DockerService, get_engine_client, forget_engine_client
+from .nginx_service import NginxService
+from .scheduler_service import PlacementScheduler
+from .readiness_service import ReadinessService
+from .event_service import event_bus
+from .log_service import write_log
+from .lease_service import lease, LeaseUnavailable
+
+class NodeService:
+    def __init__(self):
+        self.scheduler = PlacementScheduler()
+        self.nginx_service = NginxService()
+
+    async def log_operation(self, deployment_id: str, message: str, level: LogLevel = LogLevel.INFO):
+        await write_log(deployment_id, message, level)
+
+    async def list_nodes(self) -> List[Dict[str, Any]]:
+        db = get_database()
+        return await db.nodes.find().to_list(length=None)
+
+    async def get_node(self, name: str) -> Optional[Dict[str, Any]]:
+        db = get_database()
+        return await db.nodes.find_one({"name": name})
+
+    async def register_node(self, node: NodeModel) -> bool:
+        try:
+            # Fail early if the engine is unreachable
+            client = get_engine_client(node.docker_url)
+            loop = asyncio.get_event_loop()
+            await loop.run_in_executor(None, client.ping)
+
+            db = get_database()
+            await db.nodes.insert_one(node.dict(by_alias=True))
+            return True
+        except Exception as e:
+            print(f"Failed to register node {node.name}: {e}")
+            return False
+
+    async def remove_node(self, name: str) -> bool:
+        db = get_database()
+        if await db.deployments.count_documents({"node": name}, limit=1):
+            return False
+
+        node = await self.get_node(name)
+        if node:
+            forget_engine_client(node["docker_url"])
+        result = await db.nodes.delete_one({"name": name})
+        return result.deleted_count > 0
+
+    async def set_status(self, name: str, status: NodeStatus) -> bool:
+        db = get_database()
+        result = await db.nodes.update_one({"name": name}, {"$set": {"status": status}})
+        return result.matched_count > 0
+
+    async def get_docker_service(self, node_name: Optional[str]) -> DockerService:
+        """DockerService bound to the deployment's node, or the local engine for unplaced deployments"""
+        if node_name:
+            node = await self.get_node(node_name)
+            if node:
+                return DockerService(get_engine_client(node["docker_url"]))
+        return DockerService()
+
+    async def migrate_deployment(self, deployment_doc: Dict[str, Any], target_node: Dict[str, Any]) -> bool:
+        """
+        Rebuild a running deployment on another node, switch the proxy over to
+        it and only then remove the old container, so the route stays up.
+        """
+        from bson import ObjectId
+        deployment_id = str(deployment_doc["_id"])
+        source_node = deployment_doc.get("node")
+
+        class SimpleDeployment:
+            def __init__(self, doc):
+                self.id = deployment_id
+                self.name = doc["name"]
+                self.github_url = doc["github_url"]
+                self.subdomain = doc["subdomain"]
+                self.port = doc["port"]
+                self.status = doc["status"]
+                self.env_vars = doc.get("env_vars", {})
+                self.resources = ResourceProfile(**(doc.get("resources") or {}))
+
+        deployment = SimpleDeployment(deployment_doc)
+        source_service = await self.get_docker_service(source_node)
+        target_service = DockerService(get_engine_client(target_node["docker_url"]))
+
+        try:
+            await self.log_operation(deployment_id, f"Migrating deployment from node {source_node} to {target_node['name']}")
+
+            repo_path = await target_service.clone_repository(deployment.github_url, deployment_id)
+            if not repo_path:
+                return False
+
+            image_tag = await target_service.build_image(repo_path, deployment)
+            if not image_tag:
+                await target_service.cleanup_build_files(repo_path)
+                return False
+
+            container_id = await target_service.run_container(image_tag, deployment)
+            await target_service.cleanup_build_files(repo_path)
+            if not container_id:
+                await target_service.remove_image(image_tag)
+                return False
+
+            readiness_service = ReadinessService(target_service.client)
+            time_to_ready = await readiness_service.wait_until_ready(
+                deployment_id,
+                container_id,
+                target_node["address"],
+                deployment.port,
+                deployment_doc.get("readiness_path")
+            )
+            if time_to_ready is None:
+                await target_service.stop_container(container_id)
+                await target_service.remove_container(container_id)
+                await target_service.remove_image(image_tag)
+                return False
+
+            db = get_database()
+            await db.deployments.update_one(
+                {"_id": ObjectId(deployment_id)},
+                {
+                    "$set": {
+                        "node": target_node["name"],
+                        "container_id": container_id,
+                        "docker_image": image_tag,
+                        "time_to_ready": round(time_to_ready, 3),
+                        "replica_instances": [],
+                        "updated_at": datetime.utcnow()
+                    }
+                }
+            )
+            await mark_deployments_changed(deployment_id)
+            event_bus.publish("updated", deployment_id, node=target_node["name"])
+
+            # Point the proxy at the new node before tearing down the old container
+            if await self.nginx_service.generate_mapping_file(deployment_id):
+                await self.nginx_service.reload_nginx(deployment_id)
+
+            if deployment_doc.get("container_id"):
+                await source_service.stop_container(deployment_doc["container_id"])
+                await source_service.remove_container(deployment_doc["container_id"])
+            # Extra replicas are rebuilt on the new node from the freshly built image
+            from .replica_service import ReplicaService
+            replica_service = ReplicaService()
+            if deployment_doc.get("replica_instances"):
+                await replica_service.remove_replicas(deployment_doc, deployment_doc["replica_instances"])
+            if deployment_doc.get("docker_image"):
+                await source_service.remove_image(deployment_doc["docker_image"])
+            if deployment_doc.get("replicas", 1) > 1:
+                await replica_service.scale(deployment_id, deployment_doc["replicas"])
+
+            await self.log_operation(deployment_id, f"Migration to node {target_node['name']} completed")
+            return True
+
+        except Exception as e:
+            await self.log_operation(deployment_id, f"Migration failed: {str(e)}", LogLevel.ERROR)
+            return False
+
+    async def drain_node(self, name: str) -> Dict[str, Any]:
+        """
+        Move every running and hibernated deployment off a node. Hibernated ones
+        are rebuilt on the new node and stopped again, so they wake there. The
+        node ends up drained once no deployment references it any more.
+        """
+        from bson import ObjectId
+        db = get_database()
+        await self.set_status(name, NodeStatus.DRAINING)
+
+        deployments = await db.deployments.find(
+            {"node": name, "status": {"$in": [DeploymentStatus.RUNNING, DeploymentStatus.HIBERNATED]}},
+            {"_id": 1}
+        ).to_list(length=None)
+
+        migrated = []
+        failed = []
+        for doc in deployments:
+            deployment_id = str(doc["_id"])
+            try:
+                # Under the power lease a hibernated deployment can't wake (or a running one
+                # hibernate) halfway through its move
+                async with lease(f"power:{deployment_id}"):
+                    deployment_doc = await db.deployments.find_one({"_id": ObjectId(deployment_id), "node": name})
+                    if not deployment_doc or deployment_doc["status"] not in (DeploymentStatus.RUNNING, DeploymentStatus.HIBERNATED):
+                        continue
+
+                    target = await self.scheduler.place(
+                        self.scheduler.capacity_service.footprint(
+                            ResourceProfile(**(deployment_doc.get("resources") or {})),
+                            deployment_doc.get("replicas", 1)
+                        ),
+                        PlacementConstraints(**(deployment_doc.get("placement") or {})),
+                        exclude_id=deployment_id,
+                        exclude_nodes=[name]
+                    )
+                    if not target:
+                        await self.log_operation(deployment_id, f"No node available to take this deployment off {name}", LogLevel.ERROR)
+                        failed.append(deployment_id)
+                        continue
+
+                    if not await self.migrate_deployment(deployment_doc, target):
+                        failed.append(deployment_id)
+                        continue
+                    if deployment_doc["status"] == DeploymentStatus.HIBERNATED:
+                        await self._stop_migrated(deployment_id, target)
+                    migrated.append(deployment_id)
+            except LeaseUnavailable:
+                await self.log_operation(deployment_id, f"Cannot move this deployment off {name}: it is being woken or hibernated", LogLevel.ERROR)
+                failed.append(deployment_id)
+
+        # Deployments in any other state (pending, failed, ...) still hold the node too
+        remaining = [str(doc["_id"]) for doc in await db.deployments.find({"node": name}, {"_id": 1}).to_list(length=None)]
+        if not failed and not remaining:
+            await self.set_status(name, NodeStatus.DRAINED)
+
+        return {"node": name, "migrated": migrated, "failed": failed, "remaining": remaining}
+
+    async def _stop_migrated(self, deployment_id: str, target_node: Dict[str, Any]):
+        """Stop the containers a hibernated deployment was rebuilt into; waking starts them again"""
+        from bson import ObjectId
+        db = get_database()
+        deployment_doc = await db.deployments.find_one({"_id": ObjectId(deployment_id)})
+        if not deployment_doc:
+            return
+        docker_service = DockerService(get_engine_client(target_node["docker_url"]))
+        container_ids = [deployment_doc["container_id"]] + [
+            instance["container_id"] for instance in deployment_doc.get("replica_instances", [])
+        ]
+        await asyncio.gather(*(docker_service.stop_container(container_id) for container_id in container_ids))
+        await self.log_operation(deployment_id, f"Hibernated on node {target_node['name']}")
@@ -1,7 +1,9 @@
 import os
 from datetime import datetime
 from typing import Optional
+from pymongo.errors import DuplicateKeyError
 from models import get_database, PortRegistryModel
+from .lease_service import lease
 
 class PortService:
     def __init__(self):
@@ -10,29 +12,40 @@ class PortService:
         
     async def find_available_port(self, deployment_id: str) -> Optional[int]:
         try:
-            db = get_database()
-            
-            # Find all allocated ports
-            allocated_ports = await db.port_registry.find(
-                {"is_allocated": True}
-            ).to_list(length=None)
-            
-            allocated_port_numbers = {port["port"] for port in allocated_ports}
-            
-            # Find first available port in range
-            for port in range(self.min_port, self.max_port + 1):
-                if port not in allocated_port_numbers:
-                    # Reserve this port
-                    port_record = PortRegistryModel(
-                        port=port,
-                        is_allocated=True,
-                        deployment_id=deployment_id,
-                        allocated_at=datetime.utcnow()
-                    )
-                    
-                    await db.port_registry.insert_one(port_record.dict())
-                    return port
-            
+            # One allocator at a time across workers, so two requests never race for the same free port
+            async with lease("ports") as held:
+                db = get_database()
+                
+                # Find all allocated ports
+                allocated_ports = await db.port_registry.find(
+                    {"is_allocated": True}
+                ).to_list(length=None)
+                
+                allocated_port_numbers = {port["port"] for port in allocated_ports}
+                
+                # Find first available port in range
+                for port in range(self.min_port, self.max_port + 1):
+                    if port not in allocated_port_numbers:
+                        # Reserve this port. Released ports keep their registry record, so
+                        # claim it in place; a duplicate key means someone else just took it.
+                        port_record = PortRegistryModel(
+                            port=port,
+                            is_allocated=True,
+                            deployment_id=deployment_id,
+                            allocated_at=datetime.utcnow()
+                        )
+                        
+                        try:
+                            await held.check()
+                            await db.port_registry.update_one(
+                                {"port": port, "is_allocated": {"$ne": True}},
+                                {"$set": port_record.dict()},
+                                upsert=True
+                            )
+                        except DuplicateKeyError:
+                            continue
+                        return port
+                
             return None
             
         except Exception as e:
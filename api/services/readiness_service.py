@@ -0,0 +1,108 @@
+import os
+import time
+import asyncio
+import httpx
+from typing import Optional, Tuple
+from models import LogLevel
+from .log_service import write_log
+
+class ReadinessService:
+    """
+    Waits for a freshly started container to accept traffic. A Docker
+    HEALTHCHECK in the image takes precedence; otherwise the published port
+    is probed over TCP and then HTTP with exponential backoff.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.default_path = os.getenv("READINESS_PATH", "/")
+        self.probe_type = os.getenv("READINESS_PROBE", "http")  # http | tcp
+        self.timeout = float(os.getenv("READINESS_TIMEOUT", "180"))
+        self.probe_timeout = float(os.getenv("READINESS_PROBE_TIMEOUT", "2"))
+        self.initial_backoff = float(os.getenv("READINESS_INITIAL_BACKOFF", "0.5"))
+        self.max_backoff = float(os.getenv("READINESS_MAX_BACKOFF", "5"))
+
+    async def log_operation(self, deployment_id: str, message: str, level: LogLevel = LogLevel.INFO):
+        await write_log(deployment_id, message, level)
+
+    async def _container_state(self, container_id: str) -> Tuple[str, Optional[str], bool]:
+        """Return (container status, health status, whether the image defines a HEALTHCHECK)"""
+        loop = asyncio.get_event_loop()
+        container = await loop.run_in_executor(None, self.client.containers.get, container_id)
+        state = container.attrs.get("State", {})
+        healthcheck = (container.attrs.get("Config") or {}).get("Healthcheck") or {}
+        has_healthcheck = bool(healthcheck.get("Test")) and healthcheck["Test"][0] != "NONE"
+        health = (state.get("Health") or {}).get("Status")
+        return state.get("Status", "unknown"), health, has_healthcheck
+
+    async def probe_tcp(self, host: str, port: int) -> bool:
+        try:
+            _, writer = await asyncio.wait_for(asyncio.open_connection(host, port), self.probe_timeout)
+            writer.close()
+            await writer.wait_closed()
+            return True
+        except Exception:
+            return False
+
+    async def probe_http(self, http_client: httpx.AsyncClient, host: str, port: int, path: str) -> bool:
+        try:
+            response = await http_client.get(f"http://{host}:{port}{path}")
+            # Any non-5xx answer means the app server is up and routing requests
+            return response.status_code < 500
+        except Exception:
+            return False
+
+    async def wait_until_ready(
+        self,
+        deployment_id: str,
+        container_id: str,
+        host: str,
+        port: int,
+        path: Optional[str] = None
+    ) -> Optional[float]:
+        """Block until the container is ready; returns seconds to ready, or None on timeout or crash"""
+        path = path or self.default_path
+        if not path.startswith("/"):
+            path = f"/{path}"
+
+        started = time.monotonic()
+        deadline = started + self.timeout
+        backoff = self.initial_backoff
+
+        _, _, has_healthcheck = await self._container_state(container_id)
+        if has_healthcheck:
+            await self.log_operation(deployment_id, "Waiting for container HEALTHCHECK to report healthy")
+        else:
+            await self.log_operation(deployment_id, f"Probing {self.probe_type.upper()} readiness on port {port} (path {path})")
+
+        async with httpx.AsyncClient(timeout=self.probe_timeout, follow_redirects=False) as http_client:
+            while time.monotonic() < deadline:
+                container_status, health, _ = await self._container_state(container_id)
+                if container_status in ("exited", "dead"):
+                    await self.log_operation(deployment_id, f"Container stopped before becoming ready (status: {container_status})", LogLevel.ERROR)
+                    return None
+
+                if has_healthcheck:
+                    if health == "healthy":
+                        ready = True
+                    elif health == "unhealthy":
+                        await self.log_operation(deployment_id, "Container HEALTHCHECK reported unhealthy", LogLevel.ERROR)
+                        return None
+                    else:
+                        ready = False
+                elif self.probe_type == "tcp":
+                    ready = await self.probe_tcp(host, port)
+                else:
+                    # The TCP connect is cheap and fails fast while the server is still booting
+                    ready = await self.probe_tcp(host, port) and await self.probe_http(http_client, host, port, path)
+
+                if ready:
+                    elapsed = time.monotonic() - started
+                    await self.log_operation(deployment_id, f"Container ready after {elapsed:.1f}s")
+                    return elapsed
+
+                await asyncio.sleep(min(backoff, max(deadline - time.monotonic(), 0)))
+                backoff = min(backoff * 2, self.max_backoff)
+
+        await self.log_operation(deployment_id, f"Container not ready after {self.timeout:.0f}s", LogLevel.ERROR)
+        return None
@@ -0,0 +1,395 @@
+import os
+import re
+import time
+import asyncio
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Optional
+from models import get_database, mark_deployments_changed, PortRegistryModel, DeploymentStatus, LogLevel
+from .docker_service import DockerService, get_engine_client, LOCAL_ENGINE, DEPLOYMENT_LABEL
+from .nginx_service import NginxService
+from .cloudflare_service import CloudflareService, DNS_RECORD_COMMENT
+from .log_service import write_log
+from .lease_service import lease, LeaseUnavailable
+
+# Containers started before they were labelled are recognised by their "<name>-<deployment id>[-r<n>]" name
+LEGACY_CONTAINER_NAME = re.compile(r"^.+-([0-9a-f]{24})(?:-r\d+)?$")
+
+# Routes and DNS are expected for these; pending and building deployments are left to their pipeline
+ROUTED_STATUSES = (DeploymentStatus.RUNNING, DeploymentStatus.HIBERNATED)
+IN_FLIGHT_STATUSES = (DeploymentStatus.PENDING, DeploymentStatus.BUILDING)
+
+def _parse_docker_time(value: Optional[str]) -> Optional[datetime]:
+    try:
+        return datetime.fromisoformat(value[:19]) if value else None
+    except ValueError:
+        return None
+
+def _map_entries(content: str) -> Dict[str, str]:
+    """host -> upstream name from a subdomain mapping file"""
+    entries = {}
+    for line in content.splitlines():
+        parts = line.strip().rstrip(";").split()
+        if len(parts) == 2 and not parts[0].startswith("#"):
+            entries[parts[0]] = parts[1]
+    return entries
+
+class ReconcileService:
+    """
+    Compares the four places a deployment lives (the deployments and
+    port_registry collections, Docker, the nginx map and the tunnel config
+    plus DNS) and repairs what disagrees. State is gathered concurrently;
+    repairs are batched so a run costs at most one nginx reload and one
+    tunnel reload. Deployments whose pipeline is still running, and anything
+    younger than RECONCILE_GRACE_SECONDS, are left alone.
+    """
+
+    def __init__(self):
+        self.interval = int(os.getenv("RECONCILE_INTERVAL", "600"))
+        self.grace = timedelta(seconds=int(os.getenv("RECONCILE_GRACE_SECONDS", "900")))
+        self.repair_enabled = os.getenv("RECONCILE_REPAIR", "true").lower() == "true"
+        # Tunnel hostnames and DNS records under BASE_DOMAIN that belong to something other than a deployment
+        self.keep_hostnames = {name.strip() for name in os.getenv("RECONCILE_KEEP_HOSTNAMES", "").split(",") if name.strip()}
+        # Records without the platform's comment and containers without its label may not be ours; reported unless opted in
+        self.delete_untagged_dns = os.getenv("RECONCILE_DELETE_UNTAGGED_DNS", "false").lower() == "true"
+        self.remove_unlabelled_containers = os.getenv("RECONCILE_REMOVE_UNLABELLED_CONTAINERS", "false").lower() == "true"
+        self.nginx_service = NginxService()
+        self.cloudflare_service = CloudflareService()
+        self.base_domain = self.nginx_service.base_domain
+
+    async def _gather_database(self, now: datetime) -> Dict[str, Any]:
+        db = get_database()
+        deployments, ports, timelines = await asyncio.gather(
+            db.deployments.find({}, {
+                "name": 1, "subdomain": 1, "status": 1, "port": 1, "node": 1, "container_id": 1, "replica_instances": 1
+            }).to_list(length=None),
+            db.port_registry.find({"is_allocated": True}).to_list(length=None),
+            db.deployment_timelines.find(
+                {"finished_at": None, "started_at": {"$gte": now - self.grace}},
+                {"deployment_id": 1}
+            ).to_list(length=None)
+        )
+        in_flight = {timeline["deployment_id"] for timeline in timelines}
+        in_flight.update(str(doc["_id"]) for doc in deployments if doc["status"] in IN_FLIGHT_STATUSES)
+        return {"deployments": deployments, "ports": ports, "in_flight": in_flight}
+
+    async def _gather_containers(self) -> Dict[Optional[str], Optional[List[Dict[str, Any]]]]:
+        """Platform containers per node (None is the local engine), or None for an engine that couldn't be listed"""
+        db = get_database()
+        nodes = await db.nodes.find({}, {"name": 1, "docker_url": 1}).to_list(length=None)
+        engines = {None: LOCAL_ENGINE, **{node["name"]: node["docker_url"] for node in nodes}}
+
+        def list_containers(docker_url: str) -> List[Dict[str, Any]]:
+            containers = []
+            for container in get_engine_client(docker_url).containers.list(all=True):
+                deployment_id = (container.labels or {}).get(DEPLOYMENT_LABEL)
+                labelled = bool(deployment_id)
+                if not deployment_id:
+                    match = LEGACY_CONTAINER_NAME.match(container.name or "")
+                    if not match:
+                        continue
+                    deployment_id = match.group(1)
+                containers.append({
+                    "id": container.id,
+                    "name": container.name,
+                    "status": container.status,
+                    "deployment_id": deployment_id,
+                    "labelled": labelled,
+                    "created": _parse_docker_time(container.attrs.get("Created"))
+                })
+            return containers
+
+        async def list_engine(docker_url: str) -> Optional[List[Dict[str, Any]]]:
+            loop = asyncio.get_event_loop()
+            try:
+                return await loop.run_in_executor(None, list_containers, docker_url)
+            except Exception as e:
+                print(f"Reconciler could not list containers on {docker_url}: {e}")
+                return None
+
+        results = await asyncio.gather(*(list_engine(docker_url) for docker_url in engines.values()))
+        return dict(zip(engines, results))
+
+    async def _gather_tunnel(self) -> Optional[Dict[str, str]]:
+        try:
+            return self.cloudflare_service.read_tunnel_routes()
+        except Exception as e:
+            print(f"Reconciler could not read the tunnel config: {e}")
+            return None
+
+    async def _gather_nginx(self) -> Optional[Dict[str, str]]:
+        try:
+            return self.nginx_service.read_installed_files()
+        except Exception as e:
+            print(f"Reconciler could not read the nginx map: {e}")
+            return None
+
+    async def gather(self) -> Dict[str, Any]:
+        now = datetime.utcnow()
+        database, containers, nginx_files, expected_nginx, tunnel_routes, dns_records = await asyncio.gather(
+            self._gather_database(now),
+            self._gather_containers(),
+            self._gather_nginx(),
+            self.nginx_service.build_route_files(),
+            self._gather_tunnel(),
+            self.cloudflare_service.list_tunnel_dns_records()
+        )
+        return {
+            **database,
+            "now": now,
+            "containers": containers,
+            "nginx_files": nginx_files,
+            "expected_nginx_files": expected_nginx[0],
+            "tunnel_routes": tunnel_routes,
+            "dns_records": dns_records
+        }
+
+    def diff(self, state: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """One entry per disagreement, with the action a repair would take ("none" when it needs a person)"""
+        drift: List[Dict[str, Any]] = []
+        now = state["now"]
+        in_flight = state["in_flight"]
+        deployments = {str(doc["_id"]): doc for doc in state["deployments"]}
+        settled = {deployment_id: doc for deployment_id, doc in deployments.items() if deployment_id not in in_flight}
+
+        def add(kind: str, resource: str, action: str, deployment_id: Optional[str] = None, **detail: Any):
+            drift.append({"kind": kind, "resource": resource, "deployment_id": deployment_id, "action": action, **detail})
+
+        # Docker: containers of deleted deployments, and running deployments without a running container
+        for node, containers in state["containers"].items():
+            if containers is None:
+                continue
+            by_id = {container["id"]: container for container in containers}
+            for container in containers:
+                if container["deployment_id"] in deployments:
+                    continue
+                if container["created"] and now - container["created"] < self.grace:
+                    continue
+                action = "remove_container" if container["labelled"] or self.remove_unlabelled_containers else "none"
+                add("orphan_container", container["name"], action, container["deployment_id"], node=node, container_id=container["id"])
+            for deployment_id, doc in settled.items():
+                if doc.get("node") != node or doc["status"] not in ROUTED_STATUSES or not doc.get("container_id"):
+                    continue
+                container_ids = [doc["container_id"]] + [instance["container_id"] for instance in doc.get("replica_instances", [])]
+                for container_id in container_ids:
+                    container = by_id.get(container_id)
+                    if container is None:
+                        add("missing_container", container_id, "none", deployment_id, node=node)
+                    elif doc["status"] == DeploymentStatus.RUNNING and container["status"] in ("exited", "created"):
+                        add("stopped_container", container["name"], "start_container", deployment_id, node=node, container_id=container_id)
+
+        # Ports: allocations nobody owns, and deployments whose port isn't marked allocated
+        owned_ports = {}
+        for deployment_id, doc in deployments.items():
+            for port in [doc["port"]] + [instance["port"] for instance in doc.get("replica_instances", [])]:
+                owned_ports[port] = deployment_id
+        allocated = {record["port"]: record for record in state["ports"]}
+        for port, record in allocated.items():
+            allocated_at = record.get("allocated_at")
+            if port not in owned_ports and (not allocated_at or now - allocated_at >= self.grace):
+                add("leaked_port", str(port), "release_port", record.get("deployment_id"), port=port)
+        for port, deployment_id in owned_ports.items():
+            if port not in allocated and deployment_id in settled:
+                add("unregistered_port", str(port), "claim_port", deployment_id, port=port)
+
+        # nginx: the installed map and upstream files should be exactly what the database generates
+        expected_files = state["expected_nginx_files"]
+        installed_files = state["nginx_files"] if state["nginx_files"] is not None else expected_files
+        if installed_files != expected_files:
+            mapping_file = self.nginx_service.mapping_file
+            installed, expected = _map_entries(installed_files.get(mapping_file, "")), _map_entries(expected_files[mapping_file])
+            add(
+                "stale_nginx_routes",
+                self.nginx_service.mapping_file,
+                "rewrite_nginx",
+                missing=sorted(set(expected) - set(installed)),
+                stale=sorted(set(installed) - set(expected)),
+                changed=sorted(host for host in set(installed) & set(expected) if installed[host] != expected[host]),
+                upstreams_changed=sorted(
+                    path for path in set(installed_files) | set(expected_files)
+                    if path != mapping_file and installed_files.get(path) != expected_files.get(path)
+                )
+            )
+
+        # Tunnel and DNS: every routed deployment has both; hostnames of no deployment have neither
+        known = {f"{doc['subdomain']}.{self.base_domain}" for doc in deployments.values()}
+        routed = {
+            f"{doc['subdomain']}.{self.base_domain}": deployment_id
+            for deployment_id, doc in settled.items()
+            if doc["status"] in ROUTED_STATUSES
+        }
+
+        def unmanaged(hostname: str) -> bool:
+            return (
+                hostname in known
+                or hostname in self.keep_hostnames
+                or hostname.startswith("*.")
+                or not hostname.endswith(f".{self.base_domain}")
+            )
+
+        # In wildcard mode one *.BASE_DOMAIN record and route serve every deployment
+        wildcard = f"*.{self.base_domain}"
+        wildcard_enabled = self.cloudflare_service.wildcard_enabled
+
+        tunnel_routes = state["tunnel_routes"]
+        if tunnel_routes is not None:
+            for hostname, service in tunnel_routes.items():
+                # Only routes this platform writes (to the local nginx) are candidates for removal
+                if not unmanaged(hostname) and service == "http://localhost:80":
+                    add("stale_tunnel_route", hostname, "remove_tunnel_route")
+            if wildcard_enabled and wildcard not in tunnel_routes:
+                add("missing_wildcard_route", wildcard, "setup_wildcard")
+            for hostname, deployment_id in routed.items():
+                if hostname not in tunnel_routes and not (wildcard_enabled and wildcard in tunnel_routes):
+                    add("missing_tunnel_route", hostname, "add_tunnel_route", deployment_id)
+
+        dns_records = state["dns_records"]
+        if dns_records is not None:
+            record_names = {record["name"] for record in dns_records}
+            for record in dns_records:
+                if not unmanaged(record["name"]):
+                    action = "delete_dns_record" if record.get("comment") == DNS_RECORD_COMMENT or self.delete_untagged_dns else "none"
+                    add("stale_dns_record", record["name"], action, record_id=record["id"])
+            if wildcard_enabled and wildcard not in record_names:
+                add("missing_wildcard_dns_record", wildcard, "setup_wildcard")
+            for hostname, deployment_id in routed.items():
+                if hostname not in record_names and not (wildcard_enabled and wildcard in record_names):
+                    add("missing_dns_record", hostname, "create_dns_record", deployment_id, subdomain=deployments[deployment_id]["subdomain"])
+
+        return drift
+
+    async def repair(self, drift: List[Dict[str, Any]]):
+        """Apply every entry's action, batched by kind; sets "repaired" on each entry"""
+        db = get_database()
+        by_action: Dict[str, List[Dict[str, Any]]] = {}
+        for entry in drift:
+            by_action.setdefault(entry["action"], []).append(entry)
+
+        async def docker_service_for(node: Optional[str]) -> DockerService:
+            if node is None:
+                return DockerService()
+            node_doc = await db.nodes.find_one({"name": node})
+            return DockerService(get_engine_client(node_doc["docker_url"]))
+
+        async def remove_container(entry):
+            docker_service = await docker_service_for(entry["node"])
+            await docker_service.stop_container(entry["container_id"])
+            entry["repaired"] = await docker_service.remove_container(entry["container_id"])
+
+        async def start_container(entry):
+            docker_service = await docker_service_for(entry["node"])
+            entry["repaired"] = await docker_service.start_container(entry["container_id"])
+            if entry["repaired"]:
+                await write_log(entry["deployment_id"], f"Reconciler restarted stopped container {entry['resource']}", LogLevel.WARNING)
+
+        async def release_ports(entries):
+            result = await db.port_registry.update_many(
+                {"port": {"$in": [entry["port"] for entry in entries]}, "is_allocated": True},
+                {"$set": {"is_allocated": False, "deployment_id": None, "released_at": datetime.utcnow()}}
+            )
+            for entry in entries:
+                entry["repaired"] = result.matched_count > 0
+
+        async def claim_port(entry):
+            record = PortRegistryModel(
+                port=entry["port"],
+                is_allocated=True,
+                deployment_id=entry["deployment_id"],
+                allocated_at=datetime.utcnow()
+            )
+            await db.port_registry.update_one({"port": entry["port"]}, {"$set": record.dict()}, upsert=True)
+            entry["repaired"] = True
+
+        async def rewrite_nginx(entries):
+            repaired = await self.nginx_service.sync_routes()
+            for entry in entries:
+                entry["repaired"] = repaired
+
+        async def update_tunnel(entries):
+            repaired = await self.cloudflare_service.update_tunnel_routes(
+                add=[entry["resource"] for entry in entries if entry["action"] == "add_tunnel_route"],
+                remove=[entry["resource"] for entry in entries if entry["action"] == "remove_tunnel_route"]
+            )
+            for entry in entries:
+                entry["repaired"] = repaired
+
+        # The Cloudflare API is rate limited; a handful of calls at a time
+        dns_slots = asyncio.Semaphore(int(os.getenv("RECONCILE_DNS_CONCURRENCY", "4")))
+
+        async def delete_dns_record(entry):
+            async with dns_slots:
+                entry["repaired"] = await self.cloudflare_service.delete_dns_record(entry["record_id"])
+
+        async def create_dns_record(entry):
+            async with dns_slots:
+                entry["repaired"] = await self.cloudflare_service.create_dns_record(entry["subdomain"], entry["deployment_id"])
+
+        async def setup_wildcard(entries):
+            # Also updates this worker's flag, so its deploys fall back to per-hostname routes if this fails
+            repaired = await self.cloudflare_service.ensure_wildcard()
+            for entry in entries:
+                entry["repaired"] = repaired
+
+        tasks = []
+        tasks += [remove_container(entry) for entry in by_action.get("remove_container", [])]
+        tasks += [start_container(entry) for entry in by_action.get("start_container", [])]
+        tasks += [claim_port(entry) for entry in by_action.get("claim_port", [])]
+        tasks += [delete_dns_record(entry) for entry in by_action.get("delete_dns_record", [])]
+        tasks += [create_dns_record(entry) for entry in by_action.get("create_dns_record", [])]
+        if by_action.get("release_port"):
+            tasks.append(release_ports(by_action["release_port"]))
+        if by_action.get("rewrite_nginx"):
+            tasks.append(rewrite_nginx(by_action["rewrite_nginx"]))
+        tunnel_entries = by_action.get("add_tunnel_route", []) + by_action.get("remove_tunnel_route", [])
+        if tunnel_entries:
+            tasks.append(update_tunnel(tunnel_entries))
+        if by_action.get("setup_wildcard"):
+            tasks.append(setup_wildcard(by_action["setup_wildcard"]))
+
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                print(f"Reconciler repair failed: {result}")
+        if by_action.get("start_container"):
+            await mark_deployments_changed(*{entry["deployment_id"] for entry in by_action["start_container"]})
+
+    async def reconcile(self, repair: bool = False) -> Dict[str, Any]:
+        """Gather and diff every source; with repair, also fix what can be fixed. Returns the report."""
+        started = time.monotonic()
+        state = await self.gather()
+        drift = self.diff(state)
+        if repair and drift:
+            await self.repair(drift)
+
+        counts: Dict[str, int] = {}
+        for entry in drift:
+            counts[entry["kind"]] = counts.get(entry["kind"], 0) + 1
+        return {
+            "checked_at": state["now"].isoformat(),
+            "dry_run": not repair,
+            "duration_ms": round((time.monotonic() - started) * 1000, 1),
+            "sources": {
+                "docker": {str(node or "local"): containers is not None for node, containers in state["containers"].items()},
+                "nginx": state["nginx_files"] is not None,
+                "tunnel": state["tunnel_routes"] is not None,
+                "dns": state["dns_records"] is not None
+            },
+            "skipped_in_flight": len(state["in_flight"]),
+            "counts": counts,
+            "drift": drift
+        }
+
+    async def run_reconciler(self):
+        """Background loop started with the API; the first pass runs immediately to clean up after a crash"""
+        while True:
+            try:
+                # One worker reconciles per pass; the others skip it
+                async with lease("reconciler", wait=0):
+                    report = await self.reconcile(repair=self.repair_enabled)
+                if report["drift"]:
+                    verb = "Repaired" if self.repair_enabled else "Found"
+                    print(f"{verb} drift: {report['counts']}")
+            except LeaseUnavailable:
+                pass
+            except Exception as e:
+                print(f"Reconciler failed: {e}")
+            await asyncio.sleep(self.interval)
@@ -0,0 +1,200 @@
+import os
+import asyncio
+from datetime import datetime
+from typing import Dict, Any, List, Optional
+from models import get_database, mark_deployments_changed, DeploymentStatus, ResourceProfile, LogLevel
+from .nginx_service import NginxService
+from .node_service import NodeService
+from .port_service import PortService
+from .capacity_service import CapacityService
+from .readiness_service import ReadinessService
+from .event_service import event_bus
+from .log_service import write_log
+from .lease_service import lease, LeaseUnavailable
+
+class ReplicaService:
+    """
+    Runs extra containers of an already-built image so a deployment can be
+    served by several ports behind one nginx upstream. The primary container
+    keeps the deployment's own port; extra replicas live in replica_instances.
+    """
+
+    def __init__(self):
+        self.max_replicas = int(os.getenv("MAX_REPLICAS", "10"))
+        self.nginx_service = NginxService()
+        self.node_service = NodeService()
+        self.port_service = PortService()
+        self.capacity_service = CapacityService()
+
+    async def log_operation(self, deployment_id: str, message: str, level: LogLevel = LogLevel.INFO):
+        await write_log(deployment_id, message, level)
+
+    def _deployment_object(self, deployment_doc: Dict[str, Any]):
+        class SimpleDeployment:
+            def __init__(self, doc):
+                self.id = str(doc["_id"])
+                self.name = doc["name"]
+                self.github_url = doc["github_url"]
+                self.subdomain = doc["subdomain"]
+                self.port = doc["port"]
+                self.status = doc["status"]
+                self.env_vars = doc.get("env_vars", {})
+                self.resources = ResourceProfile(**(doc.get("resources") or {}))
+
+        return SimpleDeployment(deployment_doc)
+
+    async def _start_replica(self, deployment_doc: Dict[str, Any], index: int, docker_service, host: str) -> Optional[Dict[str, Any]]:
+        deployment_id = str(deployment_doc["_id"])
+        deployment = self._deployment_object(deployment_doc)
+
+        port = await self.port_service.find_available_port(deployment_id)
+        if not port:
+            await self.log_operation(deployment_id, f"No port available for replica {index}", LogLevel.ERROR)
+            return None
+
+        container_id = await docker_service.run_container(deployment_doc["docker_image"], deployment, port=port, replica=index)
+        if not container_id:
+            await self.port_service.release_port(port)
+            return None
+
+        readiness_service = ReadinessService(docker_service.client)
+        time_to_ready = await readiness_service.wait_until_ready(
+            deployment_id, container_id, host, port, deployment_doc.get("readiness_path")
+        )
+        if time_to_ready is None:
+            await docker_service.stop_container(container_id)
+            await docker_service.remove_container(container_id)
+            await self.port_service.release_port(port)
+            return None
+
+        return {"index": index, "port": port, "container_id": container_id}
+
+    async def remove_replicas(self, deployment_doc: Dict[str, Any], instances: List[Dict[str, Any]]):
+        """Stop and remove replica containers and release their ports"""
+        docker_service = await self.node_service.get_docker_service(deployment_doc.get("node"))
+
+        async def remove(instance):
+            await docker_service.stop_container(instance["container_id"])
+            await docker_service.remove_container(instance["container_id"])
+            await self.port_service.release_port(instance["port"])
+
+        await asyncio.gather(*(remove(instance) for instance in instances))
+
+    async def scale(self, deployment_id: str, replicas: int, refresh_routes: bool = True) -> bool:
+        """
+        Bring the deployment to the requested number of containers using its
+        existing image: no clone or rebuild. Scaling down takes replicas out of
+        the upstream before stopping them. Runs under the deployment's power
+        lease, so concurrent scales (or a wake or hibernation) don't pick the
+        same replica indexes and ports.
+        """
+        if replicas < 1 or replicas > self.max_replicas:
+            return False
+
+        try:
+            async with lease(f"power:{deployment_id}") as held:
+                return await self._scale(deployment_id, replicas, refresh_routes, held)
+        except LeaseUnavailable:
+            await self.log_operation(deployment_id, f"Cannot scale to {replicas} replicas: the deployment is busy", LogLevel.WARNING)
+            return False
+
+    async def _scale(self, deployment_id: str, replicas: int, refresh_routes: bool, held) -> bool:
+        from bson import ObjectId
+        db = get_database()
+
+        deployment_doc = await db.deployments.find_one({"_id": ObjectId(deployment_id)})
+        if not deployment_doc or not deployment_doc.get("docker_image"):
+            return False
+
+        instances = list(deployment_doc.get("replica_instances", []))
+        current = 1 + len(instances)
+
+        try:
+            if replicas > current:
+                node = await self.node_service.get_node(deployment_doc["node"]) if deployment_doc.get("node") else None
+                profile = ResourceProfile(**(deployment_doc.get("resources") or {}))
+                extra = replicas - current
+                # Check the deployment's full target footprint against everything else on the host
+                target_profile = self.capacity_service.footprint(profile, replicas)
+                if not await self.capacity_service.can_admit(target_profile, exclude_id=deployment_id, node=node):
+                    await self.log_operation(deployment_id, f"Cannot scale to {replicas} replicas: host capacity exhausted", LogLevel.WARNING)
+                    return False
+
+                await self.log_operation(deployment_id, f"Scaling up from {current} to {replicas} replicas")
+                docker_service = await self.node_service.get_docker_service(deployment_doc.get("node"))
+                host = node["address"] if node else "127.0.0.1"
+
+                # Container names carry the replica index; reuse gaps left by failed starts
+                used = {instance.get("index") for instance in instances}
+                free_indices = [index for index in range(1, self.max_replicas + 1) if index not in used][:extra]
+
+                started = await asyncio.gather(*(
+                    self._start_replica(deployment_doc, index, docker_service, host)
+                    for index in free_indices
+                ))
+                new_instances = [instance for instance in started if instance]
+                instances.extend(new_instances)
+
+                if len(new_instances) < extra:
+                    await self.log_operation(
+                        deployment_id,
+                        f"Only {len(new_instances)} of {extra} new replicas became ready",
+                        LogLevel.WARNING
+                    )
+
+                await held.check()
+                result = await db.deployments.update_one(
+                    {"_id": ObjectId(deployment_id), "replica_instances": deployment_doc.get("replica_instances")},
+                    {"$set": {
+                        "replicas": 1 + len(instances),
+                        "replica_instances": instances,
+                        "updated_at": datetime.utcnow()
+                    }}
+                )
+                if result.matched_count == 0:
+                    # Changed underneath us; what we started is tracked nowhere, so it goes
+                    await self.log_operation(deployment_id, "Replicas changed during scaling; new replicas removed", LogLevel.WARNING)
+                    await self.remove_replicas(deployment_doc, new_instances)
+                    return False
+                await mark_deployments_changed(deployment_id)
+                event_bus.publish("updated", deployment_id, replicas=1 + len(instances))
+                if refresh_routes and new_instances and deployment_doc["status"] == DeploymentStatus.RUNNING:
+                    await self._refresh_routes(deployment_id)
+
+                return len(new_instances) == extra
+
+            if replicas < current:
+                await self.log_operation(deployment_id, f"Scaling down from {current} to {replicas} replicas")
+                keep, drop = instances[:replicas - 1], instances[replicas - 1:]
+
+                await held.check()
+                result = await db.deployments.update_one(
+                    {"_id": ObjectId(deployment_id), "replica_instances": deployment_doc.get("replica_instances")},
+                    {"$set": {
+                        "replicas": replicas,
+                        "replica_instances": keep,
+                        "updated_at": datetime.utcnow()
+                    }}
+                )
+                if result.matched_count == 0:
+                    await self.log_operation(deployment_id, "Replicas changed during scaling; nothing removed", LogLevel.WARNING)
+                    return False
+                await mark_deployments_changed(deployment_id)
+                event_bus.publish("updated", deployment_id, replicas=replicas)
+                # Drain traffic away before the containers go
+                if refresh_routes and deployment_doc["status"] == DeploymentStatus.RUNNING:
+                    await self._refresh_routes(deployment_id)
+
+                await self.remove_replicas(deployment_doc, drop)
+
+            await self.log_operation(deployment_id, f"Deployment running with {replicas} replicas")
+            return True
+
+        except Exception as e:
+            await self.log_operation(deployment_id, f"Scaling failed: {str(e)}", LogLevel.ERROR)
+            return False
+
+    async def _refresh_routes(self, deployment_id: str) -> bool:
+        if not await self.nginx_service.generate_mapping_file(deployment_id):
+            return False
+        return await self.nginx_service.reload_nginx(deployment_id)
@@ -0,0 +1,208 @@
+import os
+import re
+import asyncio
+import threading
+from collections import deque
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple
+
+# Docker prefixes each line with an RFC 3339 timestamp with up to nanosecond precision
+_TIMESTAMP = re.compile(r"^(\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2})(?:\.(\d+))?Z ?")
+
+def parse_log_line(text: str) -> Dict[str, Any]:
+    """Split a timestamped docker log line; "key" is a sortable form of the full-precision timestamp"""
+    match = _TIMESTAMP.match(text)
+    if not match:
+        return {"timestamp": None, "key": "", "line": text}
+    fraction = match.group(2) or ""
+    return {
+        "timestamp": datetime.fromisoformat(f"{match.group(1)}.{fraction[:6].ljust(6, '0')}"),
+        "key": f"{match.group(1)}.{fraction.ljust(9, '0')}",
+        "line": text[match.end():]
+    }
+
+def _split_lines(chunks) -> Any:
+    """Reassemble lines from docker's stream frames, which may hold several lines or part of one"""
+    pending = b""
+    for chunk in chunks:
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            yield line.decode("utf-8", errors="replace").rstrip("\r")
+    if pending:
+        yield pending.decode("utf-8", errors="replace").rstrip("\r")
+
+class TooManyLogStreams(Exception):
+    """Following another container would go over RUNTIME_LOG_MAX_STREAMS"""
+
+class ContainerLogStream:
+    """
+    The one `docker logs --follow` reader for a container. It runs in its own
+    daemon thread (a follow blocks for as long as anyone watches, so it stays
+    out of the executor the deploy pipeline uses), keeps the most recent lines
+    in a ring buffer and hands each new line to every viewer's bounded queue.
+    """
+
+    def __init__(self, hub: "RuntimeLogHub", client, container_id: str):
+        self.hub = hub
+        self.client = client
+        self.container_id = container_id
+        self.buffer: deque = deque(maxlen=hub.buffer_size)
+        self.subscribers: List[asyncio.Queue] = []
+        self.sequence = 0
+        self.ready = asyncio.Event()
+        self.closed = False
+        self._stream = None
+        self._idle_handle: Optional[asyncio.TimerHandle] = None
+
+    def start(self):
+        loop = asyncio.get_event_loop()
+        # Closed if nobody subscribes, e.g. the viewer left during the history fetch
+        self._idle_handle = loop.call_later(self.hub.idle_timeout, self._close_if_idle)
+        threading.Thread(
+            target=self._read, args=(loop,), name=f"logs-{self.container_id[:12]}", daemon=True
+        ).start()
+
+    def _read(self, loop: asyncio.AbstractEventLoop):
+        try:
+            container = self.client.containers.get(self.container_id)
+            # History first, so viewers get their backlog from the buffer, then follow from its last line
+            history = container.logs(tail=self.hub.buffer_size, timestamps=True)
+            entries = [parse_log_line(line) for line in history.decode("utf-8", errors="replace").splitlines()]
+            loop.call_soon_threadsafe(self._load_history, entries)
+
+            last_key = entries[-1]["key"] if entries else ""
+            since = entries[-1]["timestamp"] if entries and entries[-1]["timestamp"] else None
+            self._stream = container.logs(stream=True, follow=True, timestamps=True, since=since)
+            if self.closed:
+                # close() ran before there was a stream to close
+                self._stream.close()
+                return
+            for line in _split_lines(self._stream):
+                entry = parse_log_line(line)
+                # `since` has second resolution; skip what the history already holds
+                if last_key and entry["key"] and entry["key"] <= last_key:
+                    continue
+                loop.call_soon_threadsafe(self._publish, entry)
+        except Exception as e:
+            if not self.closed:
+                print(f"Runtime log stream for {self.container_id} ended: {e}")
+        finally:
+            loop.call_soon_threadsafe(self._finish)
+
+    def _load_history(self, entries: List[Dict[str, Any]]):
+        for entry in entries:
+            self.sequence += 1
+            self.buffer.append({"id": self.sequence, **entry})
+        self.ready.set()
+
+    def _publish(self, entry: Dict[str, Any]):
+        self.sequence += 1
+        entry = {"id": self.sequence, **entry}
+        self.buffer.append(entry)
+        for queue in list(self.subscribers):
+            try:
+                queue.put_nowait(entry)
+            except asyncio.QueueFull:
+                # Slow viewer: end its stream rather than hold up the reader or the other viewers
+                self._drop(queue)
+
+    def _drop(self, queue: asyncio.Queue):
+        if queue in self.subscribers:
+            self.subscribers.remove(queue)
+        while not queue.empty():
+            queue.get_nowait()
+        queue.put_nowait(None)
+
+    def _finish(self):
+        self.closed = True
+        self.ready.set()
+        for queue in list(self.subscribers):
+            self._drop(queue)
+        self.hub._forget(self)
+
+    def close(self):
+        """Stop following; closing the HTTP response ends the reader thread's iteration"""
+        self.closed = True
+        if self._stream is not None:
+            try:
+                self._stream.close()
+            except Exception:
+                pass
+
+    async def subscribe(self, tail: int, since: Optional[datetime]) -> Tuple[List[Dict[str, Any]], asyncio.Queue]:
+        """The buffered backlog (at most `tail` lines at or after `since`) and a queue of the lines after it"""
+        await self.ready.wait()
+        if self._idle_handle:
+            self._idle_handle.cancel()
+            self._idle_handle = None
+        # No await between the snapshot and registering the queue, so no line falls in between
+        backlog = [entry for entry in self.buffer if not since or (entry["timestamp"] and entry["timestamp"] >= since)]
+        backlog = backlog[-tail:] if tail else []
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.hub.queue_size)
+        if self.closed:
+            queue.put_nowait(None)
+        else:
+            self.subscribers.append(queue)
+        return backlog, queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        if queue in self.subscribers:
+            self.subscribers.remove(queue)
+        if not self.subscribers and not self.closed:
+            # Keep following briefly so a reconnecting viewer reuses the stream
+            loop = asyncio.get_event_loop()
+            self._idle_handle = loop.call_later(self.hub.idle_timeout, self._close_if_idle)
+
+    def _close_if_idle(self):
+        self._idle_handle = None
+        if not self.subscribers:
+            self.close()
+
+class RuntimeLogHub:
+    """
+    Multiplexes container stdout/stderr to any number of viewers: one Docker
+    log stream per container, shared through a ring buffer of the last
+    RUNTIME_LOG_BUFFER lines. A viewer more than RUNTIME_LOG_QUEUE_SIZE lines
+    behind is disconnected instead of slowing the reader down.
+    """
+
+    def __init__(self):
+        self.buffer_size = int(os.getenv("RUNTIME_LOG_BUFFER", "1000"))
+        self.queue_size = int(os.getenv("RUNTIME_LOG_QUEUE_SIZE", "500"))
+        self.idle_timeout = float(os.getenv("RUNTIME_LOG_IDLE_SECONDS", "30"))
+        # Each followed container holds a thread until its stream closes
+        self.max_streams = int(os.getenv("RUNTIME_LOG_MAX_STREAMS", "50"))
+        self._streams: Dict[str, ContainerLogStream] = {}
+
+    def stream(self, client, container_id: str) -> ContainerLogStream:
+        stream = self._streams.get(container_id)
+        if stream is None or stream.closed:
+            if len(self._streams) >= self.max_streams:
+                raise TooManyLogStreams(f"At most {self.max_streams} containers can be followed at once")
+            stream = ContainerLogStream(self, client, container_id)
+            self._streams[container_id] = stream
+            stream.start()
+        return stream
+
+    def _forget(self, stream: ContainerLogStream):
+        if self._streams.get(stream.container_id) is stream:
+            del self._streams[stream.container_id]
+
+    async def read(self, client, container_id: str, tail: int, since: Optional[datetime] = None) -> List[Dict[str, Any]]:
+        """A one-off read straight from Docker, not limited to the buffer"""
+        def fetch() -> bytes:
+            container = client.containers.get(container_id)
+            return container.logs(tail=tail, since=since, timestamps=True)
+
+        loop = asyncio.get_event_loop()
+        output = await loop.run_in_executor(None, fetch)
+        return [parse_log_line(line) for line in output.decode("utf-8", errors="replace").splitlines()]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "streams": len(self._streams),
+            "viewers": sum(len(stream.subscribers) for stream in self._streams.values())
+        }
+
+runtime_logs = RuntimeLogHub()
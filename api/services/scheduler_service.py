@@ -0,0 +1,96 @@
+from typing import Optional, Dict, Any, List
+from models import get_database, NodeStatus, ResourceProfile, PlacementConstraints
+from .capacity_service import CapacityService
+
+class PlacementScheduler:
+    """
+    Picks a registered node for a deployment: filter by required labels and
+    free capacity, then prefer the spread domain holding the fewest members of
+    the deployment's spread group, then the least-loaded node.
+    """
+
+    def __init__(self):
+        self.capacity_service = CapacityService()
+
+    async def has_nodes(self) -> bool:
+        db = get_database()
+        return await db.nodes.count_documents({}, limit=1) > 0
+
+    def _matches_labels(self, node: Dict[str, Any], labels: Dict[str, str]) -> bool:
+        node_labels = node.get("labels", {})
+        return all(node_labels.get(key) == value for key, value in labels.items())
+
+    def _spread_domain(self, node: Dict[str, Any], spread_by: Optional[str]) -> str:
+        if spread_by:
+            return node.get("labels", {}).get(spread_by, "")
+        return node["name"]
+
+    async def place(
+        self,
+        profile: ResourceProfile,
+        placement: PlacementConstraints,
+        exclude_id: Optional[str] = None,
+        exclude_nodes: Optional[List[str]] = None,
+        require_fit: bool = True
+    ) -> Optional[Dict[str, Any]]:
+        """Return the chosen node document, or None if no active node is eligible"""
+        db = get_database()
+        exclude_nodes = exclude_nodes or []
+
+        nodes = await db.nodes.find({"status": NodeStatus.ACTIVE}).to_list(length=None)
+        nodes = [
+            node for node in nodes
+            if node["name"] not in exclude_nodes and self._matches_labels(node, placement.labels)
+        ]
+        if not nodes:
+            return None
+
+        # Count members of the spread group per domain
+        group_members = []
+        if placement.spread_group:
+            group_members = await db.deployments.find(
+                {
+                    "placement.spread_group": placement.spread_group,
+                    "node": {"$ne": None},
+                    "status": {"$in": self.capacity_service.committed_statuses}
+                },
+                {"node": 1}
+            ).to_list(length=None)
+        if exclude_id:
+            group_members = [member for member in group_members if str(member["_id"]) != exclude_id]
+
+        domain_by_node = {node["name"]: self._spread_domain(node, placement.spread_by) for node in nodes}
+        domain_counts: Dict[str, int] = {}
+        for member in group_members:
+            domain = domain_by_node.get(member["node"])
+            if domain is not None:
+                domain_counts[domain] = domain_counts.get(domain, 0) + 1
+
+        candidates = []
+        for node in nodes:
+            committed = await self.capacity_service.committed(exclude_id, node["name"])
+            limits = self.capacity_service.limits(node)
+
+            cpu_after = committed["cpus"] + profile.cpus
+            memory_after = committed["memory_mb"] + profile.memory_mb
+            pids_after = committed["pids"] + profile.pids
+            fits = (
+                cpu_after <= limits["cpus"] and
+                memory_after <= limits["memory_mb"] and
+                pids_after <= limits["pids"]
+            )
+            if require_fit and not fits:
+                continue
+
+            load = max(
+                cpu_after / limits["cpus"] if limits["cpus"] else 1.0,
+                memory_after / limits["memory_mb"] if limits["memory_mb"] else 1.0
+            )
+            spread = domain_counts.get(domain_by_node[node["name"]], 0)
+            candidates.append(((spread, load, node["name"]), node))
+
+        if not candidates:
+            return None
+
+        candidates.sort(key=lambda candidate: candidate[0])
+        return candidates[0][1]
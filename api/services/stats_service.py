@@ -0,0 +1,239 @@
+import os
+import time
+import asyncio
+from array import array
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional, Tuple
+from models import get_database, DeploymentStatus
+from .node_service import NodeService
+
+# Values kept per sample; the I/O fields are rates over the sampling interval
+STAT_FIELDS = (
+    "cpu_percent",
+    "memory_bytes",
+    "memory_limit_bytes",
+    "net_rx_bps",
+    "net_tx_bps",
+    "block_read_bps",
+    "block_write_bps"
+)
+
+def _iso(timestamp: float) -> str:
+    return datetime.utcfromtimestamp(timestamp).isoformat()
+
+class StatsRing:
+    """A fixed number of samples in preallocated arrays, one per field, overwritten oldest first"""
+
+    def __init__(self, size: int):
+        self.size = size
+        self.times = array("d", bytes(8 * size))
+        self.values = {field: array("d", bytes(8 * size)) for field in STAT_FIELDS}
+        self.count = 0
+        self._next = 0
+
+    def append(self, timestamp: float, sample: Dict[str, float]):
+        self.times[self._next] = timestamp
+        for field in STAT_FIELDS:
+            self.values[field][self._next] = sample[field]
+        self._next = (self._next + 1) % self.size
+        self.count = min(self.count + 1, self.size)
+
+    def _indexes(self) -> List[int]:
+        start = (self._next - self.count) % self.size
+        return [(start + offset) % self.size for offset in range(self.count)]
+
+    @property
+    def last_time(self) -> float:
+        return self.times[(self._next - 1) % self.size] if self.count else 0.0
+
+    def latest(self) -> Optional[Dict[str, float]]:
+        if not self.count:
+            return None
+        index = (self._next - 1) % self.size
+        return {"timestamp": _iso(self.times[index]), **{field: self.values[field][index] for field in STAT_FIELDS}}
+
+    def history(self, points: int, since: Optional[float] = None) -> List[Dict[str, float]]:
+        """Samples after `since`, averaged into at most `points` evenly sized buckets, oldest first"""
+        indexes = [index for index in self._indexes() if since is None or self.times[index] > since]
+        if not indexes or points <= 0:
+            return []
+        buckets = min(points, len(indexes))
+        history = []
+        for bucket in range(buckets):
+            members = indexes[bucket * len(indexes) // buckets:(bucket + 1) * len(indexes) // buckets]
+            point = {"timestamp": _iso(self.times[members[-1]])}
+            for field in STAT_FIELDS:
+                values = self.values[field]
+                point[field] = round(sum(values[index] for index in members) / len(members), 2)
+            history.append(point)
+        return history
+
+def _container_counters(stats: Dict[str, Any]) -> Dict[str, float]:
+    """Cumulative counters and current memory from one `docker stats` reading"""
+    cpu = stats.get("cpu_stats") or {}
+    memory = stats.get("memory_stats") or {}
+    # Page cache is reclaimable; subtract it the way `docker stats` does (cgroup v2, then v1)
+    cache = (memory.get("stats") or {}).get("inactive_file", (memory.get("stats") or {}).get("total_inactive_file", 0))
+    networks = (stats.get("networks") or {}).values()
+    block = (stats.get("blkio_stats") or {}).get("io_service_bytes_recursive") or []
+    return {
+        "cpu_total": float((cpu.get("cpu_usage") or {}).get("total_usage", 0)),
+        "cpu_system": float(cpu.get("system_cpu_usage", 0)),
+        "online_cpus": float(cpu.get("online_cpus") or len((cpu.get("cpu_usage") or {}).get("percpu_usage") or []) or 1),
+        "memory_bytes": float(max(memory.get("usage", 0) - cache, 0)),
+        "memory_limit_bytes": float(memory.get("limit", 0)),
+        "net_rx": float(sum(network.get("rx_bytes", 0) for network in networks)),
+        "net_tx": float(sum(network.get("tx_bytes", 0) for network in networks)),
+        "block_read": float(sum(entry.get("value", 0) for entry in block if entry.get("op", "").lower() == "read")),
+        "block_write": float(sum(entry.get("value", 0) for entry in block if entry.get("op", "").lower() == "write"))
+    }
+
+def _container_sample(previous: Dict[str, float], current: Dict[str, float], elapsed: float) -> Dict[str, float]:
+    def rate(counter: str) -> float:
+        # Counters restart with the container
+        return max(current[counter] - previous[counter], 0) / elapsed
+
+    system_delta = current["cpu_system"] - previous["cpu_system"]
+    cpu_delta = current["cpu_total"] - previous["cpu_total"]
+    return {
+        "cpu_percent": cpu_delta / system_delta * current["online_cpus"] * 100 if system_delta > 0 and cpu_delta > 0 else 0.0,
+        "memory_bytes": current["memory_bytes"],
+        "memory_limit_bytes": current["memory_limit_bytes"],
+        "net_rx_bps": rate("net_rx"),
+        "net_tx_bps": rate("net_tx"),
+        "block_read_bps": rate("block_read"),
+        "block_write_bps": rate("block_write")
+    }
+
+class StatsSampler:
+    """
+    Reads `docker stats` for every running deployment's containers each
+    STATS_INTERVAL seconds, STATS_CONCURRENCY at a time on a dedicated thread
+    pool so sampling never queues behind builds. Each deployment keeps its
+    last STATS_HISTORY samples (replicas summed) in a StatsRing, so memory is
+    bounded by the number of deployments.
+    """
+
+    def __init__(self):
+        self.interval = float(os.getenv("STATS_INTERVAL", "10"))
+        self.history_size = int(os.getenv("STATS_HISTORY", "360"))
+        self.concurrency = int(os.getenv("STATS_CONCURRENCY", "16"))
+        self.rings: Dict[str, StatsRing] = {}
+        self.deployments: Dict[str, Dict[str, Any]] = {}
+        self._previous: Dict[str, Tuple[float, Dict[str, float]]] = {}
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def _read_stats(self, client, container_id: str) -> Dict[str, Any]:
+        # one_shot skips the second reading Docker otherwise waits ~1s for; CPU is diffed against our last sample
+        return client.api.stats(container_id, stream=False, one_shot=True)
+
+    async def _sample_container(self, client, container_id: str) -> Optional[Dict[str, float]]:
+        loop = asyncio.get_event_loop()
+        try:
+            stats = await loop.run_in_executor(self._executor, self._read_stats, client, container_id)
+        except Exception as e:
+            print(f"Failed to read stats for container {container_id}: {e}")
+            return None
+
+        now = time.monotonic()
+        current = _container_counters(stats)
+        previous = self._previous.get(container_id)
+        self._previous[container_id] = (now, current)
+        if not previous or now <= previous[0]:
+            # The first reading is only a baseline for the rates
+            return None
+        return _container_sample(previous[1], current, now - previous[0])
+
+    async def sample(self) -> int:
+        """Sample every running deployment once; returns how many got a new sample"""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="stats")
+
+        db = get_database()
+        docs = await db.deployments.find(
+            {"status": DeploymentStatus.RUNNING, "container_id": {"$ne": None}},
+            {"name": 1, "subdomain": 1, "node": 1, "container_id": 1, "replica_instances.container_id": 1}
+        ).to_list(length=None)
+
+        node_service = NodeService()
+        clients: Dict[Optional[str], Any] = {}
+        for node in {doc.get("node") for doc in docs}:
+            clients[node] = (await node_service.get_docker_service(node)).client
+
+        async def sample_deployment(doc: Dict[str, Any]) -> bool:
+            container_ids = [doc["container_id"]] + [instance["container_id"] for instance in doc.get("replica_instances", [])]
+            samples = await asyncio.gather(*(
+                self._sample_container(clients[doc.get("node")], container_id) for container_id in container_ids
+            ))
+            samples = [sample for sample in samples if sample]
+            if not samples:
+                return False
+
+            deployment_id = str(doc["_id"])
+            ring = self.rings.get(deployment_id)
+            if ring is None:
+                ring = self.rings[deployment_id] = StatsRing(self.history_size)
+            ring.append(time.time(), {field: sum(sample[field] for sample in samples) for field in STAT_FIELDS})
+            self.deployments[deployment_id] = {"name": doc.get("name"), "subdomain": doc.get("subdomain"), "containers": len(container_ids)}
+            return True
+
+        results = await asyncio.gather(*(sample_deployment(doc) for doc in docs))
+        self._prune(docs)
+        return sum(1 for sampled in results if sampled)
+
+    def _prune(self, docs: List[Dict[str, Any]]):
+        """Forget containers no longer running, and deployments whose history has aged out"""
+        running_containers = set()
+        for doc in docs:
+            running_containers.add(doc["container_id"])
+            running_containers.update(instance["container_id"] for instance in doc.get("replica_instances", []))
+        for container_id in list(self._previous):
+            if container_id not in running_containers:
+                del self._previous[container_id]
+
+        running = {str(doc["_id"]) for doc in docs}
+        horizon = time.time() - self.interval * self.history_size
+        for deployment_id in list(self.rings):
+            ring = self.rings[deployment_id]
+            if deployment_id not in running and (ring.last_time < horizon):
+                del self.rings[deployment_id]
+                self.deployments.pop(deployment_id, None)
+
+    def _is_current(self, ring: StatsRing) -> bool:
+        """Sampled by one of the last passes; a stopped or deleted deployment's ring only holds history"""
+        return ring.count > 0 and ring.last_time >= time.time() - 2 * self.interval
+
+    def get_stats(self, deployment_id: str, points: int, since: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        ring = self.rings.get(deployment_id)
+        if ring is None:
+            return None
+        return {
+            "deployment_id": deployment_id,
+            **self.deployments.get(deployment_id, {}),
+            "interval": self.interval,
+            "current": ring.latest() if self._is_current(ring) else None,
+            "history": ring.history(points, since)
+        }
+
+    def top(self, field: str, limit: int) -> List[Dict[str, Any]]:
+        """Deployments still being sampled with the highest current value of `field`"""
+        current = [
+            {"deployment_id": deployment_id, **self.deployments.get(deployment_id, {}), **ring.latest()}
+            for deployment_id, ring in self.rings.items()
+            if self._is_current(ring)
+        ]
+        current.sort(key=lambda entry: entry[field], reverse=True)
+        return current[:limit]
+
+    async def run(self):
+        """Background loop started with the API"""
+        while True:
+            started = time.monotonic()
+            try:
+                await self.sample()
+            except Exception as e:
+                print(f"Stats sampler failed: {e}")
+            await asyncio.sleep(max(self.interval - (time.monotonic() - started), 0))
+
+stats_sampler = StatsSampler()
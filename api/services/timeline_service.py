@@ -0,0 +1,148 @@
+import os
+import math
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Dict, Any, List, Optional
+from models import get_database
+
+# The timeline of the pipeline running in this task, and the span currently open in it.
+# Services call span() without knowing whether anything is being recorded.
+_current_timeline: ContextVar[Optional["PipelineTimeline"]] = ContextVar("pipeline_timeline", default=None)
+_current_span: ContextVar[Optional[str]] = ContextVar("pipeline_span", default=None)
+
+class PipelineTimeline:
+    """
+    One attempt at running a pipeline (deploy, delete) for a deployment,
+    stored as a deployment_timelines document whose spans are appended as
+    each stage or sub-step finishes.
+    """
+
+    def __init__(self, deployment_id: str, kind: str, attempt: int):
+        self.deployment_id = deployment_id
+        self.kind = kind
+        self.attempt = attempt
+        self.started_at = datetime.utcnow()
+        self._started = time.monotonic()
+        self.id = None
+
+    @classmethod
+    async def start(cls, deployment_id: str, kind: str = "deploy") -> "PipelineTimeline":
+        """Open a new attempt and make it the current timeline for this task"""
+        db = get_database()
+        attempt = await db.deployment_timelines.count_documents({"deployment_id": deployment_id, "kind": kind}) + 1
+        timeline = cls(deployment_id, kind, attempt)
+        result = await db.deployment_timelines.insert_one({
+            "deployment_id": deployment_id,
+            "kind": kind,
+            "attempt": attempt,
+            "started_at": timeline.started_at,
+            "finished_at": None,
+            "outcome": None,
+            "spans": []
+        })
+        timeline.id = result.inserted_id
+        _current_timeline.set(timeline)
+        return timeline
+
+    @asynccontextmanager
+    async def span(self, name: str, **detail: Any):
+        """Time a stage; set record["status"] = "failed" inside the block for failures that don't raise"""
+        record: Dict[str, Any] = {"name": name, "parent": _current_span.get(), "status": "ok"}
+        if detail:
+            record["detail"] = detail
+        started = time.monotonic()
+        token = _current_span.set(name)
+        try:
+            yield record
+        except BaseException:
+            record["status"] = "error"
+            raise
+        finally:
+            _current_span.reset(token)
+            await self.add_span(record, started, time.monotonic())
+
+    async def add_span(self, record: Dict[str, Any], started: float, finished: float):
+        """Store a span measured with time.monotonic(), e.g. one reconstructed from build output"""
+        record["offset_ms"] = round((started - self._started) * 1000, 1)
+        record["duration_ms"] = round((finished - started) * 1000, 1)
+        record.setdefault("parent", _current_span.get())
+        record.setdefault("status", "ok")
+        try:
+            db = get_database()
+            await db.deployment_timelines.update_one({"_id": self.id}, {"$push": {"spans": record}})
+        except Exception as e:
+            print(f"Failed to record span {record['name']}: {e}")
+
+    async def finish(self, outcome: str):
+        db = get_database()
+        await db.deployment_timelines.update_one(
+            {"_id": self.id},
+            {"$set": {
+                "finished_at": datetime.utcnow(),
+                "duration_ms": round((time.monotonic() - self._started) * 1000, 1),
+                "outcome": outcome
+            }}
+        )
+        if _current_timeline.get() is self:
+            _current_timeline.set(None)
+
+def current_timeline() -> Optional[PipelineTimeline]:
+    return _current_timeline.get()
+
+@asynccontextmanager
+async def span(name: str, **detail: Any):
+    """Record a span on the current timeline, or do nothing outside an instrumented pipeline"""
+    timeline = _current_timeline.get()
+    if timeline is None:
+        yield {"name": name, "status": "ok"}
+        return
+    async with timeline.span(name, **detail) as record:
+        yield record
+
+def _percentile(sorted_values: List[float], fraction: float) -> float:
+    # Nearest-rank percentile
+    index = max(0, math.ceil(fraction * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+class TimelineService:
+    def __init__(self):
+        self.stats_window = int(os.getenv("TIMELINE_STATS_WINDOW", "100"))
+
+    async def get_timeline(self, deployment_id: str) -> List[Dict[str, Any]]:
+        db = get_database()
+        attempts = await db.deployment_timelines.find({"deployment_id": deployment_id}).sort("started_at", 1).to_list(length=None)
+        for attempt in attempts:
+            attempt["id"] = str(attempt.pop("_id"))
+        return attempts
+
+    async def stage_stats(self, kind: str = "deploy", limit: Optional[int] = None) -> Dict[str, Any]:
+        """p50/p95 duration per span name across the most recent finished attempts"""
+        db = get_database()
+        limit = limit or self.stats_window
+        attempts = await db.deployment_timelines.find(
+            {"kind": kind, "finished_at": {"$ne": None}},
+            {"spans.name": 1, "spans.parent": 1, "spans.duration_ms": 1, "duration_ms": 1}
+        ).sort("started_at", -1).limit(limit).to_list(length=limit)
+
+        durations: Dict[str, List[float]] = {}
+        parents: Dict[str, Optional[str]] = {}
+        for attempt in attempts:
+            durations.setdefault("total", []).append(attempt.get("duration_ms", 0))
+            for span_record in attempt.get("spans", []):
+                durations.setdefault(span_record["name"], []).append(span_record["duration_ms"])
+                parents.setdefault(span_record["name"], span_record.get("parent"))
+
+        stages = {}
+        for name, values in durations.items():
+            values.sort()
+            stages[name] = {
+                "parent": parents.get(name),
+                "count": len(values),
+                "p50_ms": _percentile(values, 0.5),
+                "p95_ms": _percentile(values, 0.95),
+                "max_ms": values[-1]
+            }
+
+        return {"kind": kind, "attempts": len(attempts), "stages": stages}
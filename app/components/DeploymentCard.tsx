@@ -23,6 +23,7 @@ function getStatusVariant(status: string) {
     case 'failed':
       return 'destructive'
     case 'stopped':
+    case 'hibernated':
       return 'secondary'
     default:
       return 'default'
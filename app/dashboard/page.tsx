@@ -1,6 +1,6 @@
 'use client'
 
-import { useState } from 'react'
+import { useState, useEffect } from 'react'
 import { useQuery, useMutation, useQueryClient } from '@tanstack/react-query'
 import { ProtectedRoute } from '@/app/components/ProtectedRoute'
 import { DeploymentCard } from '@/app/components/DeploymentCard'
@@ -9,7 +9,7 @@ import { Button } from '@/app/components/ui/button'
 import { Card, CardContent, CardHeader, CardTitle } from '@/app/components/ui/card'
 import { useAuth } from '@/app/hooks/useAuth'
 import { useToast } from '@/app/hooks/use-toast'
-import { deploymentsAPI, Deployment, DeploymentCreate } from '@/app/lib/api'
+import { deploymentsAPI, Deployment, DeploymentCreate, DeploymentEvent } from '@/app/lib/api'
 import { Plus, LogOut, RefreshCw } from 'lucide-react'
 
 export default function DashboardPage() {
@@ -28,9 +28,41 @@ export default function DashboardPage() {
       const response = await deploymentsAPI.list()
       return response.data
     },
-    refetchInterval: 5000, // Refetch every 5 seconds for real-time updates
+    // Live updates come from the event stream; this only catches anything it missed
+    refetchInterval: 60000,
   })
 
+  useEffect(() => {
+    // EventSource reconnects on its own and resumes from the last event id
+    const source = new EventSource(deploymentsAPI.eventsURL)
+
+    const applyStatus = (message: MessageEvent) => {
+      const event: DeploymentEvent = JSON.parse(message.data)
+      queryClient.setQueryData<Deployment[]>(['deployments'], (current) =>
+        current?.map((deployment) =>
+          deployment.id === event.deployment_id && event.status
+            ? {
+                ...deployment,
+                status: event.status,
+                time_to_ready: event.time_to_ready ?? deployment.time_to_ready,
+              }
+            : deployment
+        )
+      )
+    }
+    const refetchList = () => {
+      queryClient.invalidateQueries({ queryKey: ['deployments'] })
+    }
+
+    source.addEventListener('status', applyStatus)
+    source.addEventListener('created', refetchList)
+    source.addEventListener('deleted', refetchList)
+    source.addEventListener('updated', refetchList)
+    source.addEventListener('reset', refetchList)
+
+    return () => source.close()
+  }, [queryClient])
+
   const createDeploymentMutation = useMutation({
     mutationFn: async (deployment: DeploymentCreate) => {
       const response = await deploymentsAPI.create(deployment)
@@ -47,21 +47,38 @@ export interface User {
   is_active: boolean
 }
 
+export interface ResourceProfile {
+  cpus: number
+  memory_mb: number
+  pids: number
+}
+
 export interface Deployment {
   id: string
   name: string
   github_url: string
   subdomain: string
   port: number
-  status: 'pending' | 'building' | 'running' | 'failed' | 'stopped'
+  status: 'pending' | 'building' | 'running' | 'failed' | 'stopped' | 'hibernated'
   created_at: string
   updated_at: string
+  resources?: ResourceProfile
+  node?: string | null
+  time_to_ready?: number | null
+  scale_to_zero?: boolean
+  last_request_at?: string | null
+  replicas?: number
+  replica_ports?: number[]
 }
 
 export interface DeploymentCreate {
   github_url: string
   subdomain: string
   env_vars?: Record<string, string>
+  resources?: ResourceProfile
+  readiness_path?: string
+  scale_to_zero?: boolean
+  replicas?: number
 }
 
 export interface LogEntry {
@@ -78,12 +95,59 @@ export const authAPI = {
   logout: () => api.post('/auth/logout'),
 }
 
+export interface DeploymentEvent {
+  id: number
+  type: 'status' | 'created' | 'deleted' | 'updated' | 'stage' | 'reset'
+  deployment_id: string | null
+  timestamp: string
+  status?: Deployment['status']
+  stage?: 'clone' | 'build' | 'run' | 'readiness' | 'nginx' | 'cloudflare'
+  time_to_ready?: number
+}
+
+export interface LogSearchResult {
+  id: string
+  deployment_id: string
+  deployment_name: string | null
+  subdomain: string | null
+  log_level: string
+  timestamp: string
+  snippet: string
+  highlights: [number, number][]
+}
+
+export interface LogSearchParams {
+  q: string
+  level?: string[]
+  deployment_id?: string
+  since?: string
+  until?: string
+  limit?: number
+  cursor?: string
+}
+
+export interface DeploymentListParams {
+  status?: Deployment['status']
+  name_prefix?: string
+  sort?: 'created_at' | 'updated_at' | 'name' | 'subdomain'
+  order?: 'asc' | 'desc'
+  limit?: number
+  cursor?: string
+}
+
 // Deployments API
 export const deploymentsAPI = {
-  list: () => api.get<Deployment[]>('/deployments/'),
+  // The next page's cursor comes back in the X-Next-Cursor header
+  list: (params?: DeploymentListParams) => api.get<Deployment[]>('/deployments/', { params }),
   create: (deployment: DeploymentCreate) => api.post<Deployment>('/deployments/', deployment),
   get: (id: string) => api.get<Deployment>(`/deployments/${id}`),
   delete: (id: string) => api.delete(`/deployments/${id}`),
   getLogs: (id: string) => api.get<LogEntry[]>(`/deployments/${id}/logs`),
+  // Repeated level params (level=error&level=warning), as FastAPI expects
+  searchLogs: (params: LogSearchParams) =>
+    api.get<LogSearchResult[]>('/deployments/logs/search', { params, paramsSerializer: { indexes: null } }),
+  scale: (id: string, replicas: number) => api.post(`/deployments/${id}/scale`, { replicas }),
+  // Server-sent events; same-origin, so the access_token cookie authenticates the stream
+  eventsURL: `${API_URL}/deployments/events`,
   getStatus: (id: string) => api.get<{id: string, status: string, updated_at: string}>(`/deployments/${id}/status`),
 }
\ No newline at end of file
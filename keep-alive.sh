@@ -20,7 +20,7 @@ while true; do
         if ! kill -0 "$BACKEND_PID" 2>/dev/null || ! sudo netstat -tuln | grep -q :8000; then
             echo "$(date): ❌ Backend died, restarting..."
             cd api
-            nohup poetry run uvicorn main:app --host 0.0.0.0 --port 8000 --reload > ../logs/backend.log 2>&1 &
+            nohup poetry run uvicorn main:app --host 0.0.0.0 --port 8000 --workers ${API_WORKERS:-1} > ../logs/backend.log 2>&1 &
             echo $! > ../logs/backend.pid
             cd ..
             RESTART_NEEDED=true
@@ -28,7 +28,7 @@ while true; do
     else
         echo "$(date): ❌ Backend not running, starting..."
         cd api
-        nohup poetry run uvicorn main:app --host 0.0.0.0 --port 8000 --reload > ../logs/backend.log 2>&1 &
+        nohup poetry run uvicorn main:app --host 0.0.0.0 --port 8000 --workers ${API_WORKERS:-1} > ../logs/backend.log 2>&1 &
         echo $! > ../logs/backend.pid
         cd ..
         RESTART_NEEDED=true